@@ -0,0 +1,254 @@
+"""Рассылка изменений записей открытым представлениям через Server-Sent Events."""
+
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Any, Iterator, List, Optional, Set, Tuple
+
+from change_log import CHANGE_INSERT, CHANGE_UPDATE, CHANGE_DELETE, CHANGE_RESET
+
+# Пределы числа потоков событий: всего на сервер и на одного пользователя
+# (каждый открытый поток занимает поток сервера)
+DEFAULT_MAX_STREAMS = 100
+DEFAULT_MAX_STREAMS_PER_USER = 5
+
+# Сколько неотправленных событий держится для одного клиента; если клиент не
+# успевает их забирать, очередь сбрасывается и он получает событие reset
+DEFAULT_QUEUE_SIZE = 256
+
+# Интервал (в секундах) пустых сообщений, по которым обнаруживаются отключившиеся
+# клиенты; заодно перепроверяются права пользователя
+DEFAULT_HEARTBEAT = 15.0
+
+# Статистика отправляется клиенту не чаще одного раза за столько секунд
+STATISTICS_INTERVAL = 1.0
+
+# Через сколько миллисекунд браузер переподключается после обрыва
+RECONNECT_MS = 3000
+
+
+class TooManyStreamsError(Exception):
+    """Превышен лимит одновременных потоков событий."""
+
+
+def _json_dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def sse_frame(event: str, data: Any, dumps: Callable[[Any], str] = _json_dumps) -> str:
+    """Сообщение SSE: имя события и данные JSON одной строкой."""
+    return f"event: {event}\ndata: {dumps(data)}\n\n"
+
+
+class _Stream:
+    """Ограниченная очередь сообщений одного клиента."""
+
+    def __init__(self, data_type_id: int, user_id: int, queue_size: int):
+        self.data_type_id = data_type_id
+        self.user_id = user_id
+        self.queue_size = queue_size
+        self.opened_at = time.time()
+        self._condition = threading.Condition()
+        self._frames: deque = deque()
+        self._overflowed = False
+        self._closed = False
+
+    def push(self, frame: str) -> bool:
+        """Сообщение в очередь; False, если очередь переполнена и сброшена."""
+        with self._condition:
+            if self._overflowed or self._closed:
+                return False
+            if len(self._frames) >= self.queue_size:
+                # Медленный клиент не задерживает запись и не копит память:
+                # вместо пропущенных событий он перезагрузит данные целиком
+                self._frames.clear()
+                self._overflowed = True
+                self._condition.notify()
+                return False
+            self._frames.append(frame)
+            self._condition.notify()
+            return True
+
+    def take(self, timeout: float) -> Tuple[List[str], bool]:
+        """Все накопившиеся сообщения (ожидание не дольше timeout) и признак переполнения."""
+        with self._condition:
+            if not self._frames and not self._overflowed and not self._closed:
+                self._condition.wait(max(timeout, 0))
+            frames = list(self._frames)
+            self._frames.clear()
+            overflowed, self._overflowed = self._overflowed, False
+            return frames, overflowed
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+
+class ChangeBroadcaster:
+    """Рассылка изменений записей справочника всем открытым потокам событий.
+
+    Подписывается на изменения DatabaseManager. Событие change (вид
+    изменения и текущая запись) кодируется один раз и раскладывается по
+    очередям клиентов; запись читается из базы, только если у справочника
+    есть клиенты. Поток клиента отправляет накопившиеся события пачкой и
+    после них - статистику справочника (не чаще STATISTICS_INTERVAL).
+    Статистика считается один раз на версию данных для всех клиентов.
+    Переполненная очередь медленного клиента сбрасывается, клиент получает
+    событие reset и перезагружает данные сам.
+    """
+
+    def __init__(self, db, max_streams: int = DEFAULT_MAX_STREAMS,
+                 max_streams_per_user: int = DEFAULT_MAX_STREAMS_PER_USER,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, heartbeat: float = DEFAULT_HEARTBEAT,
+                 dumps: Callable[[Any], str] = _json_dumps):
+        self.db = db
+        self.max_streams = max_streams
+        self.max_streams_per_user = max_streams_per_user
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.dumps = dumps
+        self._lock = threading.Lock()
+        self._streams: Dict[int, Set[_Stream]] = {}
+        self._statistics: Dict[int, Tuple[int, str]] = {}
+        self._statistics_locks: Dict[int, threading.Lock] = {}
+        self._published = 0
+        self._delivered = 0
+        self._overflows = 0
+        self._rejected = 0
+        self._statistics_computed = 0
+        db.add_change_listener(self.publish)
+
+    def _all_streams(self) -> List[_Stream]:
+        return [stream for streams in self._streams.values() for stream in streams]
+
+    def open(self, data_type_id: int, user_id: int) -> _Stream:
+        """Регистрация нового клиента; при превышении лимитов - TooManyStreamsError."""
+        with self._lock:
+            streams = self._all_streams()
+            if len(streams) >= self.max_streams:
+                self._rejected += 1
+                raise TooManyStreamsError("Слишком много открытых потоков событий, попробуйте позже")
+            if sum(1 for stream in streams if stream.user_id == user_id) >= self.max_streams_per_user:
+                self._rejected += 1
+                raise TooManyStreamsError(
+                    f"Открыто слишком много потоков событий (не более {self.max_streams_per_user} на пользователя)"
+                )
+            stream = _Stream(data_type_id, user_id, self.queue_size)
+            self._streams.setdefault(data_type_id, set()).add(stream)
+            return stream
+
+    def close(self, stream: _Stream):
+        stream.close()
+        with self._lock:
+            streams = self._streams.get(stream.data_type_id)
+            if streams is not None:
+                streams.discard(stream)
+                if not streams:
+                    del self._streams[stream.data_type_id]
+                    self._statistics.pop(stream.data_type_id, None)
+
+    def publish(self, data_type_id: int, op: str, record_id: Optional[int] = None):
+        """Обработчик изменения записи (вызывается после фиксации транзакции)."""
+        with self._lock:
+            streams = list(self._streams.get(data_type_id, ()))
+        if not streams:
+            return
+
+        if op in (CHANGE_INSERT, CHANGE_UPDATE) and record_id is not None:
+            record = self.db.get_data_records_by_id(data_type_id, [record_id]).get(record_id)
+            frame = sse_frame('change', {'op': op, 'record_id': record_id, 'record': record}, self.dumps)
+        elif op == CHANGE_DELETE:
+            frame = sse_frame('change', {'op': op, 'record_id': record_id}, self.dumps)
+        else:
+            frame = sse_frame('reset', {'reason': op}, self.dumps)
+
+        delivered = overflows = 0
+        for stream in streams:
+            if stream.push(frame):
+                delivered += 1
+            elif not stream.closed:
+                overflows += 1
+        with self._lock:
+            self._published += 1
+            self._delivered += delivered
+            self._overflows += overflows
+
+    def statistics_frame(self, data_type_id: int) -> str:
+        """Сообщение со статистикой справочника, общее для всех клиентов одной версии данных."""
+        with self._lock:
+            type_lock = self._statistics_locks.setdefault(data_type_id, threading.Lock())
+        # Один расчет на версию: остальные клиенты ждут его и берут готовый результат
+        # Версия и статистика - из одного снимка: кэш не подменит новую версию старым расчетом
+        with type_lock, self.db.read_snapshot():
+            version, _ = self.db.get_data_version(data_type_id)
+            with self._lock:
+                cached = self._statistics.get(data_type_id)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            frame = sse_frame('statistics', self.db.get_data_statistics(data_type_id), self.dumps)
+            with self._lock:
+                self._statistics_computed += 1
+                if data_type_id in self._streams:
+                    self._statistics[data_type_id] = (version, frame)
+            return frame
+
+    def stream(self, stream: _Stream, still_allowed: Callable[[], bool]) -> Iterator[str]:
+        """Сообщения SSE для клиента до отключения или отзыва прав.
+
+        still_allowed проверяется при каждом пустом сообщении; клиент
+        отключается, как только права на чтение справочника отозваны.
+        """
+        try:
+            yield f"retry: {RECONNECT_MS}\n" + sse_frame('ready', {'data_type_id': stream.data_type_id}, self.dumps)
+            last_heartbeat = last_statistics = time.monotonic()
+            statistics_due = False
+            while True:
+                now = time.monotonic()
+                timeout = last_heartbeat + self.heartbeat - now
+                if statistics_due:
+                    timeout = min(timeout, last_statistics + STATISTICS_INTERVAL - now)
+                frames, overflowed = stream.take(timeout)
+                if stream.closed:
+                    return
+                if overflowed:
+                    frames = [sse_frame('reset', {'reason': 'overflow'}, self.dumps)]
+                if frames:
+                    statistics_due = True
+                    yield ''.join(frames)
+
+                now = time.monotonic()
+                if statistics_due and now - last_statistics >= STATISTICS_INTERVAL:
+                    statistics_due = False
+                    last_statistics = now
+                    yield self.statistics_frame(stream.data_type_id)
+                if now - last_heartbeat >= self.heartbeat:
+                    last_heartbeat = now
+                    if not still_allowed():
+                        yield sse_frame('close', {'reason': 'forbidden'}, self.dumps)
+                        return
+                    # Комментарий SSE: при отключенном клиенте запись в сокет завершит генератор
+                    yield ': ping\n\n'
+        finally:
+            self.close(stream)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики потоков и событий."""
+        with self._lock:
+            return {
+                'streams': sum(len(streams) for streams in self._streams.values()),
+                'data_types': len(self._streams),
+                'max_streams': self.max_streams,
+                'max_streams_per_user': self.max_streams_per_user,
+                'queue_size': self.queue_size,
+                'published': self._published,
+                'delivered': self._delivered,
+                'overflows': self._overflows,
+                'rejected': self._rejected,
+                'statistics_computed': self._statistics_computed
+            }
@@ -0,0 +1,201 @@
+"""Журнал изменений записей справочников для инкрементальной синхронизации клиентов."""
+
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+# Виды изменений: записи и служебные отметки (record_id пуст)
+CHANGE_INSERT = 'insert'
+CHANGE_UPDATE = 'update'
+CHANGE_DELETE = 'delete'
+CHANGE_SCHEMA = 'schema'  # изменились поля справочника
+CHANGE_RESET = 'reset'    # записи изменены в обход журнала (офлайн-загрузка): нужна полная перезагрузка
+
+# Сколько изменений по умолчанию и максимум отдает один запрос
+DEFAULT_CHANGES_LIMIT = 1000
+MAX_CHANGES_LIMIT = 10000
+
+# Сжатие журнала: срок хранения и предел числа изменений одного справочника
+CHANGE_RETENTION_SECONDS = 30 * 24 * 3600
+MAX_CHANGES_PER_TYPE = 100000
+
+# Сжатие запускается после стольких новых изменений справочника
+COMPACT_EVERY = 10000
+
+# Время в секундах Unix с дробной частью средствами SQLite
+_NOW_SQL = "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+def _triggers(table_name: str) -> List[str]:
+    return [f"{table_name}_changes_{kind}" for kind in ('insert', 'update', 'delete')]
+
+
+class ChangeLog:
+    """Журнал изменений в таблице data_changes.
+
+    Строки добавляются триггерами таблиц данных, поэтому в журнал попадает
+    любое изменение записей, в том числе пакетная вставка и импорт CSV.
+    Номер изменения seq растет монотонно для всех справочников.
+
+    Сжатие оставляет по каждой записи только последнее изменение и удаляет
+    изменения старше срока хранения (или сверх предела числа изменений).
+    Номер последнего удаленного изменения запоминается в data_changes_floor:
+    клиенту, который запрашивает изменения с более раннего номера, нужна
+    полная перезагрузка.
+    """
+
+    CREATE_SQL = (
+        '''
+        CREATE TABLE IF NOT EXISTS data_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            data_type_id INTEGER NOT NULL,
+            record_id INTEGER,
+            op TEXT NOT NULL,
+            changed_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_data_changes_type_seq
+        ON data_changes (data_type_id, seq)
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS data_changes_floor (
+            data_type_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+        ''',
+    )
+
+    def __init__(self):
+        self._pending: Dict[int, int] = {}
+
+    def create_table_with_cursor(self, cursor):
+        for sql in self.CREATE_SQL:
+            cursor.execute(sql)
+
+    def create_triggers_with_cursor(self, cursor, data_type_id: int):
+        """Триггеры таблицы данных, записывающие изменения в журнал."""
+        table_name = f"data_{data_type_id}"
+        insert_trigger, update_trigger, delete_trigger = _triggers(table_name)
+        for trigger, event, row, op in (
+            (insert_trigger, 'INSERT', 'new', CHANGE_INSERT),
+            (update_trigger, 'UPDATE', 'new', CHANGE_UPDATE),
+            (delete_trigger, 'DELETE', 'old', CHANGE_DELETE),
+        ):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event} ON {table_name}
+                BEGIN
+                    INSERT INTO data_changes (data_type_id, record_id, op, changed_at)
+                    VALUES ({int(data_type_id)}, {row}.id, '{op}', {_NOW_SQL});
+                END
+            ''')
+
+    def drop_triggers_with_cursor(self, cursor, data_type_id: int):
+        for trigger in _triggers(f"data_{data_type_id}"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    def record_with_cursor(self, cursor, data_type_id: int, op: str):
+        """Служебная отметка в журнале (изменение схемы, полная перезагрузка)."""
+        cursor.execute(
+            'INSERT INTO data_changes (data_type_id, record_id, op, changed_at) VALUES (?, NULL, ?, ?)',
+            (data_type_id, op, time.time())
+        )
+
+    def delete_with_cursor(self, cursor, data_type_id: int):
+        for table in ('data_changes', 'data_changes_floor'):
+            cursor.execute(f"DELETE FROM {table} WHERE data_type_id = ?", (data_type_id,))
+
+    def note_changes(self, data_type_id: int, count: int = 1) -> bool:
+        """Учет новых изменений; True, когда пора сжать журнал справочника."""
+        pending = self._pending.get(data_type_id, 0) + count
+        if pending >= COMPACT_EVERY:
+            self._pending[data_type_id] = 0
+            return True
+        self._pending[data_type_id] = pending
+        return False
+
+    def get_floor_with_cursor(self, cursor, data_type_id: int) -> int:
+        cursor.execute('SELECT seq FROM data_changes_floor WHERE data_type_id = ?', (data_type_id,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def get_changes_with_cursor(self, cursor, data_type_id: int, since: int,
+                                limit: int) -> Tuple[List[tuple], bool, int, int]:
+        """Изменения справочника с номером больше since.
+
+        Возвращает (изменения, есть ли еще, номер для следующего запроса,
+        последний номер в журнале). Изменения - кортежи (seq, record_id, op,
+        changed_at); из нескольких изменений одной записи в пределах страницы
+        остается последнее.
+        """
+        cursor.execute('''
+            SELECT seq, record_id, op, changed_at FROM data_changes
+            WHERE data_type_id = ? AND seq > ?
+            ORDER BY seq
+            LIMIT ?
+        ''', (data_type_id, since, limit + 1))
+        rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        latest: Dict[Any, tuple] = {}
+        for row in rows:
+            # Служебные отметки не схлопываются
+            latest[row[1] if row[1] is not None else ('mark', row[0])] = row
+        changes = sorted(latest.values(), key=lambda row: row[0])
+
+        cursor.execute('SELECT MAX(seq) FROM data_changes WHERE data_type_id = ?', (data_type_id,))
+        last_seq = cursor.fetchone()[0] or 0
+        last_seq = max(last_seq, self.get_floor_with_cursor(cursor, data_type_id))
+        # Транзакции записи в SQLite идут по одной, поэтому номера фиксируются
+        # по возрастанию: все следующие изменения будут больше последнего полученного
+        next_since = rows[-1][0] if rows else since
+        return changes, has_more, next_since, last_seq
+
+    def compact_with_cursor(self, cursor, data_type_id: int,
+                            retention_seconds: float = CHANGE_RETENTION_SECONDS,
+                            max_entries: int = MAX_CHANGES_PER_TYPE) -> Dict[str, Any]:
+        """Сжатие журнала справочника; возвращает число удаленных изменений и новую границу."""
+        # По каждой записи достаточно последнего изменения: клиенту нужно
+        # текущее состояние записи, а не история
+        cursor.execute('''
+            DELETE FROM data_changes
+            WHERE data_type_id = ? AND record_id IS NOT NULL AND seq NOT IN (
+                SELECT MAX(seq) FROM data_changes
+                WHERE data_type_id = ? AND record_id IS NOT NULL
+                GROUP BY record_id
+            )
+        ''', (data_type_id, data_type_id))
+        deduplicated = cursor.rowcount
+
+        # Изменения до последней полной перезагрузки клиенту не помогут
+        cursor.execute('''
+            SELECT MAX(seq) FROM data_changes WHERE data_type_id = ? AND op = ?
+        ''', (data_type_id, CHANGE_RESET))
+        cutoff = (cursor.fetchone()[0] or 1) - 1
+
+        cursor.execute('''
+            SELECT MAX(seq) FROM data_changes WHERE data_type_id = ? AND changed_at < ?
+        ''', (data_type_id, time.time() - retention_seconds))
+        cutoff = max(cutoff, cursor.fetchone()[0] or 0)
+
+        cursor.execute('''
+            SELECT seq FROM data_changes WHERE data_type_id = ?
+            ORDER BY seq DESC LIMIT 1 OFFSET ?
+        ''', (data_type_id, max_entries))
+        row = cursor.fetchone()
+        if row:
+            cutoff = max(cutoff, row[0])
+
+        expired = 0
+        if cutoff > 0:
+            cursor.execute('DELETE FROM data_changes WHERE data_type_id = ? AND seq <= ?', (data_type_id, cutoff))
+            expired = cursor.rowcount
+            if expired:
+                cursor.execute('''
+                    INSERT INTO data_changes_floor (data_type_id, seq) VALUES (?, ?)
+                    ON CONFLICT (data_type_id) DO UPDATE SET seq = MAX(seq, excluded.seq)
+                ''', (data_type_id, cutoff))
+        return {
+            'removed': deduplicated + expired,
+            'floor': self.get_floor_with_cursor(cursor, data_type_id)
+        }
@@ -0,0 +1,236 @@
+"""Пул соединений SQLite для DatabaseManager."""
+
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Any, Iterable, Optional
+
+
+# PRAGMA выполняются один раз при создании соединения, а не при каждой выдаче из пула
+DEFAULT_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=30000",  # 30 секунд таймаут
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA cache_size=10000",
+    # После контрольной точки файл WAL усекается до 64 МБ, а не остается
+    # размером с самую длинную транзакцию чтения
+    "PRAGMA journal_size_limit=67108864",
+)
+
+
+# PRAGMA соединений только для чтения (аналитика, экспорт): запись запрещена
+# на уровне соединения, файл базы читается через mmap (размер задается отдельно)
+READ_ONLY_PRAGMAS = (
+    "PRAGMA query_only=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA cache_size=10000",
+)
+
+# Размер отображения файла базы в память для соединений чтения, байт
+DEFAULT_READ_MMAP_SIZE = 256 * 1024 * 1024
+
+
+def connect_read_only(db_path: str, timeout: float = 30.0,
+                      mmap_size: int = DEFAULT_READ_MMAP_SIZE,
+                      factory: type = sqlite3.Connection) -> sqlite3.Connection:
+    """Соединение только для чтения (mode=ro, query_only) с отображением файла в память."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=timeout, check_same_thread=False,
+                           factory=factory)
+    try:
+        for pragma in READ_ONLY_PRAGMAS + (f"PRAGMA mmap_size={int(mmap_size)}",):
+            conn.execute(pragma)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Не удалось получить соединение из пула за отведенное время."""
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений SQLite ограниченного размера."""
+
+    def __init__(self, db_path: str, max_size: int = 8, timeout: float = 30.0,
+                 pragmas: Iterable[str] = DEFAULT_PRAGMAS,
+                 initializer: Optional[Callable[[sqlite3.Connection], None]] = None):
+        """Инициализация пула (соединения создаются лениво).
+        
+        initializer вызывается для каждого нового соединения (регистрация функций SQL).
+        """
+        if max_size < 1:
+            raise ValueError("Размер пула должен быть не меньше 1")
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = tuple(pragmas)
+        self.initializer = initializer
+        # Класс соединения (подкласс sqlite3.Connection, например со счетчиками запросов)
+        self.factory = sqlite3.Connection
+
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        # Счетчики для статистики
+        self._created = 0
+        self._closed = 0
+        self._acquired = 0
+        self._reused = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+
+    def _open(self) -> sqlite3.Connection:
+        return sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            factory=self.factory
+        )
+
+    def _create_connection(self, extra_pragmas: Iterable[str] = ()) -> sqlite3.Connection:
+        """Открытие нового соединения с применением PRAGMA."""
+        conn = self._open()
+        try:
+            for pragma in self.pragmas + tuple(extra_pragmas):
+                conn.execute(pragma)
+            if self.initializer:
+                self.initializer(conn)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def connect_dedicated(self, extra_pragmas: Iterable[str] = ()) -> sqlite3.Connection:
+        """Отдельное соединение с настройками пула вне его учета (для фоновых потоков).
+
+        Закрывает соединение вызывающий; extra_pragmas применяются после PRAGMA пула.
+        """
+        return self._create_connection(extra_pragmas)
+
+    def acquire(self, timeout: Optional[float] = None) -> sqlite3.Connection:
+        """Получение соединения из пула; при исчерпании пула ожидает освобождения."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waited_from = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._reused += 1
+                    break
+                if self._size < self.max_size:
+                    # Резервируем место, само соединение создаем вне блокировки
+                    self._size += 1
+                    conn = None
+                    break
+
+                if waited_from is None:
+                    waited_from = time.monotonic()
+                    self._waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    self._wait_time += time.monotonic() - waited_from
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений в пуле (размер {self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+            if waited_from is not None:
+                self._wait_time += time.monotonic() - waited_from
+            self._acquired += 1
+            self._in_use += 1
+
+        if conn is None:
+            try:
+                conn = self._create_connection()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False):
+        """Возврат соединения в пул (незавершенная транзакция откатывается)."""
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self._closed += 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+        if discard:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def close_all(self):
+        """Закрытие всех простаивающих соединений."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._closed += len(idle)
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика использования пула."""
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'created': self._created,
+                'closed': self._closed,
+                'acquired': self._acquired,
+                'reused': self._reused,
+                'waits': self._waits,
+                'wait_time_seconds': round(self._wait_time, 6),
+                'timeouts': self._timeouts,
+            }
+
+
+class ReadOnlyConnectionPool(ConnectionPool):
+    """Пул соединений только для чтения (см. connect_read_only).
+
+    Длинные чтения (списки записей, статистика, экспорт) идут через
+    отдельные соединения и не занимают соединения записи; записать через
+    них ничего нельзя даже по ошибке.
+    """
+
+    def __init__(self, db_path: str, max_size: int = 8, timeout: float = 30.0,
+                 mmap_size: int = DEFAULT_READ_MMAP_SIZE,
+                 initializer: Optional[Callable[[sqlite3.Connection], None]] = None):
+        super().__init__(db_path, max_size=max_size, timeout=timeout, pragmas=(), initializer=initializer)
+        self.mmap_size = mmap_size
+
+    def _open(self) -> sqlite3.Connection:
+        return connect_read_only(self.db_path, self.timeout, self.mmap_size, self.factory)
@@ -0,0 +1,106 @@
+"""Потоковое чтение CSV для импорта записей в справочник."""
+
+import csv
+import io
+import itertools
+import re
+from typing import Dict, Any, Iterator, List, Optional, Union
+
+from record_validation import RecordValidationError
+
+# Разделители, которые распознаются по строке заголовка
+CSV_DELIMITERS = (',', ';', '\t')
+
+# Суффикс " (описание)" в заголовках, выгруженных с описаниями полей
+DESCRIPTION_SUFFIX = re.compile(r'\s*\(.*\)\s*$')
+
+# Размер буфера чтения тела запроса
+READ_BUFFER_SIZE = 64 * 1024
+
+# Предел длины одного поля CSV (защита от файла без закрывающей кавычки)
+MAX_FIELD_SIZE = 1024 * 1024
+
+
+class CsvImportError(ValueError):
+    """Файл нельзя импортировать (нет заголовка, нет подходящих колонок и т.п.)."""
+
+
+def open_text_stream(stream, encoding: str = 'utf-8-sig') -> io.TextIOBase:
+    """Текстовый поток поверх бинарного потока запроса или загруженного файла.
+
+    BOM (который пишет наш экспорт для Excel) отбрасывается кодировкой utf-8-sig.
+    """
+    if not isinstance(stream, io.BufferedIOBase):
+        stream = io.BufferedReader(stream, READ_BUFFER_SIZE)
+    return io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+
+
+def detect_delimiter(header_line: str) -> str:
+    """Разделитель - тот из допустимых, что чаще встречается в заголовке."""
+    counts = {delimiter: header_line.count(delimiter) for delimiter in CSV_DELIMITERS}
+    best = max(CSV_DELIMITERS, key=lambda delimiter: counts[delimiter])
+    return best if counts[best] else ','
+
+
+def _normalize_header(header: str) -> str:
+    return DESCRIPTION_SUFFIX.sub('', header.strip()).strip().lower()
+
+
+class CsvRecordReader:
+    """Записи CSV-файла в виде словарей {имя поля: строковое значение}.
+
+    Колонки сопоставляются с полями справочника по заголовку без учета регистра;
+    заголовки вида "поле (описание)" из нашего экспорта тоже распознаются.
+    Неизвестные колонки пропускаются. Пустые ячейки в запись не попадают,
+    поэтому проверка обязательных полей срабатывает и для них. Строки читаются
+    по одной, и файл целиком в памяти не держится.
+    """
+
+    def __init__(self, text: io.TextIOBase, fields: List[Dict[str, Any]],
+                 delimiter: Optional[str] = None):
+        header_line = text.readline()
+        if not header_line.strip():
+            raise CsvImportError("Файл пуст или не содержит заголовка")
+        self.delimiter = delimiter or detect_delimiter(header_line)
+
+        csv.field_size_limit(MAX_FIELD_SIZE)
+        self._reader = csv.reader(itertools.chain([header_line], text), delimiter=self.delimiter)
+        headers = next(self._reader)
+
+        by_name = {field['field_name'].lower(): field['field_name'] for field in fields}
+        self.columns: List[Optional[str]] = []
+        self.ignored_columns: List[str] = []
+        seen = set()
+        for header in headers:
+            field_name = by_name.get(_normalize_header(header))
+            if field_name is None or field_name in seen:
+                self.columns.append(None)
+                if header.strip():
+                    self.ignored_columns.append(header)
+                continue
+            seen.add(field_name)
+            self.columns.append(field_name)
+
+        self.mapped_fields = [name for name in self.columns if name]
+        if not self.mapped_fields:
+            raise CsvImportError("Ни одна колонка файла не соответствует полям справочника")
+        missing = [field['field_name'] for field in fields
+                   if field.get('is_required') and field['field_name'] not in seen]
+        if missing:
+            raise CsvImportError(f"В файле нет обязательных колонок: {', '.join(missing)}")
+
+    def __iter__(self) -> Iterator[Union[Dict[str, str], RecordValidationError]]:
+        width = len(self.columns)
+        mapped = [(index, name) for index, name in enumerate(self.columns) if name]
+        try:
+            for row in self._reader:
+                if not row or (len(row) == 1 and not row[0].strip()):
+                    # Пустые строки пропускаются (в том числе в конце файла)
+                    continue
+                if len(row) > width and any(value.strip() for value in row[width:]):
+                    yield RecordValidationError({'_record': f'значений больше, чем колонок ({len(row)} > {width})'})
+                    continue
+                yield {name: row[index] for index, name in mapped
+                       if index < len(row) and row[index].strip()}
+        except csv.Error as e:
+            yield RecordValidationError({'_record': f'ошибка разбора CSV: {e}'})
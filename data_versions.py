@@ -0,0 +1,62 @@
+"""Версии данных справочников для условных запросов (ETag, Last-Modified)."""
+
+import time
+from typing import Optional, Tuple
+
+
+class DataVersions:
+    """Счетчик изменений каждого справочника в таблице data_versions.
+
+    Версия увеличивается в той же транзакции, что и изменение записей или
+    схемы справочника, поэтому она общая для всех процессов (сервер, офлайн-
+    загрузка, утилиты) и сохраняется после перезапуска. Проверка версии -
+    один поиск по первичному ключу.
+    """
+
+    CREATE_SQL = '''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            data_type_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            modified_at REAL NOT NULL
+        )
+    '''
+
+    BUMP_SQL = '''
+        INSERT INTO data_versions (data_type_id, version, modified_at)
+        VALUES (?, 1, ?)
+        ON CONFLICT (data_type_id)
+        DO UPDATE SET version = version + 1, modified_at = excluded.modified_at
+    '''
+
+    def create_table_with_cursor(self, cursor):
+        cursor.execute(self.CREATE_SQL)
+        # Справочники, созданные до появления таблицы версий
+        cursor.execute(
+            'INSERT OR IGNORE INTO data_versions (data_type_id, version, modified_at) '
+            'SELECT id, 1, ? FROM data_types',
+            (time.time(),)
+        )
+
+    def bump_with_cursor(self, cursor, data_type_id: int):
+        """Новая версия справочника (вызывается внутри транзакции изменения)."""
+        cursor.execute(self.BUMP_SQL, (data_type_id, time.time()))
+
+    def bump_all_with_cursor(self, cursor):
+        """Новая версия всех справочников (например, после изменения пользователей,
+        чьи имена выводятся в записях)."""
+        cursor.execute(
+            'UPDATE data_versions SET version = version + 1, modified_at = ?',
+            (time.time(),)
+        )
+
+    def delete_with_cursor(self, cursor, data_type_id: int):
+        cursor.execute('DELETE FROM data_versions WHERE data_type_id = ?', (data_type_id,))
+
+    def get_with_cursor(self, cursor, data_type_id: int) -> Tuple[int, Optional[float]]:
+        """(версия, время изменения в секундах Unix); для справочника без изменений - (0, None)."""
+        cursor.execute(
+            'SELECT version, modified_at FROM data_versions WHERE data_type_id = ?',
+            (data_type_id,)
+        )
+        row = cursor.fetchone()
+        return (row[0], row[1]) if row else (0, None)
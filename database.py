@@ -1,32 +1,237 @@
 """Модуль для работы с базой данных SQLite."""
 
+import atexit
 import sqlite3
 import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Iterable, Iterator, Optional, Sequence, Tuple
+
+from connection_pool import ConnectionPool, ReadOnlyConnectionPool, DEFAULT_READ_MMAP_SIZE
+from schema_catalog import SchemaCatalog
+from permission_cache import PermissionCache
+from schema_migration import DataTableMigrator
+from record_query import RecordQueryCompiler
+from statistics_engine import compute_statistics, DEFAULT_PERCENTILES
+from statistics_summary import StatisticsSummary
+from exports import export_rows_query, iter_row_batches
+from record_validation import RecordValidator, RecordValidationError
+from geo_clustering import GeoClusterer
+from data_versions import DataVersions
+from schema_changes import SchemaChangeExecutor
+from summary_refresh import SummaryRefresher
+from group_commit import GroupCommitWriter, DEFAULT_MAX_BATCH, DEFAULT_MAX_DELAY, DEFAULT_SYNCHRONOUS, SYNCHRONOUS_MODES
+from change_log import (
+    ChangeLog, CHANGE_INSERT, CHANGE_UPDATE, CHANGE_DELETE, CHANGE_RESET, CHANGE_SCHEMA, DEFAULT_CHANGES_LIMIT
+)
+from response_encoding import columnar_records
+from spatial_index import (
+    coordinate_columns, storage_columns, split_coordinates, join_coordinates,
+    create_spatial_index_with_cursor, drop_stale_spatial_indexes_with_cursor,
+    migrate_legacy_coordinates_with_cursor, needs_coordinate_migration_with_cursor,
+    rtree_table, longitude_ranges, radius_bbox, haversine_distance,
+    DEFAULT_WITHIN_LIMIT
+)
+
+# Размер пачки записей при пакетной вставке (одна executemany на пачку)
+BULK_BATCH_SIZE = 1000
+
+# Сколько ошибок по строкам возвращать в отчете о пакетной вставке
+MAX_REPORTED_ERRORS = 1000
+
+
+class _ConnectionLease:
+    """Контекст выдачи соединения: повторно использует соединение, закрепленное за потоком.
+
+    read_only=True - соединение из пула чтения; транзакцию такого соединения
+    (снимок, см. DatabaseManager.read_snapshot) выдача не завершает.
+    """
+
+    def __init__(self, manager: 'DatabaseManager', timeout: float, read_only: bool = False):
+        self._manager = manager
+        self._timeout = timeout
+        self._read_only = read_only
+        self._pool = manager.read_pool if read_only else manager.pool
+        self._local = manager._read_local if read_only else manager._local
+
+    def __enter__(self) -> sqlite3.Connection:
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = self._pool.acquire(timeout=self._timeout)
+            local.conn = conn
+            local.depth = 0
+            local.failed = False
+        else:
+            self._manager._count_lease_reuse()
+        local.depth += 1
+        return conn
+
+    def __exit__(self, exc_type, exc, tb):
+        local = self._local
+        conn = local.conn
+        local.depth -= 1
+        if exc_type is not None:
+            local.failed = True
+        try:
+            # Транзакцию завершает только внешняя выдача: вложенная выдача (чтение
+            # схемы, проверка прав) не должна фиксировать или откатывать начатую
+            # вызывающим запись. Ошибка во вложенной выдаче откатывает всю транзакцию
+            if not self._read_only and local.depth == 0:
+                failed, local.failed = local.failed, False
+                if failed:
+                    conn.rollback()
+                else:
+                    conn.commit()
+        finally:
+            if local.depth == 0 and not getattr(self._manager._local, 'request_scope', False):
+                local.conn = None
+                self._pool.release(conn)
+        return False
 
 
 class DatabaseManager:
-    def __init__(self, db_path: str = "datavue.db"):
+    def __init__(self, db_path: str = "datavue.db", pool_size: int = 8, pool_timeout: float = 30.0,
+                 read_pool_size: int = 8, read_mmap_size: int = DEFAULT_READ_MMAP_SIZE):
         """Инициализация менеджера базы данных."""
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, max_size=pool_size, timeout=pool_timeout,
+                                   initializer=self._init_connection)
+        # Чтение записей, статистики и экспорт - через отдельные соединения только для чтения
+        self.read_pool = ReadOnlyConnectionPool(db_path, max_size=read_pool_size, timeout=pool_timeout,
+                                                mmap_size=read_mmap_size, initializer=self._init_connection)
+        self._local = threading.local()
+        self._read_local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._lease_reuses = 0
+        # Открытые снимки чтения: время начала (по нему видно, что держит WAL)
+        self._snapshots: Dict[object, float] = {}
+        self._snapshots_total = 0
+        self.schema = SchemaCatalog(self.get_connection)
+        self.permissions = PermissionCache(self.get_connection)
+        self.summary = StatisticsSummary()
+        # Устаревшие MIN/MAX и недостающие сводки пересчитываются в фоне
+        self.summary_refresher = SummaryRefresher(self.refresh_statistics)
+        self.versions = DataVersions()
+        self.changes = ChangeLog()
+        self._change_listeners: List[Callable[[int, str, Optional[int]], None]] = []
+        self.geo_clusters = GeoClusterer()
+        # Поток групповой фиксации записей (см. enable_group_commit); по умолчанию выключен
+        self.writer: Optional[GroupCommitWriter] = None
+        # Изменения схемы выполняются по одному, после завершения начатых записей
+        self.schema_changes = SchemaChangeExecutor(self.get_connection)
         self.init_database()
     
     def get_connection(self, timeout=30.0):
-        """Получение соединения с базой данных с оптимальными настройками."""
-        conn = sqlite3.connect(
-            self.db_path, 
-            timeout=timeout,
-            check_same_thread=False
+        """Получение соединения из пула.
+        
+        Внутри одного потока (и одного HTTP-запроса) вложенные вызовы получают
+        одно и то же соединение; PRAGMA применяются один раз при его создании.
+        """
+        return _ConnectionLease(self, timeout)
+    
+    def get_read_connection(self, timeout=30.0):
+        """Получение соединения только для чтения (mode=ro, query_only).
+        
+        Как и get_connection, закрепляется за потоком и HTTP-запросом. Каждый
+        запрос вне read_snapshot видит последние зафиксированные данные.
+        """
+        return _ConnectionLease(self, timeout, read_only=True)
+    
+    @contextmanager
+    def read_snapshot(self, timeout=30.0):
+        """Транзакция чтения: все запросы внутри блока видят один снимок базы.
+        
+        Вложенные чтения (get_read_connection, read_snapshot) получают то же
+        соединение и тот же снимок. Снимок не дает контрольной точке WAL
+        перенести более новые страницы в файл базы, поэтому держать его
+        следует только на время чтения.
+        """
+        with self.get_read_connection(timeout) as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            with self._snapshot(conn):
+                yield conn
+    
+    @contextmanager
+    def _snapshot(self, conn: sqlite3.Connection):
+        token = object()
+        conn.execute('BEGIN')
+        with self._stats_lock:
+            self._snapshots[token] = time.monotonic()
+            self._snapshots_total += 1
+        try:
+            yield conn
+        finally:
+            with self._stats_lock:
+                self._snapshots.pop(token, None)
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+    
+    @staticmethod
+    def _init_connection(conn: sqlite3.Connection):
+        """Регистрация пользовательских функций SQL для нового соединения."""
+        # Встроенный lower() в SQLite работает только с ASCII, а поиск нужен и по кириллице
+        conn.create_function(
+            'unicode_lower', 1,
+            lambda value: None if value is None else str(value).lower(),
+            deterministic=True
         )
-        # Настройки для избежания блокировок
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA synchronous=NORMAL")
-        conn.execute("PRAGMA temp_store=MEMORY")
-        conn.execute("PRAGMA busy_timeout=30000")  # 30 секунд таймаут
-        conn.execute("PRAGMA foreign_keys=ON")
-        conn.execute("PRAGMA cache_size=10000")
-        return conn
+        # Расстояние в метрах для запросов точек в радиусе
+        conn.create_function('haversine', 4, haversine_distance, deterministic=True)
+    
+    def begin_request_scope(self):
+        """Закрепление соединения за текущим потоком до конца HTTP-запроса."""
+        self._local.request_scope = True
+    
+    def end_request_scope(self):
+        """Возврат закрепленного за запросом соединения в пул."""
+        local = self._local
+        local.request_scope = False
+        for pool, pinned in ((self.pool, local), (self.read_pool, self._read_local)):
+            conn = getattr(pinned, 'conn', None)
+            if conn is not None and getattr(pinned, 'depth', 0) == 0:
+                pinned.conn = None
+                pool.release(conn)
+    
+    def _count_lease_reuse(self):
+        with self._stats_lock:
+            self._lease_reuses += 1
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Статистика пула соединений."""
+        stats = self.pool.stats()
+        with self._stats_lock:
+            stats['lease_reuses'] = self._lease_reuses
+        return stats
+    
+    def get_read_pool_stats(self) -> Dict[str, Any]:
+        """Статистика пула чтения и открытых снимков."""
+        stats = self.read_pool.stats()
+        now = time.monotonic()
+        with self._stats_lock:
+            stats['mmap_size'] = self.read_pool.mmap_size
+            stats['snapshots'] = self._snapshots_total
+            stats['open_snapshots'] = len(self._snapshots)
+            stats['oldest_snapshot_seconds'] = (
+                round(now - min(self._snapshots.values()), 3) if self._snapshots else None
+            )
+        return stats
+    
+    def get_data_version(self, data_type_id: int) -> Tuple[int, Optional[float]]:
+        """Версия данных справочника и время ее изменения (секунды Unix).
+        
+        Версия меняется в одной транзакции с изменением записей или схемы,
+        поэтому результат, посчитанный по старой версии, не будет выдан под новой.
+        """
+        with self.get_read_connection() as conn:
+            return self.versions.get_with_cursor(conn.cursor(), data_type_id)
     
     def get_current_timestamp(self) -> str:
         """Получение текущего времени в формате для SQLite с правильным часовым поясом."""
@@ -211,6 +416,15 @@ class DatabaseManager:
                 )
             ''')
             
+            # Сводная статистика по полям справочников (ведется вместе с записями)
+            self.summary.create_table_with_cursor(cursor)
+            
+            # Версии данных справочников (для ETag и Last-Modified)
+            self.versions.create_table_with_cursor(cursor)
+            
+            # Журнал изменений записей (ведется триггерами таблиц данных)
+            self.changes.create_table_with_cursor(cursor)
+            
             # Таблица данных (динамическая, создается для каждого справочника)
             # Структура: data_{data_type_id} с полями из data_fields
             
@@ -270,8 +484,7 @@ class DatabaseManager:
     
     def create_data_type(self, name: str, description: str, created_by: int) -> int:
         """Создание нового типа данных (справочника)"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
+        def create_type(cursor) -> int:
             current_time = self.get_current_timestamp()
             cursor.execute('''
                 INSERT INTO data_types (name, description, created_by, created_at)
@@ -282,9 +495,12 @@ class DatabaseManager:
             
             # Создаем базовую таблицу для данных этого типа (без полей)
             self.create_basic_data_table_with_cursor(cursor, data_type_id)
-            
-            conn.commit()
+            self.versions.bump_with_cursor(cursor, data_type_id)
             return data_type_id
+        
+        data_type_id = self.schema_changes.submit(create_type, f"создание справочника {name}")
+        self.schema.invalidate(data_type_id)
+        return data_type_id
     
     def create_missing_data_tables(self):
         """Создание недостающих таблиц данных для существующих типов данных"""
@@ -308,8 +524,19 @@ class DatabaseManager:
                     # Создаем недостающую таблицу
                     self.create_data_table_with_cursor(cursor, data_type_id)
                     print(f"Создана таблица {table_name}")
+                else:
+                    fields = self._get_fields_with_cursor(cursor, data_type_id)
+                    if needs_coordinate_migration_with_cursor(cursor, table_name, fields):
+                        # Координаты из JSON-строк переносятся в числовые колонки
+                        self.recreate_data_table_with_cursor(cursor, data_type_id)
+                        continue
+                    # Добавляем индексы в таблицы, созданные старыми версиями
+                    self.create_data_table_indexes_with_cursor(cursor, data_type_id)
+                    self.create_spatial_indexes_with_cursor(cursor, data_type_id, fields)
             
             conn.commit()
+        
+        self.schema.invalidate()
     
     def create_basic_data_table(self, data_type_id: int):
         """Создание базовой таблицы для хранения данных конкретного типа (без полей)"""
@@ -331,6 +558,17 @@ class DatabaseManager:
         '''
         
         cursor.execute(create_sql)
+        self.create_data_table_indexes_with_cursor(cursor, data_type_id)
+    
+    def create_data_table_indexes_with_cursor(self, cursor, data_type_id: int):
+        """Создание индексов таблицы данных (порядок выдачи записей: новые первыми)
+        и триггеров журнала изменений (при пересоздании таблицы они удаляются вместе с ней)"""
+        table_name = f"data_{data_type_id}"
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_created_at
+            ON {table_name} (created_at DESC, id DESC)
+        ''')
+        self.changes.create_triggers_with_cursor(cursor, data_type_id)
     
     def create_data_table(self, data_type_id: int):
         """Создание таблицы для хранения данных конкретного типа"""
@@ -354,9 +592,9 @@ class DatabaseManager:
         if fields:
             # Создаем таблицу с полями
             field_definitions = []
-            for field_name, field_type in fields:
-                sql_type = self.get_sql_type(field_type)
-                field_definitions.append(f"{field_name} {sql_type}")
+            field_dicts = [{'field_name': name, 'field_type': field_type} for name, field_type in fields]
+            for column_name, sql_type in storage_columns(field_dicts, self.get_sql_type):
+                field_definitions.append(f"{column_name} {sql_type}")
             
             create_sql = f'''
                 CREATE TABLE IF NOT EXISTS {table_name} (
@@ -379,6 +617,16 @@ class DatabaseManager:
             '''
         
         cursor.execute(create_sql)
+        self.create_data_table_indexes_with_cursor(cursor, data_type_id)
+        if fields:
+            self.create_spatial_indexes_with_cursor(cursor, data_type_id, field_dicts)
+    
+    def create_spatial_indexes_with_cursor(self, cursor, data_type_id: int, fields: List[Dict[str, Any]]):
+        """Создание недостающих индексов R*Tree для полей координат"""
+        table_name = f"data_{data_type_id}"
+        for field in fields:
+            if field['field_type'] == 'coordinates':
+                create_spatial_index_with_cursor(cursor, table_name, field['field_name'])
     
     def get_sql_type(self, field_type: str) -> str:
         """Преобразование типа поля в SQL тип"""
@@ -389,7 +637,7 @@ class DatabaseManager:
             'date': 'TIMESTAMP',
             'boolean': 'BOOLEAN',
             'enum': 'TEXT',  # Enum хранится как текст
-            'coordinates': 'TEXT'  # Coordinates хранятся как JSON строка
+            'coordinates': 'REAL'  # Координаты - две колонки REAL (широта и долгота), см. spatial_index
         }
         return type_mapping.get(field_type, 'TEXT')
     
@@ -397,291 +645,195 @@ class DatabaseManager:
                               field_type: str, is_required: bool = False, 
                               description: str = "", validation_rules: str = ""):
         """Добавление поля к типу данных"""
-        import time
-        
-        # Пытаемся подключиться с таймаутом
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                with self.get_connection(timeout=30.0) as conn:
-                    cursor = conn.cursor()
-                    
-                    # Проверяем и обновляем constraint если нужно
-                    cursor.execute("""
-                        SELECT sql FROM sqlite_master 
-                        WHERE type='table' AND name='data_fields'
-                    """)
-                    create_sql = cursor.fetchone()
-                    if create_sql:
-                        sql_lower = create_sql[0].lower()
-                        # Если constraint не содержит 'coordinates', пересоздаем таблицу
-                        if 'coordinates' not in sql_lower:
-                            # Пересоздаем таблицу с полным constraint
-                            cursor.execute('''
-                                CREATE TABLE data_fields_temp (
-                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    data_type_id INTEGER NOT NULL,
-                                    field_name TEXT NOT NULL,
-                                    field_type TEXT NOT NULL CHECK (field_type IN ('text', 'integer', 'decimal', 'date', 'boolean', 'enum', 'coordinates')),
-                                    is_required BOOLEAN DEFAULT 0,
-                                    description TEXT,
-                                    validation_rules TEXT,
-                                    created_at TIMESTAMP,
-                                    FOREIGN KEY (data_type_id) REFERENCES data_types (id),
-                                    UNIQUE(data_type_id, field_name)
-                                )
-                            ''')
-                            
-                            # Копируем данные
-                            cursor.execute('''
-                                INSERT INTO data_fields_temp 
-                                SELECT 
-                                    id,
-                                    data_type_id,
-                                    field_name,
-                                    CASE 
-                                        WHEN field_type = 'number' THEN 'decimal'
-                                        ELSE field_type
-                                    END as field_type,
-                                    is_required,
-                                    description,
-                                    validation_rules,
-                                    created_at
-                                FROM data_fields
-                            ''')
-                            
-                            cursor.execute('DROP TABLE data_fields')
-                            cursor.execute('ALTER TABLE data_fields_temp RENAME TO data_fields')
-                            conn.commit()
-                    
-                    # Проверяем, существует ли уже поле с таким именем
+        def add_field(cursor):
+            # Проверяем и обновляем constraint если нужно
+            cursor.execute("""
+                SELECT sql FROM sqlite_master 
+                WHERE type='table' AND name='data_fields'
+            """)
+            create_sql = cursor.fetchone()
+            if create_sql:
+                sql_lower = create_sql[0].lower()
+                # Если constraint не содержит 'coordinates', пересоздаем таблицу
+                if 'coordinates' not in sql_lower:
+                    # Пересоздаем таблицу с полным constraint
                     cursor.execute('''
-                        SELECT id FROM data_fields 
-                        WHERE data_type_id = ? AND field_name = ?
-                    ''', (data_type_id, field_name))
-                    
-                    if cursor.fetchone():
-                        raise ValueError(f"Поле '{field_name}' уже существует для данного типа данных")
-                    
-                    current_time = self.get_current_timestamp()
+                        CREATE TABLE data_fields_temp (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            data_type_id INTEGER NOT NULL,
+                            field_name TEXT NOT NULL,
+                            field_type TEXT NOT NULL CHECK (field_type IN ('text', 'integer', 'decimal', 'date', 'boolean', 'enum', 'coordinates')),
+                            is_required BOOLEAN DEFAULT 0,
+                            description TEXT,
+                            validation_rules TEXT,
+                            created_at TIMESTAMP,
+                            FOREIGN KEY (data_type_id) REFERENCES data_types (id),
+                            UNIQUE(data_type_id, field_name)
+                        )
+                    ''')
+                
+                    # Копируем данные
                     cursor.execute('''
-                        INSERT INTO data_fields (data_type_id, field_name, field_type, 
-                                               is_required, description, validation_rules, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (data_type_id, field_name, field_type, is_required, description, validation_rules, current_time))
-                    
-                    # Пересоздаем таблицу данных с новым полем
-                    self.recreate_data_table_with_cursor(cursor, data_type_id)
-                    conn.commit()
-                    break  # Успешно выполнили операцию
-                    
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and attempt < max_retries - 1:
-                    print(f"База данных заблокирована, попытка {attempt + 1}/{max_retries}")
-                    time.sleep(0.5)  # Ждем 500мс перед следующей попыткой
-                    continue
-                else:
-                    raise e
+                        INSERT INTO data_fields_temp 
+                        SELECT 
+                            id,
+                            data_type_id,
+                            field_name,
+                            CASE 
+                                WHEN field_type = 'number' THEN 'decimal'
+                                ELSE field_type
+                            END as field_type,
+                            is_required,
+                            description,
+                            validation_rules,
+                            created_at
+                        FROM data_fields
+                    ''')
+                
+                    cursor.execute('DROP TABLE data_fields')
+                    cursor.execute('ALTER TABLE data_fields_temp RENAME TO data_fields')
+        
+            # Проверяем, существует ли уже поле с таким именем
+            cursor.execute('''
+                SELECT id FROM data_fields 
+                WHERE data_type_id = ? AND field_name = ?
+            ''', (data_type_id, field_name))
+        
+            if cursor.fetchone():
+                raise ValueError(f"Поле '{field_name}' уже существует для данного типа данных")
+        
+            current_time = self.get_current_timestamp()
+            cursor.execute('''
+                INSERT INTO data_fields (data_type_id, field_name, field_type, 
+                                       is_required, description, validation_rules, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (data_type_id, field_name, field_type, is_required, description, validation_rules, current_time))
+        
+            # Пересоздаем таблицу данных с новым полем
+            self.recreate_data_table_with_cursor(cursor, data_type_id)
+        
+        self._change_schema(data_type_id, add_field, f"data_{data_type_id}: добавление поля {field_name}")
     
     def delete_field_from_data_type(self, data_type_id: int, field_id: int):
         """Удаление поля из типа данных"""
-        import time
+        def delete_field(cursor):
+            # Проверяем, существует ли поле
+            cursor.execute('''
+                SELECT field_name FROM data_fields 
+                WHERE id = ? AND data_type_id = ?
+            ''', (field_id, data_type_id))
         
-        # Пытаемся подключиться с таймаутом
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                with self.get_connection(timeout=30.0) as conn:
-                    cursor = conn.cursor()
-                    
-                    # Проверяем, существует ли поле
-                    cursor.execute('''
-                        SELECT field_name FROM data_fields 
-                        WHERE id = ? AND data_type_id = ?
-                    ''', (field_id, data_type_id))
-                    
-                    field = cursor.fetchone()
-                    if not field:
-                        raise ValueError("Поле не найдено")
-                    
-                    # Удаляем enum значения, если поле типа enum
-                    cursor.execute('SELECT field_type FROM data_fields WHERE id = ?', (field_id,))
-                    field_type_result = cursor.fetchone()
-                    if field_type_result and field_type_result[0] == 'enum':
-                        cursor.execute('DELETE FROM enum_field_values WHERE field_id = ?', (field_id,))
-                    
-                    # Удаляем поле
-                    cursor.execute('''
-                        DELETE FROM data_fields 
-                        WHERE id = ? AND data_type_id = ?
-                    ''', (field_id, data_type_id))
-                    
-                    # Пересоздаем таблицу данных без удаленного поля
-                    self.recreate_data_table_with_cursor(cursor, data_type_id)
-                    conn.commit()
-                    break  # Успешно выполнили операцию
-                    
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and attempt < max_retries - 1:
-                    print(f"База данных заблокирована, попытка {attempt + 1}/{max_retries}")
-                    time.sleep(0.5)  # Ждем 500мс перед следующей попыткой
-                    continue
-                else:
-                    raise e
+            field = cursor.fetchone()
+            if not field:
+                raise ValueError("Поле не найдено")
+        
+            # Удаляем enum значения, если поле типа enum
+            cursor.execute('SELECT field_type FROM data_fields WHERE id = ?', (field_id,))
+            field_type_result = cursor.fetchone()
+            if field_type_result and field_type_result[0] == 'enum':
+                cursor.execute('DELETE FROM enum_field_values WHERE field_id = ?', (field_id,))
+        
+            # Удаляем поле
+            cursor.execute('''
+                DELETE FROM data_fields 
+                WHERE id = ? AND data_type_id = ?
+            ''', (field_id, data_type_id))
+        
+            # Пересоздаем таблицу данных без удаленного поля
+            self.recreate_data_table_with_cursor(cursor, data_type_id)
+        
+        self._change_schema(data_type_id, delete_field, f"data_{data_type_id}: удаление поля {field_id}")
     
     def delete_data_type(self, data_type_id: int):
         """Удаление типа данных и всех связанных данных"""
-        import time
+        def delete_type(cursor):
+            # Проверяем, существует ли тип данных
+            cursor.execute('''
+                SELECT name FROM data_types WHERE id = ?
+            ''', (data_type_id,))
         
-        # Пытаемся подключиться с таймаутом
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                with self.get_connection(timeout=30.0) as conn:
-                    cursor = conn.cursor()
-                    
-                    # Проверяем, существует ли тип данных
-                    cursor.execute('''
-                        SELECT name FROM data_types WHERE id = ?
-                    ''', (data_type_id,))
-                    
-                    if not cursor.fetchone():
-                        raise ValueError("Тип данных не найден")
-                    
-                    # Удаляем все записи данных
-                    table_name = f"data_{data_type_id}"
-                    cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
-                    
-                    # Удаляем все поля типа данных
-                    cursor.execute('''
-                        DELETE FROM data_fields WHERE data_type_id = ?
-                    ''', (data_type_id,))
-                    
-                    # Удаляем все права доступа к типу данных
-                    cursor.execute('''
-                        DELETE FROM user_permissions WHERE data_type_id = ?
-                    ''', (data_type_id,))
-                    
-                    # Удаляем сам тип данных
-                    cursor.execute('''
-                        DELETE FROM data_types WHERE id = ?
-                    ''', (data_type_id,))
-                    
-                    conn.commit()
-                    break  # Успешно выполнили операцию
-                    
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and attempt < max_retries - 1:
-                    print(f"База данных заблокирована, попытка {attempt + 1}/{max_retries}")
-                    time.sleep(0.5)  # Ждем 500мс перед следующей попыткой
-                    continue
-                else:
-                    raise e
+            if not cursor.fetchone():
+                raise ValueError("Тип данных не найден")
+        
+            # Удаляем все записи данных (и индексы R*Tree полей координат)
+            table_name = f"data_{data_type_id}"
+            drop_stale_spatial_indexes_with_cursor(cursor, table_name)
+            cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
+        
+            self.summary.delete_with_cursor(cursor, data_type_id)
+            self.versions.delete_with_cursor(cursor, data_type_id)
+            self.changes.delete_with_cursor(cursor, data_type_id)
+        
+            # Удаляем все поля типа данных
+            cursor.execute('''
+                DELETE FROM data_fields WHERE data_type_id = ?
+            ''', (data_type_id,))
+        
+            # Удаляем все права доступа к типу данных
+            cursor.execute('''
+                DELETE FROM user_permissions WHERE data_type_id = ?
+            ''', (data_type_id,))
+        
+            # Удаляем сам тип данных
+            cursor.execute('''
+                DELETE FROM data_types WHERE id = ?
+            ''', (data_type_id,))
+        
+        try:
+            self._change_schema(data_type_id, delete_type, f"data_{data_type_id}: удаление справочника")
+        finally:
+            # Права на удаленный справочник удалены у всех пользователей
+            self.permissions.invalidate()
+    
+    def _change_schema(self, data_type_id: int, operation: Callable[[sqlite3.Cursor], Any],
+                       description: str) -> Any:
+        """Изменение схемы справочника через очередь изменений схемы (см. schema_changes).
+        
+        Изменение ждет своей очереди и завершения начатых записей, а не
+        возвращает ошибку "database is locked".
+        """
+        # Кэш схемы сбрасывается до снятия блокировки схемы: записи, ждущие
+        # окончания изменения, уже прочитают новую схему
+        return self.schema_changes.submit(
+            operation, description, on_finish=lambda: self.schema.invalidate(data_type_id),
+            key=data_type_id
+        )
     
     def recreate_data_table(self, data_type_id: int):
         """Пересоздание таблицы данных с учетом новых полей"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            self.recreate_data_table_with_cursor(cursor, data_type_id)
+        self._change_schema(
+            data_type_id,
+            lambda cursor: self.recreate_data_table_with_cursor(cursor, data_type_id),
+            f"data_{data_type_id}: пересоздание таблицы"
+        )
     
-    def recreate_data_table_with_cursor(self, cursor, data_type_id: int):
-        """Пересоздание таблицы данных с учетом новых полей с использованием существующего курсора"""
-        table_name = f"data_{data_type_id}"
+    def recreate_data_table_with_cursor(self, cursor, data_type_id: int, progress=None) -> Dict[str, Any]:
+        """Приведение таблицы данных к текущим полям с использованием существующего курсора.
         
-        # Проверяем, существует ли таблица, и если да, сохраняем данные
-        cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-        table_exists = cursor.fetchone()
-        
-        old_data = []
-        old_column_names = []
-        if table_exists:
-            # Получаем все данные из старой таблицы
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            old_columns = cursor.fetchall()
-            old_column_names = [col[1] for col in old_columns if col[1] not in ['id', 'created_by', 'created_at']]
-            
-            if old_column_names:
-                # Сохраняем все данные
-                columns_to_select = ['id', 'created_by', 'created_at'] + old_column_names
-                cursor.execute(f"SELECT {', '.join(columns_to_select)} FROM {table_name}")
-                old_data = cursor.fetchall()
+        Новые и удаленные поля применяются через ALTER TABLE; если это невозможно,
+        таблица пересоздается с переносом данных через INSERT ... SELECT.
+        progress - необязательный callback, получающий словари с этапами миграции.
+        """
+        table_name = f"data_{data_type_id}"
         
         # Получаем текущие поля
-        cursor.execute('''
-            SELECT field_name, field_type
-            FROM data_fields
-            WHERE data_type_id = ?
-            ORDER BY id
-        ''', (data_type_id,))
-        
-        fields = cursor.fetchall()
-        
-        # Удаляем старую таблицу
-        cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
-        
-        if fields:
-            # Создаем новую таблицу с полями
-            field_definitions = []
-            for field_name, field_type in fields:
-                sql_type = self.get_sql_type(field_type)
-                field_definitions.append(f"{field_name} {sql_type}")
-            
-            create_sql = f'''
-                CREATE TABLE {table_name} (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    created_by INTEGER,
-                    created_at TIMESTAMP,
-                    {', '.join(field_definitions)},
-                    FOREIGN KEY (created_by) REFERENCES users (id)
-                )
-            '''
-        else:
-            # Создаем базовую таблицу без полей
-            create_sql = f'''
-                CREATE TABLE {table_name} (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    created_by INTEGER,
-                    created_at TIMESTAMP,
-                    FOREIGN KEY (created_by) REFERENCES users (id)
-                )
-            '''
+        fields = self._get_fields_with_cursor(cursor, data_type_id)
+        columns = storage_columns(fields, self.get_sql_type)
         
-        cursor.execute(create_sql)
+        # Триггеры R*Tree удаленных полей мешают DROP COLUMN - удаляем их заранее
+        drop_stale_spatial_indexes_with_cursor(cursor, table_name, fields)
+        migrate_legacy_coordinates_with_cursor(cursor, table_name, fields)
         
-        # Восстанавливаем данные, если они были
-        if old_data:
-            # Получаем список полей в новой таблице
-            new_field_names = [field[0] for field in fields] if fields else []
-            
-            # Формируем запрос для вставки
-            all_fields = ['id', 'created_by', 'created_at'] + new_field_names
-            placeholders = ['?' for _ in all_fields]
-            
-            # Для каждой старой записи создаем новую запись
-            for row in old_data:
-                # Создаем словарь из старой записи
-                old_record = dict(zip(['id', 'created_by', 'created_at'] + old_column_names, row))
-                
-                # Формируем новую запись
-                new_values = []
-                new_values.append(old_record.get('id'))
-                new_values.append(old_record.get('created_by'))
-                new_values.append(old_record.get('created_at'))
-                
-                # Добавляем значения для новых полей
-                for field_name in new_field_names:
-                    if field_name in old_record:
-                        new_values.append(old_record[field_name])
-                    else:
-                        # Новое поле - значение NULL
-                        new_values.append(None)
-                
-                # Вставляем запись
-                insert_sql = f'''
-                    INSERT INTO {table_name} ({', '.join(all_fields)})
-                    VALUES ({', '.join(placeholders)})
-                '''
-                cursor.execute(insert_sql, new_values)
+        result = DataTableMigrator(cursor, table_name, columns, progress=progress).run()
+        # При пересоздании таблицы индексы и триггеры удаляются вместе со старой таблицей
+        self.create_data_table_indexes_with_cursor(cursor, data_type_id)
+        self.create_spatial_indexes_with_cursor(cursor, data_type_id, fields)
+        # Добавленные колонки пусты в обоих способах миграции
+        self.summary.sync_fields_with_cursor(cursor, data_type_id, fields, result['added'])
+        self.versions.bump_with_cursor(cursor, data_type_id)
+        self.changes.record_with_cursor(cursor, data_type_id, CHANGE_SCHEMA)
+        print(f"Миграция {table_name}: {result['strategy']}, {result['elapsed_seconds']} с")
+        return result
     
     def get_user_permissions(self, user_id: int) -> List[Dict[str, Any]]:
         """Получение прав доступа пользователя"""
@@ -712,6 +864,7 @@ class DatabaseManager:
                 VALUES (?, ?, ?, ?, ?)
             ''', (user_id, data_type_id, permission_type, granted_by, current_time))
             conn.commit()
+        self.permissions.invalidate(user_id)
     
     def revoke_permission(self, user_id: int, data_type_id: int):
         """Отзыв разрешения пользователя"""
@@ -722,6 +875,7 @@ class DatabaseManager:
                 WHERE user_id = ? AND data_type_id = ?
             ''', (user_id, data_type_id))
             conn.commit()
+        self.permissions.invalidate(user_id)
     
     def get_data_types(self, user_id: int) -> List[Dict[str, Any]]:
         """Получение доступных типов данных для пользователя"""
@@ -738,36 +892,47 @@ class DatabaseManager:
             ''')
             
             results = cursor.fetchall()
-            
-            # Получаем права пользователя на редактирование
-            cursor.execute('''
-                SELECT data_type_id FROM user_permissions
-                WHERE user_id = ? AND permission_type = 'write'
-            ''', (user_id,))
-            
-            write_permissions = {row[0] for row in cursor.fetchall()}
-            
-            return [{
-                'id': row[0],
-                'name': row[1],
-                'description': row[2],
-                'created_at': self.format_datetime(row[3]),
-                'created_by_username': row[4],
-                'can_edit': row[0] in write_permissions or self.is_admin(user_id)
-            } for row in results]
+        
+        # Права пользователя на редактирование берем из кэша авторизации
+        authorization = self.get_user_authorization(user_id)
+        write_permissions = authorization['writable'] if authorization else frozenset()
+        is_admin = bool(authorization and authorization['role'] == 'admin')
+        
+        return [{
+            'id': row[0],
+            'name': row[1],
+            'description': row[2],
+            'created_at': self.format_datetime(row[3]),
+            'created_by_username': row[4],
+            'can_edit': row[0] in write_permissions or is_admin
+        } for row in results]
+    
+    def get_user_authorization(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Роль, активность и права записи пользователя (из кэша авторизации)"""
+        return self.permissions.get(user_id)
+    
+    def invalidate_user_authorization(self, user_id: Optional[int] = None):
+        """Сброс кэша авторизации после изменения пользователя или его прав"""
+        self.permissions.invalidate(user_id)
+    
+    def is_active_user(self, user_id: int) -> bool:
+        """Проверка, что пользователь существует и активен"""
+        authorization = self.get_user_authorization(user_id)
+        return bool(authorization and authorization['is_active'])
     
     def is_admin(self, user_id: int) -> bool:
         """Проверка, является ли пользователь администратором"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-            result = cursor.fetchone()
-            return result and result[0] == 'admin'
+        authorization = self.get_user_authorization(user_id)
+        return bool(authorization and authorization['role'] == 'admin')
     
     def has_permission(self, user_id: int, data_type_id: int, permission_type: str) -> bool:
         """Проверка прав доступа пользователя к типу данных"""
+        authorization = self.get_user_authorization(user_id)
+        if not authorization:
+            return False
+        
         # Администраторы имеют все права
-        if self.is_admin(user_id):
+        if authorization['role'] == 'admin':
             return True
         
         # Все пользователи могут просматривать данные
@@ -776,70 +941,48 @@ class DatabaseManager:
         
         # Для редактирования проверяем права
         if permission_type == 'write':
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT permission_type FROM user_permissions
-                    WHERE user_id = ? AND data_type_id = ?
-                ''', (user_id, data_type_id))
-                
-                result = cursor.fetchone()
-                return result is not None and result[0] == 'write'
+            return data_type_id in authorization['writable']
         
         return False
     
     def get_data_type(self, data_type_id: int) -> Dict[str, Any]:
         """Получение информации о типе данных"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, name, description, created_by, created_at
-                FROM data_types
-                WHERE id = ?
-            ''', (data_type_id,))
-            
-            row = cursor.fetchone()
-            if not row:
-                return None
-            
-            return {
-                'id': row[0],
-                'name': row[1],
-                'description': row[2] or '',
-                'created_by': row[3],
-                'created_at': self.format_datetime(row[4])
-            }
+        schema = self.schema.get(data_type_id)
+        if not schema:
+            return None
+        
+        data_type = schema['data_type']
+        return {
+            'id': data_type['id'],
+            'name': data_type['name'],
+            'description': data_type['description'] or '',
+            'created_by': data_type['created_by'],
+            'created_at': self.format_datetime(data_type['created_at'])
+        }
     
     def get_data_fields(self, data_type_id: int) -> List[Dict[str, Any]]:
-        """Получение полей для типа данных"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, field_name, field_type, is_required, description, validation_rules
-                FROM data_fields
-                WHERE data_type_id = ?
-                ORDER BY id
-            ''', (data_type_id,))
-            
-            results = cursor.fetchall()
-            fields = []
-            for row in results:
-                field = {
-                    'id': row[0],
-                    'field_name': row[1],
-                    'field_type': row[2],
-                    'is_required': row[3],
-                    'description': row[4],
-                    'validation_rules': row[5]
-                }
-                # Если поле типа enum, получаем его значения
-                if field['field_type'] == 'enum':
-                    field['enum_values'] = self.get_enum_values(row[0])
-                fields.append(field)
-            return fields
+        """Получение полей для типа данных (из кэша схемы, вместе со значениями enum)"""
+        schema = self.schema.get_copy(data_type_id)
+        if not schema:
+            return []
+        return schema['fields']
     
     def add_enum_values(self, field_id: int, values: List[str]):
         """Добавление значений для enum поля"""
+        try:
+            self._add_enum_values(field_id, values)
+        finally:
+            self.schema.invalidate(self._get_field_data_type_id(field_id))
+    
+    def _get_field_data_type_id(self, field_id: int) -> Optional[int]:
+        """Тип данных, которому принадлежит поле"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT data_type_id FROM data_fields WHERE id = ?', (field_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+    
+    def _add_enum_values(self, field_id: int, values: List[str]):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             current_time = self.get_current_timestamp()
@@ -855,6 +998,9 @@ class DatabaseManager:
                         VALUES (?, ?, ?, ?)
                     ''', (field_id, value.strip(), order, current_time))
             
+            data_type_id = self._get_field_data_type_id(field_id)
+            if data_type_id is not None:
+                self.versions.bump_with_cursor(cursor, data_type_id)
             conn.commit()
     
     def get_enum_values(self, field_id: int) -> List[str]:
@@ -872,59 +1018,185 @@ class DatabaseManager:
     
     def delete_enum_values(self, field_id: int):
         """Удаление всех значений enum поля (вызывается при удалении поля)"""
+        data_type_id = self._get_field_data_type_id(field_id)
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM enum_field_values WHERE field_id = ?', (field_id,))
+            if data_type_id is not None:
+                self.versions.bump_with_cursor(cursor, data_type_id)
             conn.commit()
+        self.schema.invalidate(data_type_id)
     
     def has_data_fields(self, data_type_id: int) -> bool:
         """Проверка наличия полей у типа данных"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT COUNT(*) FROM data_fields
-                WHERE data_type_id = ?
-            ''', (data_type_id,))
-            
-            result = cursor.fetchone()
-            return result[0] > 0
+        schema = self.schema.get(data_type_id)
+        return bool(schema and schema['fields'])
     
     def insert_data_record(self, data_type_id: int, data: Dict[str, Any], created_by: int) -> int:
         """Вставка записи данных"""
+        # Схема читается под блокировкой схемы: изменение схемы не пройдет
+        # между построением SQL и самой записью
+        with self.schema_changes.gate.shared(data_type_id):
+            record_id = self._insert_data_record(data_type_id, data, created_by)
+        self._after_write(data_type_id, CHANGE_INSERT, record_id)
+        return record_id
+    
+    def _insert_data_record(self, data_type_id: int, data: Dict[str, Any], created_by: int) -> int:
         # Проверяем, есть ли поля у типа данных
         if not self.has_data_fields(data_type_id):
             raise ValueError("Нельзя добавлять записи в тип данных без полей. Сначала добавьте поля к типу данных.")
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            table_name = f"data_{data_type_id}"
-            
-            # Подготавливаем данные для вставки
-            fields = list(data.keys())
-            values = list(data.values())
-            
-            # Добавляем обязательные поля если их нет
-            if 'created_by' not in fields:
-                fields.append('created_by')
-                values.append(created_by)
-            if 'created_at' not in fields:
-                fields.append('created_at')
-                values.append(self.get_current_timestamp())
-            
-            # Создаем placeholders для всех полей
-            placeholders = ', '.join(['?' for _ in fields])
-            fields_str = ', '.join(fields)
-            
+        schema = self.schema.get(data_type_id)
+        table_name = f"data_{data_type_id}"
+        
+        # Подготавливаем данные для вставки (координаты - в две колонки)
+        items = self._storage_items(schema, data)
+        fields = [column for column, _ in items]
+        values = [value for _, value in items]
+        
+        # Добавляем обязательные поля если их нет
+        if 'created_by' not in fields:
+            fields.append('created_by')
+            values.append(created_by)
+        if 'created_at' not in fields:
+            fields.append('created_at')
+            values.append(self.get_current_timestamp())
+        
+        # Создаем placeholders для всех полей
+        placeholders = ', '.join(['?' for _ in fields])
+        fields_str = ', '.join(fields)
+        
+        def insert(cursor) -> int:
             cursor.execute(f'''
                 INSERT INTO {table_name} ({fields_str})
                 VALUES ({placeholders})
             ''', values)
             
             record_id = cursor.lastrowid
-            conn.commit()
+            self._apply_summary_with_cursor(
+                cursor, data_type_id, schema['fields'],
+                added=[self._fetch_row_with_cursor(cursor, table_name, record_id)]
+            )
+            self.versions.bump_with_cursor(cursor, data_type_id)
             return record_id
+        
+        return self._write(insert)
+
+    def bulk_insert_data_records(self, data_type_id: int, records: Iterable[Any], created_by: int,
+                                 atomic: bool = False,
+                                 batch_size: int = BULK_BATCH_SIZE) -> Dict[str, Any]:
+        """Пакетная вставка записей.
+
+        Записи проверяются по схеме пачками по batch_size и вставляются одним
+        executemany на пачку. В обычном режиме каждая пачка - отдельная
+        транзакция, а ошибочные записи пропускаются и попадают в отчет.
+        В режиме atomic все записи вставляются в одной транзакции, и при любой
+        ошибке она откатывается целиком. records - словари записей или
+        экземпляры RecordValidationError (например, для строк NDJSON,
+        которые не удалось разобрать).
+        """
+        # Схема справочника не меняется, пока идет вставка; записи и изменения
+        # схемы других справочников вставка не задерживает
+        with self.schema_changes.gate.shared(data_type_id):
+            return self._bulk_insert_data_records(data_type_id, records, created_by, atomic, batch_size)
     
+    def _bulk_insert_data_records(self, data_type_id: int, records: Iterable[Any], created_by: int,
+                                  atomic: bool, batch_size: int) -> Dict[str, Any]:
+        schema = self.schema.get(data_type_id)
+        if not schema:
+            raise ValueError("Тип данных не найден")
+        if not schema['fields'] or not schema['table_exists']:
+            raise ValueError("Нельзя добавлять записи в тип данных без полей. Сначала добавьте поля к типу данных.")
+
+        # Схема и поля читаются один раз до начала транзакции и передаются
+        # в обработку пачек: чтение схемы внутри транзакции не нужно
+        fields = schema['fields']
+        validator = RecordValidator(fields)
+        table_name = f"data_{data_type_id}"
+        columns = validator.storage_columns + ['created_by', 'created_at']
+        insert_sql = f'''
+            INSERT INTO {table_name} ({', '.join(columns)})
+            VALUES ({', '.join('?' * len(columns))})
+        '''
+        created_at = self.get_current_timestamp()
+        report = {'received': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+
+        def add_error(index: int, errors: Dict[str, str]):
+            report['failed'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'index': index, 'errors': errors})
+
+        def insert_batch(conn, cursor, batch: List[tuple]):
+            params = [validator.row(values) + (created_by, created_at) for _, values in batch]
+            # SAVEPOINT в разы замедляет вставку в R*Tree, поэтому он нужен только
+            # в режиме atomic; в обычном режиме пачка - отдельная транзакция
+            if atomic:
+                cursor.execute('SAVEPOINT bulk_batch')
+            try:
+                cursor.executemany(insert_sql, params)
+                inserted = [values for _, values in batch]
+            except sqlite3.Error:
+                # Ищем строки, на которых падает вставка, по одной
+                if atomic:
+                    cursor.execute('ROLLBACK TO bulk_batch')
+                else:
+                    conn.rollback()
+                    self._begin_write(conn)
+                inserted = []
+                for (index, values), row in zip(batch, params):
+                    try:
+                        cursor.execute(insert_sql, row)
+                        inserted.append(values)
+                    except sqlite3.Error as e:
+                        add_error(index, {'_record': str(e)})
+            if atomic:
+                cursor.execute('RELEASE bulk_batch')
+            self._apply_summary_with_cursor(cursor, data_type_id, fields, added=inserted)
+            self.versions.bump_with_cursor(cursor, data_type_id)
+            report['inserted'] += len(inserted)
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            batch = []
+
+            def flush():
+                # В режиме atomic после первой ошибки записи только проверяются
+                if batch and not (atomic and report['failed']):
+                    self._begin_write(conn)
+                    insert_batch(conn, cursor, batch)
+                    if not atomic:
+                        conn.commit()
+                batch.clear()
+
+            try:
+                for index, record in enumerate(records):
+                    report['received'] += 1
+                    try:
+                        if isinstance(record, RecordValidationError):
+                            raise record
+                        batch.append((index, validator.validate(record)))
+                    except RecordValidationError as e:
+                        add_error(index, e.errors)
+                    if len(batch) >= batch_size:
+                        flush()
+                flush()
+                if atomic and report['failed']:
+                    # Все или ничего: при ошибках не вставляется ни одна запись
+                    conn.rollback()
+                    report['inserted'] = 0
+                else:
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        if report['inserted']:
+            # Подписчикам достаточно одного события: записей может быть очень много
+            self._after_write(data_type_id, CHANGE_RESET, count=report['inserted'])
+        report['atomic'] = atomic
+        report['errors_truncated'] = report['failed'] > len(report['errors'])
+        return report
+
     def get_data_record(self, data_type_id: int, record_id: int) -> Optional[Dict[str, Any]]:
         """Получение одной записи данных по ID"""
         with self.get_connection() as conn:
@@ -933,10 +1205,8 @@ class DatabaseManager:
             table_name = f"data_{data_type_id}"
             
             # Проверяем, существует ли таблица
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-            table_exists = cursor.fetchone()
-            
-            if not table_exists:
+            schema = self.schema.get(data_type_id)
+            if not schema or not schema['table_exists']:
                 return None
             
             cursor.execute(f'''
@@ -944,99 +1214,95 @@ class DatabaseManager:
                 WHERE id = ?
             ''', (record_id,))
             
-            # Получаем названия колонок
-            column_names = [description[0] for description in cursor.description]
-            
-            row = cursor.fetchone()
-            if not row:
-                return None
-            
-            record = dict(zip(column_names, row))
-            
-            # Форматируем время создания если оно есть
-            if 'created_at' in record:
-                record['created_at'] = self.format_datetime(record['created_at'])
-            
-            # Парсим координаты из JSON строки обратно в объект
-            import json
-            fields = self.get_data_fields(data_type_id)
-            for field in fields:
-                if field['field_type'] == 'coordinates':
-                    field_name = field['field_name']
-                    if field_name in record and record[field_name]:
-                        try:
-                            record[field_name] = json.loads(record[field_name])
-                        except (json.JSONDecodeError, TypeError):
-                            # Если не удалось распарсить, оставляем как есть
-                            pass
-            
-            return record
+            records = self._read_records(cursor, schema)
+            return records[0][0] if records else None
     
     def update_data_record(self, data_type_id: int, record_id: int, data: Dict[str, Any]) -> bool:
         """Обновление записи данных"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            table_name = f"data_{data_type_id}"
-            
-            # Проверяем, существует ли запись
-            cursor.execute(f"SELECT id FROM {table_name} WHERE id = ?", (record_id,))
-            if not cursor.fetchone():
+        with self.schema_changes.gate.shared(data_type_id):
+            self._update_data_record(data_type_id, record_id, data)
+        self._after_write(data_type_id, CHANGE_UPDATE, record_id)
+        return True
+    
+    def _update_data_record(self, data_type_id: int, record_id: int, data: Dict[str, Any]):
+        table_name = f"data_{data_type_id}"
+        
+        # Подготавливаем данные для обновления (исключаем служебные поля)
+        update_fields = []
+        update_values = []
+        
+        schema = self.schema.get(data_type_id)
+        for key, value in self._storage_items(schema, data):
+            if key not in ['id', 'created_by', 'created_at']:  # Не обновляем служебные поля
+                update_fields.append(f"{key} = ?")
+                update_values.append(value)
+        
+        update_values.append(record_id)
+        
+        update_sql = f'''
+            UPDATE {table_name}
+            SET {', '.join(update_fields)}
+            WHERE id = ?
+        '''
+        
+        def update(cursor):
+            # Проверяем, существует ли запись (старые значения нужны для сводной статистики)
+            old_row = self._fetch_row_with_cursor(cursor, table_name, record_id)
+            if not old_row:
                 raise ValueError("Запись не найдена")
             
-            # Подготавливаем данные для обновления (исключаем служебные поля)
-            update_fields = []
-            update_values = []
-            
-            for key, value in data.items():
-                if key not in ['id', 'created_by', 'created_at']:  # Не обновляем служебные поля
-                    update_fields.append(f"{key} = ?")
-                    update_values.append(value)
-            
             if not update_fields:
                 raise ValueError("Нет полей для обновления")
             
-            update_values.append(record_id)
-            
-            update_sql = f'''
-                UPDATE {table_name}
-                SET {', '.join(update_fields)}
-                WHERE id = ?
-            '''
-            
             cursor.execute(update_sql, update_values)
-            conn.commit()
-            return True
+            self._apply_summary_with_cursor(
+                cursor, data_type_id, schema['fields'] if schema else [],
+                added=[self._fetch_row_with_cursor(cursor, table_name, record_id)],
+                removed=[old_row]
+            )
+            self.versions.bump_with_cursor(cursor, data_type_id)
+        
+        self._write(update)
     
     def delete_data_record(self, data_type_id: int, record_id: int) -> bool:
         """Удаление записи данных"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            table_name = f"data_{data_type_id}"
-            
+        with self.schema_changes.gate.shared(data_type_id):
+            self._delete_data_record(data_type_id, record_id)
+        self._after_write(data_type_id, CHANGE_DELETE, record_id)
+        return True
+    
+    def _delete_data_record(self, data_type_id: int, record_id: int):
+        table_name = f"data_{data_type_id}"
+        schema = self.schema.get(data_type_id)
+        fields = schema['fields'] if schema else []
+        
+        def delete(cursor):
             # Проверяем, существует ли запись
-            cursor.execute(f"SELECT id FROM {table_name} WHERE id = ?", (record_id,))
-            if not cursor.fetchone():
+            old_row = self._fetch_row_with_cursor(cursor, table_name, record_id)
+            if not old_row:
                 raise ValueError("Запись не найдена")
             
             cursor.execute(f"DELETE FROM {table_name} WHERE id = ?", (record_id,))
-            conn.commit()
-            return True
+            self._apply_summary_with_cursor(cursor, data_type_id, fields, removed=[old_row])
+            self.versions.bump_with_cursor(cursor, data_type_id)
+        
+        self._write(delete)
     
-    def get_data_records(self, data_type_id: int, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
-        """Получение записей данных с информацией о пользователе"""
-        with self.get_connection() as conn:
+    def get_data_records(self, data_type_id: int, limit: int = 100, offset: int = 0,
+                         columnar: bool = False):
+        """Получение записей данных с информацией о пользователе
+        
+        columnar=True - записи в колоночном формате (см. response_encoding.columnar_records).
+        """
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
             
             table_name = f"data_{data_type_id}"
             
             # Проверяем, существует ли таблица
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-            table_exists = cursor.fetchone()
-            
-            if not table_exists:
-                return []
+            schema = self.schema.get(data_type_id)
+            if not schema or not schema['table_exists']:
+                return self._records_from_rows([], [], columnar)
             
             # Получаем записи с информацией о пользователе
             if limit > 0:
@@ -1044,7 +1310,7 @@ class DatabaseManager:
                     SELECT d.*, u.username as created_by_username, u.full_name as created_by_full_name
                     FROM {table_name} d
                     LEFT JOIN users u ON d.created_by = u.id
-                    ORDER BY d.created_at DESC
+                    ORDER BY d.created_at DESC, d.id DESC
                     LIMIT ? OFFSET ?
                 ''', (limit, offset))
             else:
@@ -1053,74 +1319,600 @@ class DatabaseManager:
                     SELECT d.*, u.username as created_by_username, u.full_name as created_by_full_name
                     FROM {table_name} d
                     LEFT JOIN users u ON d.created_by = u.id
-                    ORDER BY d.created_at DESC
+                    ORDER BY d.created_at DESC, d.id DESC
                 ''')
             
-            # Получаем названия колонок
-            column_names = [description[0] for description in cursor.description]
-            
-            results = cursor.fetchall()
-            records = []
-            # Получаем поля для парсинга координат
-            import json
-            fields = self.get_data_fields(data_type_id)
-            
-            for row in results:
-                record = dict(zip(column_names, row))
-                # Форматируем время создания если оно есть
-                if 'created_at' in record:
-                    record['created_at'] = self.format_datetime(record['created_at'])
-                # Парсим координаты из JSON строки обратно в объект
-                for field in fields:
-                    if field['field_type'] == 'coordinates':
-                        field_name = field['field_name']
-                        if field_name in record and record[field_name]:
-                            try:
-                                record[field_name] = json.loads(record[field_name])
-                            except (json.JSONDecodeError, TypeError):
-                                # Если не удалось распарсить, оставляем как есть
-                                pass
-                records.append(record)
-            return records
-    
-    def get_data_statistics(self, data_type_id: int) -> Dict[str, Any]:
-        """Получение статистики по данным."""
-        with self.get_connection() as conn:
+            return self._records_from_rows(*self._read_rows(cursor, schema), columnar=columnar)
+    
+    def iter_data_rows(self, data_type_id: int, columns: List[str], limit: int = 0,
+                       batch_size: int = 1000) -> Iterator[List[tuple]]:
+        """Потоковое чтение колонок записей пачками (для экспорта).
+        
+        Генератор берет собственное соединение из пула чтения, а не соединение
+        HTTP-запроса: ответ со стримингом читается уже после завершения запроса.
+        Все пачки читаются из одного снимка; соединение возвращается в пул,
+        когда генератор исчерпан или закрыт.
+        Порядок записей - как в списке записей (новые первыми).
+        """
+        schema = self.schema.get(data_type_id)
+        if not schema or not schema['table_exists']:
+            return
+        for column in columns:
+            if column not in schema['fields_by_name']:
+                raise ValueError(f"Неизвестное поле: {column}")
+        
+        fields = [schema['fields_by_name'][column] for column in columns]
+        sql, params = export_rows_query(f"data_{data_type_id}", fields, limit)
+        conn = self.read_pool.acquire()
+        try:
+            with self._snapshot(conn):
+                yield from iter_row_batches(conn.cursor(), sql, params, batch_size)
+        finally:
+            self.read_pool.release(conn)
+    
+    def get_data_records_page(self, data_type_id: int, limit: int = 100,
+                              after: Optional[str] = None, columnar: bool = False) -> Dict[str, Any]:
+        """Постраничное получение записей по курсору (keyset-пагинация).
+        
+        Курсор имеет вид "<created_at>,<id>" последней полученной записи;
+        каждая страница - поиск по индексу (created_at DESC, id DESC),
+        поэтому ее стоимость не зависит от номера страницы.
+        columnar=True - записи страницы в колоночном формате.
+        """
+        if limit <= 0:
+            raise ValueError("Для постраничного получения limit должен быть больше 0")
+        
+        after_created_at, after_id = self.parse_record_cursor(after) if after else (None, None)
+        
+        # Две выборки страницы (с временем создания и без) - из одного снимка
+        with self.read_snapshot() as conn:
             cursor = conn.cursor()
             
             table_name = f"data_{data_type_id}"
             
-            # Получаем поля типа integer и decimal для статистики
-            cursor.execute('''
-                SELECT field_name FROM data_fields
-                WHERE data_type_id = ? AND field_type IN ('integer', 'decimal')
-            ''', (data_type_id,))
+            schema = self.schema.get(data_type_id)
+            if not schema or not schema['table_exists']:
+                return {'records': self._records_from_rows([], [], columnar), 'next_cursor': None}
             
-            number_fields = [row[0] for row in cursor.fetchall()]
+            select_sql = f'''
+                SELECT d.*, u.username as created_by_username, u.full_name as created_by_full_name
+                FROM {table_name} d
+                LEFT JOIN users u ON d.created_by = u.id
+            '''
+            order_sql = 'ORDER BY d.created_at DESC, d.id DESC LIMIT ?'
             
-            stats = {}
+            columns, page = [], []
+            if after_id is None or after_created_at is not None:
+                # Записи с заполненным временем создания идут первыми
+                if after_id is None:
+                    cursor.execute(f"{select_sql} WHERE d.created_at IS NOT NULL {order_sql}", (limit,))
+                else:
+                    cursor.execute(
+                        f"{select_sql} WHERE (d.created_at, d.id) < (?, ?) {order_sql}",
+                        (after_created_at, after_id, limit)
+                    )
+                columns, rows = self._read_rows(cursor, schema)
+                page.extend(rows)
+            
+            if len(page) < limit:
+                # Записи без времени создания (NULL) - в конце выдачи
+                if after_id is not None and after_created_at is None:
+                    cursor.execute(
+                        f"{select_sql} WHERE d.created_at IS NULL AND d.id < ? {order_sql}",
+                        (after_id, limit - len(page))
+                    )
+                else:
+                    cursor.execute(
+                        f"{select_sql} WHERE d.created_at IS NULL {order_sql}",
+                        (limit - len(page),)
+                    )
+                columns, rows = self._read_rows(cursor, schema)
+                page.extend(rows)
             
-            for field in number_fields:
-                cursor.execute(f'''
-                    SELECT 
-                        COUNT(*) as count,
-                        AVG({field}) as mean,
-                        MIN({field}) as min,
-                        MAX({field}) as max
-                    FROM {table_name}
-                    WHERE {field} IS NOT NULL
-                ''')
-                
-                result = cursor.fetchone()
-                if result and result[0] > 0:
-                    stats[field] = {
-                        'count': result[0],
-                        'mean': result[1],
-                        'min': result[2],
-                        'max': result[3]
-                    }
+            next_cursor = None
+            if len(page) == limit:
+                _, (last_created_at, last_id) = page[-1]
+                next_cursor = f"{last_created_at or ''},{last_id}"
             
-            return stats
+            return {
+                'records': self._records_from_rows(columns, page, columnar),
+                'next_cursor': next_cursor
+            }
+    
+    def query_data_records(self, data_type_id: int, filters: Optional[List[Dict[str, Any]]] = None,
+                           search: Optional[str] = None, sort: Optional[str] = None,
+                           limit: int = 100, offset: int = 0, columnar: bool = False) -> Dict[str, Any]:
+        """Получение страницы записей с фильтрацией, поиском и сортировкой на стороне БД.
+        
+        filters - список условий {"field", "op", "value"} (см. record_query),
+        sort - строка вида "field:asc,other:desc". Возвращает страницу записей
+        и общее количество записей, удовлетворяющих условиям;
+        columnar=True - записи страницы в колоночном формате.
+        """
+        schema = self.schema.get(data_type_id)
+        if not schema or not schema['table_exists']:
+            return {'records': self._records_from_rows([], [], columnar), 'total': 0, 'limit': limit, 'offset': offset}
+        
+        query = RecordQueryCompiler(schema['fields']).compile(filters, search, sort)
+        table_name = f"data_{data_type_id}"
+        from_sql = f'''
+            FROM {table_name} d
+            LEFT JOIN users u ON d.created_by = u.id
+            {query['where']}
+        '''
+        
+        # Общее количество и страница - из одного снимка
+        with self.read_snapshot() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(f"SELECT COUNT(*) {from_sql}", query['params'])
+            total = cursor.fetchone()[0]
+            
+            page_sql = f'''
+                SELECT d.*, u.username as created_by_username, u.full_name as created_by_full_name
+                {from_sql}
+                {query['order_by']}
+            '''
+            params = list(query['params'])
+            if limit > 0:
+                page_sql += ' LIMIT ? OFFSET ?'
+                params += [limit, offset]
+            cursor.execute(page_sql, params)
+            records = self._records_from_rows(*self._read_rows(cursor, schema), columnar=columnar)
+        
+        return {'records': records, 'total': total, 'limit': limit, 'offset': offset}
+    
+    def query_records_within(self, data_type_id: int, field_name: str,
+                             bbox: Optional[Sequence[float]] = None,
+                             center: Optional[Sequence[float]] = None, radius: Optional[float] = None,
+                             filters: Optional[List[Dict[str, Any]]] = None,
+                             limit: int = DEFAULT_WITHIN_LIMIT) -> Dict[str, Any]:
+        """Записи, координаты которых попадают в область или в круг.
+        
+        bbox - (min_lat, min_lng, max_lat, max_lng); center - (широта, долгота)
+        и radius в метрах. Кандидаты отбираются по R*Tree поля, затем точно
+        проверяются по колонкам таблицы, а для круга - по расстоянию (записи
+        в круге идут от ближних к дальним, расстояние - в ключе _distance).
+        """
+        schema = self.schema.get(data_type_id)
+        if not schema or not schema['table_exists']:
+            return {'records': [], 'count': 0, 'truncated': False}
+        field = schema['fields_by_name'].get(field_name)
+        if not field or field['field_type'] != 'coordinates':
+            raise ValueError(f"Поле {field_name} не является полем координат")
+        
+        if center is not None:
+            bbox = radius_bbox(center[0], center[1], radius)
+        min_lat, min_lng, max_lat, max_lng = bbox
+        
+        table_name = f"data_{data_type_id}"
+        lat, lng = coordinate_columns(field_name)
+        clauses = ['r.min_lat <= ? AND r.max_lat >= ?', f"d.{lat} BETWEEN ? AND ?"]
+        params = [max_lat, min_lat, min_lat, max_lat]
+        lng_clauses = []
+        for low, high in longitude_ranges(min_lng, max_lng):
+            lng_clauses.append(f"(r.min_lng <= ? AND r.max_lng >= ? AND d.{lng} BETWEEN ? AND ?)")
+            params += [high, low, low, high]
+        clauses.append(f"({' OR '.join(lng_clauses)})")
+        
+        filter_clauses, filter_params = RecordQueryCompiler(schema['fields']).compile_filters(filters)
+        clauses += filter_clauses
+        params += filter_params
+        
+        distance_sql = ''
+        order_sql = 'ORDER BY d.created_at DESC, d.id DESC'
+        if center is not None:
+            distance = f"haversine(d.{lat}, d.{lng}, ?, ?)"
+            distance_sql = f", {distance} AS _distance"
+            clauses.append(f"{distance} <= ?")
+            params = [center[0], center[1]] + params + [center[0], center[1], radius]
+            order_sql = 'ORDER BY _distance, d.id'
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT d.*, u.username as created_by_username, u.full_name as created_by_full_name
+                       {distance_sql}
+                FROM {rtree_table(table_name, field_name)} r
+                JOIN {table_name} d ON d.id = r.id
+                LEFT JOIN users u ON d.created_by = u.id
+                WHERE {' AND '.join(clauses)}
+                {order_sql}
+                LIMIT ?
+            ''', params + [limit + 1])
+            records = [record for record, _ in self._read_records(cursor, schema)]
+        
+        truncated = len(records) > limit
+        records = records[:limit]
+        return {'records': records, 'count': len(records), 'truncated': truncated}
+    
+    def get_data_changes(self, data_type_id: int, since: int = 0,
+                         limit: int = DEFAULT_CHANGES_LIMIT) -> Dict[str, Any]:
+        """Изменения записей справочника с номером больше since (см. change_log).
+        
+        Для вставок и изменений возвращается текущее состояние записи. Если
+        изменения после since уже удалены сжатием журнала или записи менялись
+        в обход журнала, возвращается reset=True: клиенту нужно перезагрузить
+        записи целиком и продолжить с next_since.
+        """
+        schema = self.schema.get(data_type_id)
+        if not schema or not schema['table_exists']:
+            raise ValueError("Тип данных не найден")
+        
+        # Граница журнала, изменения и записи читаются из одного снимка базы
+        with self.read_snapshot() as conn:
+            cursor = conn.cursor()
+            floor = self.changes.get_floor_with_cursor(cursor, data_type_id)
+            if since < floor:
+                cursor.execute('SELECT MAX(seq) FROM data_changes WHERE data_type_id = ?', (data_type_id,))
+                last_seq = max(cursor.fetchone()[0] or 0, floor)
+                return {'reset': True, 'changes': [], 'next_since': last_seq, 'has_more': False,
+                        'last_seq': last_seq}
+            
+            changes, has_more, next_since, last_seq = self.changes.get_changes_with_cursor(
+                cursor, data_type_id, since, limit
+            )
+            resets = [seq for seq, _, op, _ in changes if op == CHANGE_RESET]
+            if resets:
+                # Записи загружены в обход журнала: продолжать можно только после полной перезагрузки
+                return {'reset': True, 'changes': [], 'next_since': resets[-1],
+                        'has_more': resets[-1] < last_seq, 'last_seq': last_seq}
+            
+            ids = [record_id for _, record_id, op, _ in changes if record_id is not None and op != CHANGE_DELETE]
+            records = self._records_by_id_with_cursor(cursor, data_type_id, schema, ids)
+        
+        return {
+            'reset': False,
+            'changes': [
+                {
+                    'seq': seq,
+                    'op': op,
+                    'record_id': record_id,
+                    'changed_at': datetime.fromtimestamp(changed_at, timezone.utc).isoformat(),
+                    'record': records.get(record_id)
+                }
+                for seq, record_id, op, changed_at in changes
+            ],
+            'next_since': next_since,
+            'has_more': has_more,
+            'last_seq': last_seq
+        }
+    
+    def get_data_records_by_id(self, data_type_id: int, record_ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+        """Записи по списку ID в том же виде, что и в списке записей (с именем автора)."""
+        schema = self.schema.get(data_type_id)
+        if not schema or not schema['table_exists']:
+            return {}
+        with self.get_read_connection() as conn:
+            return self._records_by_id_with_cursor(conn.cursor(), data_type_id, schema, record_ids)
+    
+    def _records_by_id_with_cursor(self, cursor, data_type_id: int, schema: Dict[str, Any],
+                                   record_ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+        if not record_ids:
+            return {}
+        cursor.execute(f'''
+            SELECT d.*, u.username as created_by_username, u.full_name as created_by_full_name
+            FROM data_{data_type_id} d
+            LEFT JOIN users u ON d.created_by = u.id
+            WHERE d.id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(list(record_ids)),))
+        return {record['id']: record for record, _ in self._read_records(cursor, schema)}
+    
+    def compact_changes(self, data_type_id: int, **limits) -> Dict[str, Any]:
+        """Сжатие журнала изменений справочника (см. ChangeLog.compact_with_cursor)."""
+        with self.get_connection() as conn:
+            self._begin_write(conn)
+            result = self.changes.compact_with_cursor(conn.cursor(), data_type_id, **limits)
+            conn.commit()
+        return result
+    
+    def add_change_listener(self, listener: Callable[[int, str, Optional[int]], None]):
+        """Подписка на зафиксированные изменения записей.
+        
+        listener(id справочника, op, id записи) вызывается после фиксации
+        транзакции в потоке, который выполнил изменение; op - вид изменения из
+        change_log (для пакетной вставки - CHANGE_RESET без id записи).
+        """
+        self._change_listeners.append(listener)
+    
+    def _after_write(self, data_type_id: int, op: str, record_id: Optional[int] = None, count: int = 1):
+        """Оповещение подписчиков и периодическое сжатие журнала после фиксации изменения."""
+        for listener in self._change_listeners:
+            try:
+                listener(data_type_id, op, record_id)
+            except Exception as e:
+                # Ошибка подписчика не отменяет уже зафиксированное изменение
+                print(f"⚠️  Ошибка обработчика изменений data_{data_type_id}: {e}")
+        if self.changes.note_changes(data_type_id, count):
+            result = self.compact_changes(data_type_id)
+            print(f"Журнал изменений data_{data_type_id} сжат: удалено {result['removed']}")
+    
+    def cluster_coordinates(self, data_type_id: int, field_name: str, zoom: int,
+                            bbox: Optional[Sequence[float]] = None,
+                            aggregate_fields: Sequence[str] = (),
+                            filters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Кластеры точек поля координат для карты (см. geo_clustering).
+        
+        bbox - видимая область (min_lat, min_lng, max_lat, max_lng), по умолчанию
+        весь мир; aggregate_fields - числовые поля, для которых в каждом
+        кластере считаются среднее, минимум и максимум.
+        """
+        schema = self.schema.get(data_type_id)
+        if not schema or not schema['table_exists']:
+            raise ValueError("Тип данных не найден")
+        fields_by_name = schema['fields_by_name']
+        field = fields_by_name.get(field_name)
+        if not field or field['field_type'] != 'coordinates':
+            raise ValueError(f"Поле {field_name} не является полем координат")
+        for name in aggregate_fields:
+            if name not in fields_by_name or fields_by_name[name]['field_type'] not in ('integer', 'decimal'):
+                raise ValueError(f"Агрегировать можно только числовые поля: {name}")
+        
+        where, params = RecordQueryCompiler(schema['fields']).compile_filters(filters)
+        filter_key = json.dumps(filters, sort_keys=True, ensure_ascii=False) if filters else ''
+        version, _ = self.get_data_version(data_type_id)
+        
+        with self.get_connection() as conn:
+            return self.geo_clusters.clusters_with_cursor(
+                conn.cursor(), f"data_{data_type_id}", version, field_name, zoom,
+                bbox or (-90.0, -180.0, 90.0, 180.0), aggregate_fields, where, params, filter_key
+            )
+    
+    def parse_record_cursor(self, value: str):
+        """Разбор курсора "<created_at>,<id>" в пару (created_at или None, id)."""
+        try:
+            created_at, record_id = value.rsplit(',', 1)
+            return (created_at or None), int(record_id)
+        except (ValueError, AttributeError):
+            raise ValueError("Неверный формат курсора: ожидается <created_at>,<id>")
+    
+    def _read_records(self, cursor, schema: Dict[str, Any]):
+        """Преобразование строк выборки в словари записей.
+        
+        Возвращает пары (запись, (исходный created_at, id)) - исходные значения
+        нужны для построения курсора следующей страницы.
+        """
+        columns, rows = self._read_rows(cursor, schema)
+        return [(dict(zip(columns, values)), raw_key) for values, raw_key in rows]
+    
+    def _read_rows(self, cursor, schema: Dict[str, Any]):
+        """Строки выборки в виде списков значений в порядке колонок ответа.
+        
+        Возвращает (колонки, [(значения, (исходный created_at, id))]). Время
+        создания форматируется, пара колонок координат заменяется объектом
+        под именем поля (на месте колонки широты).
+        """
+        column_names = [description[0] for description in cursor.description]
+        position = {name: index for index, name in enumerate(column_names)}
+        created_at_index = position.get('created_at')
+        id_index = position.get('id')
+        
+        # Координаты собираются из пары колонок в объект
+        coordinate_fields = []
+        for field in schema['fields']:
+            if field['field_type'] != 'coordinates':
+                continue
+            lat_column, lng_column = coordinate_columns(field['field_name'])
+            if lat_column in position:
+                coordinate_fields.append((position[lat_column], position[lng_column]))
+                column_names[position[lat_column]] = field['field_name']
+        dropped = sorted((lng_index for _, lng_index in coordinate_fields), reverse=True)
+        for index in dropped:
+            del column_names[index]
+        
+        # Записи одной пакетной загрузки имеют одинаковое время создания:
+        # каждое значение разбирается один раз
+        formatted = {}
+        rows = []
+        for row in cursor.fetchall():
+            raw_key = (
+                row[created_at_index] if created_at_index is not None else None,
+                row[id_index] if id_index is not None else None
+            )
+            values = list(row)
+            if created_at_index is not None:
+                created_at = values[created_at_index]
+                if created_at not in formatted:
+                    formatted[created_at] = self.format_datetime(created_at)
+                values[created_at_index] = formatted[created_at]
+            for lat_index, lng_index in coordinate_fields:
+                values[lat_index] = join_coordinates(values[lat_index], values[lng_index])
+            for index in dropped:
+                del values[index]
+            rows.append((values, raw_key))
+        return column_names, rows
+    
+    @staticmethod
+    def _records_from_rows(columns: List[str], rows: List[tuple], columnar: bool = False):
+        """Записи для ответа API: список словарей или колоночный формат."""
+        if columnar:
+            return columnar_records(columns, [values for values, _ in rows])
+        return [dict(zip(columns, values)) for values, _ in rows]
+    
+    def get_data_statistics(self, data_type_id: int,
+                            percentiles: Optional[Sequence[float]] = None,
+                            exact: bool = False) -> Dict[str, Any]:
+        """Получение статистики по данным.
+        
+        По умолчанию статистика читается из сводной таблицы field_statistics
+        (медиана и перцентили - приближенные; MIN/MAX, устаревшие после
+        удаления крайних значений, - тоже, до фонового пересчета, см.
+        bounds_approximate). exact=True - точный расчет одним проходом по
+        таблице. Чтение статистики никогда не открывает транзакцию записи.
+        """
+        schema = self.schema.get(data_type_id)
+        if not schema or not schema['table_exists']:
+            return {}
+        
+        percentiles = percentiles if percentiles is not None else DEFAULT_PERCENTILES
+        with self.read_snapshot() as conn:
+            cursor = conn.cursor()
+            if exact:
+                return compute_statistics(cursor, f"data_{data_type_id}", schema['fields'], percentiles)
+            if self.summary.is_complete_with_cursor(cursor, data_type_id, schema['fields']):
+                if self.summary.stale_bounds_with_cursor(cursor, data_type_id):
+                    self.summary_refresher.schedule(data_type_id)
+                return self.summary.get_statistics_with_cursor(cursor, data_type_id, schema['fields'], percentiles)
+            # Сводки еще нет (старая база, прерванная загрузка): она строится в
+            # фоне, а до тех пор статистика считается проходом по снимку
+            self.summary_refresher.schedule(data_type_id)
+            return compute_statistics(cursor, f"data_{data_type_id}", schema['fields'], percentiles)
+    
+    def refresh_statistics(self, data_type_id: int) -> bool:
+        """Фоновое обновление сводки справочника (см. summary_refresh).
+        
+        Проход по таблице выполняется в снимке чтения и записи не блокирует;
+        в транзакции записи результат только сохраняется. Недостающая сводка
+        сохраняется, только если данные справочника не менялись с начала
+        прохода; возвращает False, если сводку обновить не удалось.
+        """
+        table_name = f"data_{data_type_id}"
+        summaries = scanned = None
+        with self.read_snapshot() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+            if not cursor.fetchone():
+                return True
+            # Поля - из того же снимка, что и таблица (в обход кэша схемы)
+            fields = self._get_fields_with_cursor(cursor, data_type_id)
+            if self.summary.is_complete_with_cursor(cursor, data_type_id, fields):
+                scanned = self.summary.scan_bounds_with_cursor(cursor, data_type_id)
+                if not scanned:
+                    return True
+            else:
+                version = self.versions.get_with_cursor(cursor, data_type_id)[0]
+                summaries = self.summary.scan_with_cursor(cursor, data_type_id, fields)
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self._begin_write(conn)
+            if summaries is not None:
+                if self.versions.get_with_cursor(cursor, data_type_id)[0] != version:
+                    conn.rollback()
+                    return False
+                self.summary.replace_with_cursor(cursor, data_type_id, summaries)
+                updated, done = True, True
+            else:
+                count = self.summary.apply_bounds_with_cursor(cursor, data_type_id, scanned)
+                updated, done = count > 0, count == len(scanned)
+            if updated:
+                # Статистика изменилась - ответы /statistics (ETag) тоже
+                self.versions.bump_with_cursor(cursor, data_type_id)
+            conn.commit()
+        return done
+    
+    def rebuild_statistics(self, data_type_id: Optional[int] = None) -> Dict[int, int]:
+        """Перестроение сводной статистики справочника (или всех справочников).
+        
+        Возвращает число учтенных записей по каждому справочнику.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if data_type_id is None:
+                cursor.execute("SELECT id FROM data_types ORDER BY id")
+                ids = [row[0] for row in cursor.fetchall()]
+            else:
+                ids = [data_type_id]
+            
+            result = {}
+            for type_id in ids:
+                self._begin_write(conn)
+                result[type_id] = self.rebuild_statistics_with_cursor(cursor, type_id)
+                conn.commit()
+            return result
+    
+    def rebuild_statistics_with_cursor(self, cursor, data_type_id: int) -> int:
+        """Перестроение сводной статистики с использованием существующего курсора."""
+        fields = self._get_fields_with_cursor(cursor, data_type_id)
+        # Перестроенная статистика может отличаться от накопленной - ответы /statistics меняются
+        self.versions.bump_with_cursor(cursor, data_type_id)
+        return self.summary.rebuild_with_cursor(cursor, data_type_id, fields)
+    
+    def _get_fields_with_cursor(self, cursor, data_type_id: int) -> List[Dict[str, Any]]:
+        """Имена и типы полей справочника в текущей транзакции (в обход кэша схемы)."""
+        cursor.execute('''
+            SELECT field_name, field_type
+            FROM data_fields
+            WHERE data_type_id = ?
+            ORDER BY id
+        ''', (data_type_id,))
+        return [{'field_name': row[0], 'field_type': row[1]} for row in cursor.fetchall()]
+    
+    @staticmethod
+    def _fetch_row_with_cursor(cursor, table_name: str, record_id: int) -> Optional[Dict[str, Any]]:
+        """Строка таблицы данных в виде словаря в текущем состоянии транзакции."""
+        cursor.execute(f"SELECT * FROM {table_name} WHERE id = ?", (record_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+    
+    @staticmethod
+    def _storage_items(schema: Optional[Dict[str, Any]], data: Dict[str, Any]) -> List[tuple]:
+        """Пары (колонка, значение) для записи в таблицу: координаты - в две колонки."""
+        fields_by_name = schema['fields_by_name'] if schema else {}
+        items = []
+        for key, value in data.items():
+            field = fields_by_name.get(key)
+            if field and field['field_type'] == 'coordinates':
+                items.extend(zip(coordinate_columns(key), split_coordinates(value)))
+            else:
+                items.append((key, value))
+        return items
+    
+    def enable_group_commit(self, max_batch: int = DEFAULT_MAX_BATCH, max_delay: float = DEFAULT_MAX_DELAY,
+                            synchronous: str = DEFAULT_SYNCHRONOUS) -> GroupCommitWriter:
+        """Включение групповой фиксации для вставки, изменения и удаления записей.
+        
+        Операции выполняет один поток-писатель на отдельном соединении с
+        PRAGMA synchronous=<synchronous>; вызывающий получает результат после
+        фиксации группы. Без групповой фиксации каждая операция фиксируется
+        отдельно в соединении вызывающего потока.
+        """
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Неизвестный режим synchronous: {synchronous}")
+        if self.writer is None:
+            self.writer = GroupCommitWriter(
+                lambda: self.pool.connect_dedicated([f"PRAGMA synchronous={synchronous}"]),
+                max_batch=max_batch, max_delay=max_delay
+            )
+            self.writer.start()
+            atexit.register(self.writer.stop)
+        return self.writer
+    
+    def _write(self, operation: Callable[[sqlite3.Cursor], Any]) -> Any:
+        """Выполнение операции записи (функции от курсора) и фиксация.
+        
+        Операция пишет только через переданный курсор: при групповой
+        фиксации она выполняется в потоке-писателе на его соединении.
+        Вызывается под schema_changes.gate.shared(data_type_id), взятой
+        вместе с чтением схемы, по которой построена операция.
+        """
+        local_conn = getattr(self._local, 'conn', None)
+        # Внутри уже открытой транзакции писатель ждал бы блокировку этого же потока
+        if self.writer is not None and not (local_conn is not None and local_conn.in_transaction):
+            return self.writer.submit(operation)
+        with self.get_connection() as conn:
+            self._begin_write(conn)
+            result = operation(conn.cursor())
+            conn.commit()
+        return result
+    
+    @staticmethod
+    def _begin_write(conn: sqlite3.Connection):
+        """Захват блокировки записи до чтения строк, которые будут изменены."""
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+    
+    def _apply_summary_with_cursor(self, cursor, data_type_id: int, fields: List[Dict[str, Any]],
+                                   added=(), removed=()):
+        """Обновление сводной статистики в транзакции изменения записей.
+        
+        Поля справочника передает вызывающий: схема читается до начала
+        транзакции, а не через отдельное соединение внутри нее.
+        """
+        self.summary.apply_with_cursor(cursor, data_type_id, fields, added, removed)
     
     def generate_users(self, count: int, role: str = 'user') -> List[Dict[str, Any]]:
         """Автоматическая генерация пользователей."""
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Офлайн-загрузка больших файлов CSV/NDJSON в справочник.
+Использование: python datavue_load.py <файл> --data-type <id или название> [параметры]
+На время загрузки база блокируется монопольно, поэтому сервер лучше остановить.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from database import DatabaseManager
+from record_validation import RecordValidator, RecordValidationError, iter_stream_lines
+from csv_import import CsvRecordReader, open_text_stream
+from spatial_index import drop_stale_spatial_indexes_with_cursor
+from change_log import CHANGE_RESET
+
+# Сколько записей разбирается одной задачей пула
+CHUNK_SIZE = 5000
+
+# Как часто фиксировать транзакцию (в записях): ограничивает размер WAL
+COMMIT_EVERY = 200000
+
+# Сколько сообщений об ошибках выводить
+MAX_PRINTED_ERRORS = 20
+
+# PRAGMA на время загрузки: монопольная блокировка, без fsync, большой кэш страниц
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA locking_mode=EXCLUSIVE",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA cache_size=-262144",  # 256 МБ
+    "PRAGMA temp_store=MEMORY",
+)
+RESTORE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=10000",
+    "PRAGMA locking_mode=NORMAL",
+)
+
+_validator: Optional[RecordValidator] = None
+
+
+def _init_worker(fields: List[Dict[str, Any]]):
+    global _validator
+    _validator = RecordValidator(fields)
+
+
+def parse_chunk(kind: str, items: List[Tuple[int, Any]]) -> Tuple[List[tuple], List[Tuple[int, Dict[str, str]]]]:
+    """Разбор и проверка пачки записей (выполняется в процессе пула).
+
+    items - пары (номер записи, строка NDJSON или словарь из CSV); возвращаются
+    параметры для executemany в порядке колонок и ошибки по номерам записей.
+    """
+    rows, errors = [], []
+    for index, item in items:
+        try:
+            record = json.loads(item) if kind == 'ndjson' else item
+            values = _validator.validate(record)
+        except RecordValidationError as e:
+            errors.append((index, e.errors))
+            continue
+        except ValueError as e:
+            errors.append((index, {'_record': f'неверный JSON: {e}'}))
+            continue
+        rows.append(_validator.row(values))
+    return rows, errors
+
+
+def detect_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    return 'ndjson' if extension in ('.ndjson', '.jsonl') else 'csv'
+
+
+def iter_chunks(file, kind: str, fields: List[Dict[str, Any]], errors: List,
+                chunk_size: int, delimiter: Optional[str] = None):
+    """Пачки (номер, запись) из файла. Ошибки разбора CSV сразу попадают в errors."""
+    if kind == 'ndjson':
+        records = (line for line in iter_stream_lines(file) if line.strip())
+    else:
+        records = CsvRecordReader(open_text_stream(file), fields, delimiter)
+
+    chunk = []
+    for index, record in enumerate(records):
+        if isinstance(record, RecordValidationError):
+            errors.append((index, record.errors))
+            continue
+        chunk.append((index, record))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parsed_chunks(chunks, kind: str, fields: List[Dict[str, Any]], workers: int):
+    """Результаты разбора пачек в исходном порядке.
+
+    Пачки разбираются в пуле процессов, а в работе одновременно не больше
+    2 * workers пачек, поэтому файл не читается в память целиком.
+    """
+    if workers <= 0:
+        _init_worker(fields)
+        for chunk in chunks:
+            yield parse_chunk(kind, chunk)
+        return
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(fields,)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(parse_chunk, kind, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _drop_indexes_with_cursor(cursor, table_name: str) -> List[Tuple[str, str]]:
+    """Удаление индексов таблицы; возвращает имена и SQL для их восстановления."""
+    cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table_name,)
+    )
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f"DROP INDEX {name}")
+    return indexes
+
+
+def _restore_table_with_cursor(db: DatabaseManager, cursor, data_type_id: int,
+                               fields: List[Dict[str, Any]], indexes: List[Tuple[str, str]]):
+    """Восстановление индексов, R*Tree, триггеров журнала и сводной статистики после загрузки.
+
+    Повторный вызов безопасен: создаются только недостающие индексы и триггеры.
+    """
+    for name, sql in indexes:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+        if cursor.fetchone() is None:
+            cursor.execute(sql)
+    db.create_spatial_indexes_with_cursor(cursor, data_type_id, fields)
+    db.changes.create_triggers_with_cursor(cursor, data_type_id)
+    db.changes.record_with_cursor(cursor, data_type_id, CHANGE_RESET)
+    db.rebuild_statistics_with_cursor(cursor, data_type_id)
+
+
+def _restore_after_failure(db: DatabaseManager, conn, data_type_id: int, fields: List[Dict[str, Any]],
+                           indexes: List[Tuple[str, str]], verbose: bool):
+    """Возврат индексов и триггеров таблице, в которой уже зафиксирована часть загрузки."""
+    if verbose:
+        print("Загрузка прервана: восстанавливаем индексы, триггеры и сводную статистику...")
+    try:
+        conn.execute('BEGIN EXCLUSIVE')
+        _restore_table_with_cursor(db, conn.cursor(), data_type_id, fields, indexes)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Не удалось восстановить индексы data_{data_type_id}: {e}. "
+              f"Их создаст сервер при следующем запуске")
+
+
+def load_file(db: DatabaseManager, data_type_id: int, path: str, created_by: Optional[int] = None,
+              file_format: Optional[str] = None, truncate: bool = False, workers: int = 0,
+              chunk_size: int = CHUNK_SIZE, delimiter: Optional[str] = None,
+              verbose: bool = True) -> Dict[str, Any]:
+    """Загрузка файла в таблицу справочника.
+
+    Файл разбирается и проверяется в пуле из workers процессов (0 - в текущем
+    процессе), а вставку выполняет одно соединение через executemany под
+    монопольной блокировкой. Индексы таблицы (и R*Tree полей координат вместе
+    с триггерами) на время загрузки удаляются и строятся заново в конце, затем
+    перестраивается сводная статистика и выполняется ANALYZE. Если загрузка
+    прервана после промежуточной фиксации, индексы, триггеры и статистика
+    восстанавливаются в отдельной транзакции; если процесс убит, сводная
+    статистика уже сброшена, а индексы и триггеры создаст сервер при запуске.
+    """
+    schema = db.schema.get(data_type_id)
+    if not schema or not schema['table_exists']:
+        raise ValueError(f"Справочник {data_type_id} не найден")
+    fields = schema['fields']
+    if not fields:
+        raise ValueError("У справочника нет полей")
+
+    kind = file_format or detect_format(path)
+    table_name = f"data_{data_type_id}"
+    columns = RecordValidator(fields).storage_columns + ['created_by', 'created_at']
+    insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    tail = (created_by, db.get_current_timestamp())
+
+    errors = []
+    loaded = 0
+    started = time.perf_counter()
+    last_report = started
+
+    with db.get_connection() as conn, open(path, 'rb') as file:
+        cursor = conn.cursor()
+        for pragma in BULK_LOAD_PRAGMAS:
+            cursor.execute(pragma)
+        indexes: List[Tuple[str, str]] = []
+        committed = False
+        try:
+            conn.execute('BEGIN EXCLUSIVE')
+            drop_stale_spatial_indexes_with_cursor(cursor, table_name)
+            # Построчный журнал изменений при загрузке не ведется: клиенты
+            # синхронизации получат отметку о полной перезагрузке
+            db.changes.drop_triggers_with_cursor(cursor, data_type_id)
+            # Отметка о перезагрузке и сброс сводной статистики фиксируются
+            # вместе с удалением индексов: даже если процесс будет убит, клиенты
+            # не пропустят загруженные записи, а статистика будет перестроена
+            db.changes.record_with_cursor(cursor, data_type_id, CHANGE_RESET)
+            db.summary.delete_with_cursor(cursor, data_type_id)
+            if truncate:
+                cursor.execute(f"DELETE FROM {table_name}")
+            indexes = _drop_indexes_with_cursor(cursor, table_name)
+
+            since_commit = 0
+            chunks = iter_chunks(file, kind, fields, errors, chunk_size, delimiter)
+            for rows, chunk_errors in _parsed_chunks(chunks, kind, fields, workers):
+                errors.extend(chunk_errors)
+                cursor.executemany(insert_sql, [row + tail for row in rows])
+                loaded += len(rows)
+                since_commit += len(rows)
+                if since_commit >= COMMIT_EVERY:
+                    conn.commit()
+                    committed = True
+                    conn.execute('BEGIN EXCLUSIVE')
+                    since_commit = 0
+                now = time.perf_counter()
+                if verbose and now - last_report >= 1:
+                    last_report = now
+                    print(f"Загружено {loaded} записей ({loaded / (now - started):.0f} записей/с)...")
+
+            load_seconds = time.perf_counter() - started
+            if verbose:
+                print("Строим индексы и сводную статистику...")
+            _restore_table_with_cursor(db, cursor, data_type_id, fields, indexes)
+            conn.commit()
+            committed = False
+            cursor.execute(f"ANALYZE {table_name}")
+            conn.commit()
+        except BaseException:
+            # В том числе Ctrl+C: откатывается только текущая транзакция
+            conn.rollback()
+            if committed:
+                _restore_after_failure(db, conn, data_type_id, fields, indexes, verbose)
+            raise
+        finally:
+            for pragma in RESTORE_PRAGMAS:
+                cursor.execute(pragma)
+
+    total_seconds = time.perf_counter() - started
+    errors.sort(key=lambda error: error[0])
+    return {
+        'loaded': loaded,
+        'rejected': len(errors),
+        'errors': errors,
+        'load_seconds': load_seconds,
+        'total_seconds': total_seconds,
+        'rows_per_second': loaded / load_seconds if load_seconds > 0 else None
+    }
+
+
+def resolve_data_type(db: DatabaseManager, value: str) -> Optional[int]:
+    """ID справочника по номеру или названию."""
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        if value.isdigit():
+            cursor.execute('SELECT id FROM data_types WHERE id = ?', (int(value),))
+        else:
+            cursor.execute('SELECT id FROM data_types WHERE name = ?', (value,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Офлайн-загрузка CSV/NDJSON в справочник DataVue')
+    parser.add_argument('file', help='Файл CSV или NDJSON (.ndjson, .jsonl)')
+    parser.add_argument('--data-type', required=True, help='ID или название справочника')
+    parser.add_argument('--db', default='datavue.db', help='Путь к базе данных (по умолчанию datavue.db)')
+    parser.add_argument('--format', choices=('csv', 'ndjson'), help='Формат файла (по умолчанию - по расширению)')
+    parser.add_argument('--delimiter', help='Разделитель CSV (по умолчанию определяется по заголовку)')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help='Число процессов для разбора файла (0 - без пула)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Записей в одной пачке')
+    parser.add_argument('--truncate', action='store_true', help='Удалить существующие записи перед загрузкой')
+    parser.add_argument('--user', default='admin', help='Логин пользователя, от имени которого создаются записи')
+    args = parser.parse_args(argv)
+
+    db = DatabaseManager(args.db, pool_size=1)
+    data_type_id = resolve_data_type(db, args.data_type)
+    if data_type_id is None:
+        print(f"❌ Справочник '{args.data_type}' не найден")
+        return 1
+
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM users WHERE username = ?', (args.user,))
+        user = cursor.fetchone()
+    if not user:
+        print(f"❌ Пользователь '{args.user}' не найден")
+        return 1
+
+    delimiter = '\t' if args.delimiter == 'tab' else args.delimiter
+    try:
+        result = load_file(db, data_type_id, args.file, created_by=user[0], file_format=args.format,
+                           truncate=args.truncate, workers=args.workers, chunk_size=args.chunk_size,
+                           delimiter=delimiter)
+    except (OSError, ValueError) as e:
+        print(f"❌ Ошибка загрузки: {e}")
+        return 1
+
+    for index, error in result['errors'][:MAX_PRINTED_ERRORS]:
+        print(f"⚠️  Запись {index + 1}: " + '; '.join(f"{name}: {message}" for name, message in error.items()))
+    print(f"✅ Загружено записей: {result['loaded']}, отклонено: {result['rejected']}")
+    print(f"⏱  Вставка: {result['load_seconds']:.2f} с ({result['rows_per_second'] or 0:.0f} записей/с), "
+          f"всего с индексами и статистикой: {result['total_seconds']:.2f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
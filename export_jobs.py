@@ -0,0 +1,540 @@
+"""Фоновые задания экспорта: очередь, процессы заданий, прогресс, отмена и хранение файлов.
+
+Модуль запускается и как скрипт процесса задания: python export_jobs.py <db_path> <job_id>.
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from connection_pool import connect_read_only
+from exports import (
+    EXPORT_BATCH_SIZE, CSV_MIMETYPE, XLSX_MIMETYPE, export_rows_query, iter_row_batches,
+    export_filename, iter_csv, write_xlsx
+)
+
+# Формат задания -> (расширение файла, MIME-тип)
+EXPORT_FORMATS = {
+    'csv': ('csv', CSV_MIMETYPE),
+    'xlsx': ('xlsx', XLSX_MIMETYPE)
+}
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+# Как часто (в секундах) процесс экспорта сохраняет прогресс и проверяет отмену
+PROGRESS_INTERVAL = 0.5
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+JOB_COLUMNS = (
+    'id', 'data_type_id', 'user_id', 'format', 'status', 'rows_total', 'rows_done',
+    'file_name', 'file_size', 'error', 'created_at', 'started_at', 'finished_at', 'expires_at'
+)
+
+
+class ExportJobError(Exception):
+    """Ошибка постановки или обработки задания экспорта."""
+
+
+class ExportQueueFullError(ExportJobError):
+    """Превышен лимит одновременных заданий экспорта."""
+
+
+class ExportCancelled(Exception):
+    """Задание отменено пользователем во время выполнения."""
+
+
+def _now() -> str:
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+
+def _after(seconds: float) -> str:
+    return (datetime.now() + timedelta(seconds=seconds)).strftime(TIMESTAMP_FORMAT)
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def create_table_with_cursor(cursor):
+    """Таблица заданий экспорта."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            id TEXT PRIMARY KEY,
+            data_type_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            format TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            rows_total INTEGER,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            file_name TEXT NOT NULL,
+            file_path TEXT,
+            file_size INTEGER,
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            owner_pid INTEGER,
+            created_at TIMESTAMP NOT NULL,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            expires_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_export_jobs_user ON export_jobs(user_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_export_jobs_status ON export_jobs(status)')
+
+
+class _ProgressTracker:
+    """Учет прогресса в процессе экспорта.
+
+    Прогресс пишется в базу не чаще раза в PROGRESS_INTERVAL секунд; в тот же
+    момент проверяется флаг отмены, и выполнение прерывается ExportCancelled.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, job_id: str):
+        self.conn = conn
+        self.job_id = job_id
+        self.rows_done = 0
+        self._last_update = time.monotonic()
+
+    def advance(self, rows: int):
+        self.rows_done += rows
+        if time.monotonic() - self._last_update >= PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self._last_update = time.monotonic()
+        with self.conn:
+            self.conn.execute('UPDATE export_jobs SET rows_done = ? WHERE id = ?',
+                              (self.rows_done, self.job_id))
+            row = self.conn.execute('SELECT cancel_requested FROM export_jobs WHERE id = ?',
+                                    (self.job_id,)).fetchone()
+        if row is None or row[0]:
+            raise ExportCancelled()
+
+    def wrap(self, batches):
+        for rows in batches:
+            yield rows
+            self.advance(len(rows))
+
+
+def run_export_job(db_path: str, job_id: str) -> str:
+    """Выполнение задания в отдельном процессе; возвращает итоговый статус.
+
+    Процесс работает со своими соединениями: одно читает данные, второе
+    (короткими транзакциями) обновляет состояние задания. Файл пишется
+    рядом с итоговым под именем *.part и переименовывается только после
+    успешного завершения, поэтому скачать недописанный файл нельзя.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            row = conn.execute(
+                'SELECT data_type_id, params, file_path, status, cancel_requested FROM export_jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return 'missing'
+            data_type_id, params, path, status, cancel_requested = row
+            params = json.loads(params)
+            if status != 'queued':
+                return status
+            if cancel_requested:
+                _set_finished(conn, job_id, 'cancelled', params['ttl'])
+                return 'cancelled'
+            conn.execute("UPDATE export_jobs SET status = 'running', started_at = ? WHERE id = ?",
+                         (_now(), job_id))
+
+        part_path = path + '.part'
+        try:
+            rows = _write_artifact(db_path, conn, job_id, data_type_id, params, part_path)
+            os.replace(part_path, path)
+        except ExportCancelled:
+            _remove(part_path)
+            with conn:
+                _set_finished(conn, job_id, 'cancelled', params['ttl'])
+            return 'cancelled'
+        except Exception as e:
+            _remove(part_path)
+            with conn:
+                _set_finished(conn, job_id, 'failed', params['ttl'], str(e))
+            return 'failed'
+
+        with conn:
+            conn.execute('''
+                UPDATE export_jobs
+                SET status = 'done', rows_done = ?, file_size = ?, finished_at = ?,
+                    expires_at = ?
+                WHERE id = ?
+            ''', (rows, os.path.getsize(path), _now(), _after(params['ttl']), job_id))
+        return 'done'
+    finally:
+        conn.close()
+
+
+def _set_finished(conn: sqlite3.Connection, job_id: str, status: str, ttl: int,
+                  error: Optional[str] = None):
+    conn.execute(
+        'UPDATE export_jobs SET status = ?, error = ?, finished_at = ?, expires_at = ? WHERE id = ?',
+        (status, error, _now(), _after(ttl), job_id)
+    )
+
+
+def _write_artifact(db_path: str, conn: sqlite3.Connection, job_id: str, data_type_id: int,
+                    params: Dict[str, Any], path: str) -> int:
+    fields = params['fields']
+    table_name = f"data_{data_type_id}"
+    limit = params.get('limit') or 0
+
+    # Отдельное соединение только для чтения: открытый SELECT не мешает
+    # фиксировать прогресс через основное соединение. Количество строк и сами
+    # строки читаются из одного снимка
+    reader = connect_read_only(db_path)
+    try:
+        reader.execute('BEGIN')
+        cursor = reader.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+        total = cursor.fetchone()[0]
+        if limit > 0:
+            total = min(total, limit)
+        with conn:
+            conn.execute('UPDATE export_jobs SET rows_total = ? WHERE id = ?', (total, job_id))
+
+        tracker = _ProgressTracker(conn, job_id)
+        sql, sql_params = export_rows_query(table_name, fields, limit)
+        batches = tracker.wrap(iter_row_batches(cursor, sql, sql_params, EXPORT_BATCH_SIZE))
+
+        if params['format'] == 'xlsx':
+            write_xlsx(path, batches, fields, params['include_headers'], params['include_descriptions'])
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as file:
+                for chunk in iter_csv(batches, fields, params['include_headers'],
+                                      params['include_descriptions']):
+                    file.write(chunk)
+        # Последняя проверка отмены перед публикацией файла
+        tracker.flush()
+        return tracker.rows_done
+    finally:
+        reader.close()
+
+
+def _remove(path: Optional[str]):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ExportJobManager:
+    """Очередь заданий экспорта в веб-процессе.
+
+    Задания хранятся в таблице export_jobs, а выполняются в отдельных
+    процессах, поэтому формирование больших файлов не занимает потоки
+    веб-сервера и не конкурирует с ними за GIL. Процесс задания запускает
+    этот модуль как скрипт: в отличие от multiprocessing (spawn), он не
+    импортирует заново главный модуль веб-сервера, не создает его объекты и
+    не выполняет восстановление заданий. Очередь ведет пул из max_workers
+    потоков, каждый ждет свой процесс. Число заданий в очереди (всего и на
+    пользователя) ограничено. Готовые файлы лежат в artifact_dir и удаляются
+    по истечении ttl секунд.
+    """
+
+    def __init__(self, db, artifact_dir: str = 'exports', max_workers: int = 2,
+                 max_pending: int = 20, max_per_user: int = 3, ttl: int = 24 * 3600):
+        self.db = db
+        self.artifact_dir = os.path.abspath(artifact_dir)
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        self._executor = None
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._processes = set()
+        self._submitted = 0
+        self._rejected = 0
+
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            create_table_with_cursor(cursor)
+            self._recover_orphans_with_cursor(cursor)
+            conn.commit()
+        atexit.register(self.shutdown)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='datavue-export'
+                )
+            return self._executor
+
+    def _run_process(self, db_path: str, job_id: str) -> str:
+        """Выполнение задания в отдельном процессе; возвращает итоговый статус."""
+        # Новый интерпретатор не наследует потоки и соединения веб-сервера
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), db_path, job_id],
+            stdout=subprocess.PIPE
+        )
+        with self._lock:
+            self._processes.add(process)
+        try:
+            output, _ = process.communicate()
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        if process.returncode != 0:
+            raise ExportJobError(f"код завершения {process.returncode}")
+        return output.decode('utf-8').strip()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            processes = list(self._processes)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def _recover_orphans_with_cursor(self, cursor):
+        """Задания, чей веб-процесс завершился, уже никто не выполнит."""
+        cursor.execute(
+            f"SELECT id, owner_pid, file_path FROM export_jobs WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))})",
+            ACTIVE_STATUSES
+        )
+        for job_id, owner_pid, path in cursor.fetchall():
+            if owner_pid != os.getpid() and _pid_alive(owner_pid):
+                continue
+            _remove(path and path + '.part')
+            cursor.execute('''
+                UPDATE export_jobs
+                SET status = 'failed', error = ?, finished_at = ?, expires_at = ?
+                WHERE id = ?
+            ''', ('Экспорт прерван перезапуском сервера', _now(), _after(self.ttl), job_id))
+
+    def submit(self, user_id: int, data_type: Dict[str, Any], fields: List[Dict[str, Any]],
+               export_format: str, limit: int = 0, include_headers: bool = True,
+               include_descriptions: bool = False) -> Dict[str, Any]:
+        """Постановка задания в очередь."""
+        if export_format not in EXPORT_FORMATS:
+            raise ExportJobError(f"Неподдерживаемый формат экспорта: {export_format}")
+        self.cleanup_expired()
+
+        extension = EXPORT_FORMATS[export_format][0]
+        job_id = uuid.uuid4().hex
+        file_name = export_filename(data_type['name'], extension)
+        path = os.path.join(self.artifact_dir, f"{job_id}.{extension}")
+        params = {
+            'format': export_format,
+            'fields': [{'field_name': f['field_name'], 'field_type': f['field_type'],
+                        'description': f['description']} for f in fields],
+            'limit': limit,
+            'include_headers': include_headers,
+            'include_descriptions': include_descriptions,
+            'ttl': self.ttl
+        }
+
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            # Проверка лимитов и вставка - в одной транзакции записи
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute(
+                    "SELECT COUNT(*), SUM(user_id = ?) FROM export_jobs WHERE status IN ('queued', 'running')",
+                    (user_id,)
+                )
+                pending, user_pending = cursor.fetchone()
+                if pending >= self.max_pending:
+                    raise ExportQueueFullError("Очередь экспорта заполнена, повторите попытку позже")
+                if (user_pending or 0) >= self.max_per_user:
+                    raise ExportQueueFullError(
+                        f"Одновременно можно выполнять не более {self.max_per_user} экспортов"
+                    )
+                cursor.execute('''
+                    INSERT INTO export_jobs
+                    (id, data_type_id, user_id, format, params, file_name, file_path, owner_pid, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (job_id, data_type['id'], user_id, export_format, json.dumps(params),
+                      file_name, path, os.getpid(), _now()))
+                conn.commit()
+            except ExportQueueFullError:
+                conn.rollback()
+                with self._lock:
+                    self._rejected += 1
+                raise
+            except Exception:
+                conn.rollback()
+                raise
+
+        try:
+            future = self._get_executor().submit(self._run_process, os.path.abspath(self.db.db_path), job_id)
+        except Exception as e:
+            self._finish(job_id, 'failed', f"Не удалось запустить экспорт: {e}")
+            raise ExportJobError(f"Не удалось запустить экспорт: {e}")
+        with self._lock:
+            self._futures[job_id] = future
+            self._submitted += 1
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return self.get(job_id)
+
+    def _on_done(self, job_id: str, future):
+        """Задание, чей процесс упал (или был отменен до запуска), переводится в конечный статус."""
+        with self._lock:
+            self._futures.pop(job_id, None)
+        if future.cancelled():
+            self._finish(job_id, 'cancelled')
+        elif future.exception() is not None:
+            self._finish(job_id, 'failed', f"Процесс экспорта завершился с ошибкой: {future.exception()}")
+
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None):
+        """Перевод активного задания в конечный статус (если оно еще активно)."""
+        with self.db.get_connection() as conn:
+            conn.execute('''
+                UPDATE export_jobs
+                SET status = ?, error = COALESCE(?, error), finished_at = ?, expires_at = ?
+                WHERE id = ? AND status IN ('queued', 'running')
+            ''', (status, error, _now(), _after(self.ttl), job_id))
+            conn.commit()
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        job = dict(zip(JOB_COLUMNS, row))
+        total = job['rows_total']
+        if job['status'] == 'done':
+            job['progress'] = 100
+        elif total:
+            job['progress'] = min(100, round(job['rows_done'] * 100 / total))
+        else:
+            job['progress'] = 0
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние задания или None."""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM export_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Задания пользователя (или все задания, если user_id не задан), новые первыми."""
+        self.cleanup_expired()
+        sql = f"SELECT {', '.join(JOB_COLUMNS)} FROM export_jobs"
+        params = ()
+        if user_id is not None:
+            sql += ' WHERE user_id = ?'
+            params = (user_id,)
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql + ' ORDER BY created_at DESC, rowid DESC', params)
+            return [self._row_to_job(row) for row in cursor.fetchall()]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Отмена активного задания либо удаление завершенного вместе с файлом."""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status, file_path FROM export_jobs WHERE id = ?', (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            status, path = row
+            if status in ACTIVE_STATUSES:
+                # Выполняющийся процесс увидит флаг при очередном обновлении прогресса
+                cursor.execute('UPDATE export_jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+                conn.commit()
+            else:
+                cursor.execute('DELETE FROM export_jobs WHERE id = ?', (job_id,))
+                conn.commit()
+                _remove(path)
+                return {'id': job_id, 'status': 'deleted'}
+
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            # Задание еще не начато - снимаем его из очереди пула сразу
+            self._finish(job_id, 'cancelled')
+        return self.get(job_id)
+
+    def get_artifact(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Путь, имя и MIME-тип готового файла (None, если файл недоступен)."""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT user_id, format, file_name, file_path, expires_at FROM export_jobs "
+                "WHERE id = ? AND status = 'done'",
+                (job_id,)
+            )
+            row = cursor.fetchone()
+        if row is None or row[4] <= _now() or not os.path.exists(row[3]):
+            return None
+        return {
+            'user_id': row[0],
+            'file_name': row[2],
+            'path': row[3],
+            'mimetype': EXPORT_FORMATS[row[1]][1]
+        }
+
+    def cleanup_expired(self) -> int:
+        """Удаление завершенных заданий с истекшим сроком хранения и их файлов."""
+        now = _now()
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, file_path FROM export_jobs "
+                f"WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND expires_at <= ?",
+                FINISHED_STATUSES + (now,)
+            )
+            expired = cursor.fetchall()
+            if not expired:
+                return 0
+            cursor.executemany('DELETE FROM export_jobs WHERE id = ?', [(job_id,) for job_id, _ in expired])
+            conn.commit()
+        for _, path in expired:
+            _remove(path)
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика очереди для /api/admin/stats."""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status, COUNT(*) FROM export_jobs GROUP BY status')
+            by_status = dict(cursor.fetchall())
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'max_per_user': self.max_per_user,
+                'ttl': self.ttl,
+                'executor_started': self._executor is not None,
+                'in_flight': len(self._futures),
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'jobs': by_status
+            }
+
+
+if __name__ == '__main__':
+    # Процесс задания (см. ExportJobManager._run_process): статус - в stdout
+    print(run_export_job(sys.argv[1], sys.argv[2]))
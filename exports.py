@@ -0,0 +1,216 @@
+"""Потоковый экспорт записей справочников в CSV и Excel."""
+
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.utils import get_column_letter
+
+from spatial_index import coordinates_text_sql
+
+# Сколько строк читается из базы и форматируется за один шаг
+EXPORT_BATCH_SIZE = 1000
+
+CSV_MIMETYPE = 'text/csv'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Предел строк на листе Excel; при его достижении создается следующий лист
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMN_WIDTH = 50
+
+# Размер фрагмента при отдаче готового файла клиенту
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def select_export_fields(all_fields: List[Dict[str, Any]],
+                         selected_fields: Optional[Sequence[str]]) -> List[Dict[str, Any]]:
+    """Поля для экспорта в порядке, выбранном пользователем (по умолчанию - все)."""
+    if not selected_fields:
+        return all_fields
+    field_order = {name: idx for idx, name in enumerate(selected_fields)}
+    fields = [f for f in all_fields if f['field_name'] in field_order]
+    fields.sort(key=lambda f: field_order[f['field_name']])
+    return fields
+
+
+def export_headers(fields: List[Dict[str, Any]], include_descriptions: bool) -> List[str]:
+    """Заголовки колонок (с описаниями полей, если нужно)."""
+    if include_descriptions:
+        return [f"{field['field_name']} ({field['description']})" for field in fields]
+    return [field['field_name'] for field in fields]
+
+
+def export_filename(data_type_name: str, extension: str) -> str:
+    """Имя файла выгрузки: <название>_<время>.<расширение>."""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    safe_name = data_type_name.replace(' ', '_').replace('(', '').replace(')', '').replace(',', '')
+    return f"{safe_name}_{timestamp}.{extension}"
+
+
+def export_rows_query(table_name: str, fields: Sequence[Dict[str, Any]], limit: int = 0) -> Tuple[str, tuple]:
+    """SELECT для выгрузки полей в порядке списка записей (новые первыми).
+
+    Координаты собираются в строку "(широта, долгота)" прямо в запросе.
+    """
+    columns = [
+        coordinates_text_sql(field['field_name']) if field['field_type'] == 'coordinates'
+        else field['field_name']
+        for field in fields
+    ]
+    sql = f"SELECT {', '.join(columns) or 'id'} FROM {table_name} ORDER BY created_at DESC, id DESC"
+    if limit > 0:
+        return sql + ' LIMIT ?', (limit,)
+    return sql, ()
+
+
+def iter_row_batches(cursor, sql: str, params: tuple = (),
+                     batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[tuple]]:
+    """Результат запроса пачками по batch_size строк."""
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def make_formatter(field_type: str, keep_numbers: bool = False) -> Callable[[Any], Any]:
+    """Функция преобразования значения колонки в значение ячейки.
+
+    Формируется один раз на поле, чтобы в цикле по строкам не разбирать
+    тип поля заново. keep_numbers - оставлять числа числами (для Excel).
+    """
+    if field_type == 'boolean':
+        return lambda value: '' if value is None else ('Да' if value else 'Нет')
+    if field_type in ('integer', 'decimal') and keep_numbers:
+        return lambda value: '' if value is None else value
+    return lambda value: '' if value is None else str(value)
+
+
+def iter_csv(batches: Iterable[List[tuple]], fields: List[Dict[str, Any]],
+             include_headers: bool = True, include_descriptions: bool = False) -> Iterator[str]:
+    """Генератор фрагментов CSV: по одному фрагменту на пачку строк.
+
+    Первый фрагмент (BOM и заголовок) отдается сразу, до чтения данных, поэтому
+    клиент начинает получать файл немедленно, а в памяти находится только
+    текущая пачка.
+    """
+    formatters = [make_formatter(field['field_type']) for field in fields]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    # BOM, чтобы Excel правильно определил кодировку UTF-8
+    buffer.write('\ufeff')
+    if include_headers:
+        writer.writerow(export_headers(fields, include_descriptions))
+    yield flush()
+
+    for rows in batches:
+        writer.writerows(
+            [formatter(value) for formatter, value in zip(formatters, row)]
+            for row in rows
+        )
+        yield flush()
+
+
+def _sheet_title(base: str, number: int) -> str:
+    return base if number == 1 else f"{base} ({number})"
+
+
+def write_xlsx(path: str, batches: Iterable[List[tuple]], fields: List[Dict[str, Any]],
+               include_headers: bool = True, include_descriptions: bool = False,
+               sheet_title: str = "Данные", max_rows: int = EXCEL_MAX_ROWS) -> Dict[str, int]:
+    """Запись выгрузки в файл XLSX с постоянным расходом памяти.
+
+    Используются write-only листы openpyxl: строки сразу сбрасываются во
+    временные файлы на диске. Ширина колонок в таком режиме задается до первой
+    строки листа, поэтому она считается на лету по уже записанным строкам:
+    для первого листа - по заголовку и первой пачке, для следующих - по всем
+    строкам до начала листа. Когда лист заполнен (max_rows строк), данные
+    продолжаются на новом листе с тем же заголовком.
+    """
+    formatters = [make_formatter(field['field_type'], keep_numbers=True) for field in fields]
+    headers = export_headers(fields, include_descriptions) if include_headers else None
+    widths = [len(header) for header in headers] if headers else [0] * len(fields)
+    rows_per_sheet = max_rows - (1 if headers else 0)
+
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    header_alignment = Alignment(horizontal="center", vertical="center")
+
+    wb = Workbook(write_only=True)
+    state = {'sheet': None, 'sheets': 0, 'sheet_rows': 0}
+
+    def open_sheet():
+        state['sheets'] += 1
+        state['sheet_rows'] = 0
+        ws = wb.create_sheet(_sheet_title(sheet_title, state['sheets']))
+        for index, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(index)].width = min(width + 2, EXCEL_MAX_COLUMN_WIDTH)
+        if headers:
+            header_cells = []
+            for header in headers:
+                cell = WriteOnlyCell(ws, value=header)
+                cell.font = header_font
+                cell.fill = header_fill
+                cell.alignment = header_alignment
+                header_cells.append(cell)
+            ws.append(header_cells)
+        state['sheet'] = ws
+
+    total = 0
+    for rows in batches:
+        values = [[formatter(value) for formatter, value in zip(formatters, row)] for row in rows]
+        for row in values:
+            for index, value in enumerate(row):
+                length = len(str(value))
+                if length > widths[index]:
+                    widths[index] = length
+        for row in values:
+            if state['sheet'] is None or state['sheet_rows'] >= rows_per_sheet:
+                open_sheet()
+            state['sheet'].append(row)
+            state['sheet_rows'] += 1
+        total += len(values)
+
+    if state['sheet'] is None:
+        open_sheet()
+
+    wb.save(path)
+    return {'rows': total, 'sheets': state['sheets']}
+
+
+def create_temp_export_file(suffix: str) -> str:
+    """Путь к временному файлу выгрузки (удаляется после отправки)."""
+    handle, path = tempfile.mkstemp(prefix='datavue_export_', suffix=suffix)
+    os.close(handle)
+    return path
+
+
+def iter_file(path: str, remove: bool = True, chunk_size: int = FILE_CHUNK_SIZE) -> Iterator[bytes]:
+    """Чтение файла фрагментами для потокового ответа; файл удаляется после отправки."""
+    try:
+        with open(path, 'rb') as file:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if remove:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
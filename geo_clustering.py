@@ -0,0 +1,242 @@
+"""Кластеризация точек поля координат по сетке для отображения на карте."""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+from spatial_index import coordinate_columns, longitude_ranges, rtree_table
+
+# Ячеек сетки на сторону тайла: при тайле 256 px ячейка занимает около 64 px
+CELLS_PER_TILE = 4
+
+MAX_ZOOM = 22
+
+# Предел тайлов в одном запросе (видимая область карты - обычно 10-40 тайлов)
+MAX_TILES_PER_REQUEST = 256
+
+# Доля площади мира, начиная с которой таблица читается целиком, а не через R*Tree
+FULL_SCAN_AREA_FRACTION = 0.25
+
+# Пределы кэша: число тайлов и суммарное число ячеек в них
+CACHE_MAX_TILES = 20000
+CACHE_MAX_CELLS = 200000
+
+
+def tile_size(zoom: int) -> float:
+    """Сторона тайла в градусах: весь мир по долготе - 2^zoom тайлов."""
+    return 360.0 / (1 << zoom)
+
+
+def cell_size(zoom: int) -> float:
+    """Сторона ячейки сетки в градусах."""
+    return tile_size(zoom) / CELLS_PER_TILE
+
+
+def viewport_tiles(zoom: int, bbox: Sequence[float],
+                   limit: int = MAX_TILES_PER_REQUEST) -> List[Tuple[int, int]]:
+    """Тайлы (tx, ty), покрывающие область (min_lat, min_lng, max_lat, max_lng).
+
+    Сетка тайлов квадратная в градусах и начинается от (-90, -180); область
+    через 180-й меридиан покрывается тайлами с обоих краев. Если тайлов
+    больше limit, выбрасывается ValueError.
+    """
+    min_lat, min_lng, max_lat, max_lng = bbox
+    size = tile_size(zoom)
+    columns = 1 << zoom
+    rows = max(1, columns // 2)
+
+    def index(value: float, origin: float, count: int) -> int:
+        return min(max(int((value - origin) // size), 0), count - 1)
+
+    ty_range = range(index(min_lat, -90, rows), index(max_lat, -90, rows) + 1)
+    tx_ranges = [(index(low, -180, columns), index(high, -180, columns))
+                 for low, high in longitude_ranges(min_lng, max_lng)]
+    if len(ty_range) * sum(high - low + 1 for low, high in tx_ranges) > limit:
+        raise ValueError("Слишком большая область для этого масштаба: уменьшите область или zoom")
+    tx_values = sorted({tx for low, high in tx_ranges for tx in range(low, high + 1)})
+    return [(tx, ty) for ty in ty_range for tx in tx_values]
+
+
+class GeoClusterer:
+    """Кластеры точек по ячейкам сетки с кэшем по тайлам.
+
+    Видимая область разбивается на тайлы уровня zoom, каждый тайл - на
+    CELLS_PER_TILE x CELLS_PER_TILE ячеек. Для ячейки считаются число точек,
+    центр масс и агрегаты числовых полей одним запросом GROUP BY на тайл
+    (кандидаты отбираются по R*Tree). Результаты тайлов кэшируются с версией
+    данных справочника: после изменения записей или схемы тайл считается заново.
+    Размер ответа ограничен числом ячеек в области, а не числом точек.
+    """
+
+    def __init__(self, max_tiles: int = CACHE_MAX_TILES, max_cells: int = CACHE_MAX_CELLS):
+        self.max_tiles = max_tiles
+        self.max_cells = max_cells
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[tuple, Tuple[Any, List[tuple]]]' = OrderedDict()
+        self._cells = 0
+        self._hits = 0
+        self._misses = 0
+
+    def _cached(self, key: tuple, version: Any) -> Optional[List[tuple]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+            return None
+
+    def _store(self, key: tuple, version: Any, cells: List[tuple]):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._cells -= len(previous[1])
+            self._entries[key] = (version, cells)
+            self._cells += len(cells)
+            while self._entries and (len(self._entries) > self.max_tiles or self._cells > self.max_cells):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._cells -= len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики кэша тайлов."""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'tiles': len(self._entries),
+                'cells': self._cells,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / total, 4) if total else None
+            }
+
+    @staticmethod
+    def _region_cells_with_cursor(cursor, table_name: str, field_name: str, zoom: int,
+                                  tiles: Sequence[Tuple[int, int]], aggregate_fields: Sequence[str],
+                                  where: Sequence[str], params: Sequence[Any]) -> Dict[Tuple[int, int], List[tuple]]:
+        """Ячейки всех тайлов прямоугольника, охватывающего tiles, одним запросом.
+
+        Возвращает {тайл: [(cx, cy, count, широта, долгота, id единственной записи, агрегаты...)]}.
+        Если прямоугольник занимает заметную часть мира, таблица читается
+        целиком: полный проход дешевле, чем выборка большинства точек через R*Tree.
+        """
+        size = tile_size(zoom)
+        cell = cell_size(zoom)
+        lat, lng = coordinate_columns(field_name)
+        first_tx, last_tx = min(tx for tx, _ in tiles), max(tx for tx, _ in tiles)
+        first_ty, last_ty = min(ty for _, ty in tiles), max(ty for _, ty in tiles)
+        min_lng = -180 + first_tx * size
+        max_lng = min(-180 + (last_tx + 1) * size, 180.0)
+        min_lat = -90 + first_ty * size
+        max_lat = min(-90 + (last_ty + 1) * size, 90.0)
+
+        # Тайлы делят плоскость без пересечений: правая и верхняя границы
+        # не входят в тайл, кроме краев сетки (180 и 90 градусов)
+        lng_op = '<=' if max_lng >= 180 else '<'
+        lat_op = '<=' if max_lat >= 90 else '<'
+        conditions = [f"d.{lat} >= ?", f"d.{lat} {lat_op} ?", f"d.{lng} >= ?", f"d.{lng} {lng_op} ?"]
+        condition_params = [min_lat, max_lat, min_lng, max_lng]
+        if (max_lat - min_lat) * (max_lng - min_lng) >= FULL_SCAN_AREA_FRACTION * 180 * 360:
+            from_sql = f"{table_name} d"
+        else:
+            from_sql = f"{rtree_table(table_name, field_name)} r JOIN {table_name} d ON d.id = r.id"
+            conditions = ['r.min_lat <= ? AND r.max_lat >= ? AND r.min_lng <= ? AND r.max_lng >= ?'] + conditions
+            condition_params = [max_lat, min_lat, max_lng, min_lng] + condition_params
+        # Пользователи нужны только для фильтра по created_by_username
+        if any('u.username' in clause for clause in where):
+            from_sql += ' LEFT JOIN users u ON d.created_by = u.id'
+
+        aggregates_sql = ''.join(f", AVG(d.{name}), MIN(d.{name}), MAX(d.{name})" for name in aggregate_fields)
+        cursor.execute(f'''
+            SELECT CAST((d.{lng} + 180) / ? AS INTEGER) AS cx,
+                   CAST((d.{lat} + 90) / ? AS INTEGER) AS cy,
+                   COUNT(*), AVG(d.{lat}), AVG(d.{lng}), MIN(d.id){aggregates_sql}
+            FROM {from_sql}
+            WHERE {' AND '.join(list(conditions) + list(where))}
+            GROUP BY cx, cy
+        ''', [cell, cell] + condition_params + list(params))
+
+        result = {(tx, ty): [] for tx in range(first_tx, last_tx + 1) for ty in range(first_ty, last_ty + 1)}
+        for row in cursor.fetchall():
+            # Точка на границе из-за округления может получить номер соседней ячейки
+            cx = min(max(row[0], first_tx * CELLS_PER_TILE), (last_tx + 1) * CELLS_PER_TILE - 1)
+            cy = min(max(row[1], first_ty * CELLS_PER_TILE), (last_ty + 1) * CELLS_PER_TILE - 1)
+            result[(cx // CELLS_PER_TILE, cy // CELLS_PER_TILE)].append((cx, cy) + tuple(row[2:]))
+        return result
+
+    def clusters_with_cursor(self, cursor, table_name: str, version: Any, field_name: str, zoom: int,
+                             bbox: Sequence[float], aggregate_fields: Sequence[str] = (),
+                             where: Sequence[str] = (), params: Sequence[Any] = (),
+                             filter_key: str = '') -> Dict[str, Any]:
+        """Кластеры видимой области bbox = (min_lat, min_lng, max_lat, max_lng).
+
+        where и params - дополнительные условия отбора записей (фильтры);
+        filter_key - их каноническое представление для ключа кэша.
+        """
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom должен быть от 0 до {MAX_ZOOM}")
+        tiles = viewport_tiles(zoom, bbox)
+
+        aggregate_fields = list(aggregate_fields)
+
+        def cache_key(tile):
+            return (table_name, field_name, zoom, tile, tuple(aggregate_fields), filter_key)
+
+        tile_cells = {}
+        for tile in tiles:
+            cells = self._cached(cache_key(tile), version)
+            if cells is not None:
+                tile_cells[tile] = cells
+        cached_tiles = len(tile_cells)
+
+        # Недостающие тайлы считаются одним запросом на каждую непрерывную полосу
+        # по долготе (область через 180-й меридиан дает две полосы)
+        missing = [tile for tile in tiles if tile not in tile_cells]
+        columns = sorted({tx for tx, _ in missing})
+        groups = []
+        for tx in columns:
+            if groups and tx == groups[-1][-1] + 1:
+                groups[-1].append(tx)
+            else:
+                groups.append([tx])
+        for group in groups:
+            group_tiles = [tile for tile in missing if tile[0] in group]
+            computed = self._region_cells_with_cursor(cursor, table_name, field_name, zoom, group_tiles,
+                                                      aggregate_fields, where, params)
+            for tile, cells in computed.items():
+                self._store(cache_key(tile), version, cells)
+                tile_cells.setdefault(tile, cells)
+
+        cells = [cell for tile in tiles for cell in tile_cells[tile]]
+
+        min_lat, min_lng, max_lat, max_lng = bbox
+        lng_ranges = longitude_ranges(min_lng, max_lng)
+        size = cell_size(zoom)
+        clusters = []
+        total = 0
+        for cx, cy, count, lat, lng, record_id, *aggregates in cells:
+            # Ячейки тайла за пределами области не отдаются
+            cell_lat, cell_lng = -90 + cy * size, -180 + cx * size
+            if cell_lat > max_lat or cell_lat + size < min_lat:
+                continue
+            if not any(cell_lng <= high and cell_lng + size >= low for low, high in lng_ranges):
+                continue
+            cluster = {'latitude': lat, 'longitude': lng, 'count': count}
+            if count == 1:
+                cluster['record_id'] = record_id
+            if aggregate_fields:
+                cluster['aggregates'] = {
+                    name: {'avg': aggregates[i * 3], 'min': aggregates[i * 3 + 1], 'max': aggregates[i * 3 + 2]}
+                    for i, name in enumerate(aggregate_fields)
+                }
+            clusters.append(cluster)
+            total += count
+
+        return {
+            'zoom': zoom,
+            'cell_size': size,
+            'clusters': clusters,
+            'total': total,
+            'tiles': len(tiles),
+            'cached_tiles': cached_tiles
+        }
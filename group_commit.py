@@ -0,0 +1,252 @@
+"""Групповая фиксация записей: один поток-писатель объединяет операции в общие транзакции."""
+
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+# Сколько операций объединяется в одну транзакцию
+DEFAULT_MAX_BATCH = 64
+
+# Сколько (в секундах) писатель ждет новые операции после первой в группе.
+# Ожидание включается, только если предыдущая группа была больше одной операции:
+# одиночный писатель не ждет; 0 - группа состоит из операций, накопившихся
+# за время предыдущей фиксации
+DEFAULT_MAX_DELAY = 0.002
+
+# Предел очереди операций: при переполнении вызывающий ждет, а не копит память
+DEFAULT_QUEUE_SIZE = 1000
+
+# Режим синхронизации соединения писателя: FULL - fsync при каждой фиксации,
+# запись переживает отключение питания; фиксация одна на группу операций
+DEFAULT_SYNCHRONOUS = 'FULL'
+
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+# Сколько (в секундах) вызывающий ждет результат своей операции
+DEFAULT_RESULT_TIMEOUT = 60.0
+
+
+class WriteQueueFullError(sqlite3.OperationalError):
+    """Очередь операций записи переполнена."""
+
+
+class WriterStoppedError(sqlite3.OperationalError):
+    """Поток-писатель остановлен (или завершился с ошибкой) и операции не принимает."""
+
+
+class GroupCommitWriter:
+    """Поток-писатель с групповой фиксацией транзакций.
+
+    Операция - функция от курсора, которая выполняет запись и возвращает
+    результат (например, id новой записи). submit ставит операцию в очередь и
+    ждет, пока транзакция с ней будет зафиксирована. Писатель забирает из
+    очереди до max_batch операций (при параллельной записи ожидая новые не
+    дольше max_delay), выполняет каждую в своей точке сохранения и фиксирует
+    всю группу одним COMMIT.
+    Ошибка операции откатывает только ее точку сохранения и возвращается ее
+    вызывающему; ошибка фиксации возвращается всем операциям группы.
+    Если сам поток-писатель завершается с ошибкой (например, не удалось
+    открыть соединение), все ожидающие операции получают эту ошибку, а
+    новые отклоняются (WriterStoppedError). Операция, которую писатель не
+    начал выполнять за result_timeout, отменяется с ошибкой; начатая
+    дожидается фиксации.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_batch: int = DEFAULT_MAX_BATCH,
+                 max_delay: float = DEFAULT_MAX_DELAY, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 submit_timeout: float = 30.0, result_timeout: float = DEFAULT_RESULT_TIMEOUT):
+        if max_batch < 1:
+            raise ValueError("Размер группы должен быть не меньше 1")
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.submit_timeout = submit_timeout
+        self.result_timeout = result_timeout
+        self._connect = connect
+        self._queue: 'queue.Queue[Optional[Tuple[Callable, Future]]]' = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._error: Optional[BaseException] = None
+        self._groups = 0
+        self._operations = 0
+        self._failed = 0
+        self._commit_failures = 0
+        self._largest_group = 0
+        self._commit_time = 0.0
+        self._last_group = 1
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='datavue-group-commit', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Остановка писателя после выполнения уже принятых операций."""
+        with self._lock:
+            thread, self._stopping = self._thread, True
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, operation: Callable[[sqlite3.Cursor], Any]) -> Any:
+        """Выполнение операции в общей транзакции; результат - после фиксации на диске."""
+        self._check_running()
+        self.start()
+        future: Future = Future()
+        try:
+            self._queue.put((operation, future), timeout=self.submit_timeout)
+        except queue.Full:
+            raise WriteQueueFullError("Очередь записи переполнена, попробуйте позже") from None
+        if self._error is not None:
+            # Писатель упал, пока операция ставилась в очередь: ее никто не заберет
+            self._fail_queued(self._error)
+        try:
+            return future.result(timeout=self.result_timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                # Операция еще в очереди и уже точно не выполнится
+                raise sqlite3.OperationalError(
+                    f"Операция записи не выполнена за {self.result_timeout:g} с"
+                ) from None
+        # Писатель уже выполняет операцию: ее результат (или ошибка фиксации)
+        # будет, и вызывающий должен его получить, иначе зафиксированная
+        # запись выглядела бы ошибкой. Если писатель упадет, _run вернет ошибку.
+        return future.result()
+
+    def _check_running(self):
+        if self._error is not None:
+            raise WriterStoppedError(f"Запись остановлена из-за ошибки: {self._error}")
+        if self._stopping:
+            raise WriterStoppedError("Запись остановлена")
+
+    def _fail_queued(self, error: BaseException):
+        """Ошибка всем операциям, оставшимся в очереди."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(error)
+
+    def _next_group(self) -> Tuple[List[Tuple[Callable, Future]], bool]:
+        """Следующая группа операций и признак остановки."""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        group = [first]
+        delay = self.max_delay if self._last_group > 1 else 0
+        deadline = time.monotonic() + delay
+        while len(group) < self.max_batch:
+            try:
+                # Сначала забираем то, что уже накопилось, затем ждем до deadline
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                return group, True
+            group.append(item)
+        return group, False
+
+    def _run(self):
+        conn = None
+        group: List[Tuple[Callable, Future]] = []
+        try:
+            conn = self._connect()
+            stopping = False
+            while not stopping:
+                group, stopping = self._next_group()
+                if group:
+                    self._execute_group(conn, group)
+                group = []
+        except BaseException as e:
+            # Писатель больше не работает: вызывающие не должны ждать его вечно
+            print(f"Поток групповой фиксации завершился с ошибкой: {e}")
+            with self._lock:
+                self._error = e
+                self._stopping = True
+            for _, future in group:
+                if not future.done():
+                    if future.running() or future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+            self._fail_queued(e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _execute_group(self, conn: sqlite3.Connection, group: List[Tuple[Callable, Future]]):
+        results: List[Tuple[Future, Any, Optional[BaseException]]] = []
+        cursor = conn.cursor()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for operation, future in group:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cursor.execute('SAVEPOINT group_operation')
+                try:
+                    result = operation(cursor)
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO group_operation')
+                    cursor.execute('RELEASE group_operation')
+                    results.append((future, None, e))
+                else:
+                    cursor.execute('RELEASE group_operation')
+                    results.append((future, result, None))
+            started = time.perf_counter()
+            conn.commit()
+            commit_seconds = time.perf_counter() - started
+        except Exception as e:
+            # Группа не зафиксирована: ни одна ее операция не сохранена
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            with self._lock:
+                self._groups += 1
+                self._commit_failures += 1
+                self._failed += len(group)
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        with self._lock:
+            self._groups += 1
+            self._operations += len(results)
+            self._failed += sum(1 for _, _, error in results if error is not None)
+            self._largest_group = max(self._largest_group, len(results))
+            self._last_group = len(group)
+            self._commit_time += commit_seconds
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики групп и операций."""
+        with self._lock:
+            return {
+                'max_batch': self.max_batch,
+                'max_delay': self.max_delay,
+                'queued': self._queue.qsize(),
+                'groups': self._groups,
+                'operations': self._operations,
+                'failed': self._failed,
+                'commit_failures': self._commit_failures,
+                'largest_group': self._largest_group,
+                'average_group': round(self._operations / self._groups, 2) if self._groups else None,
+                'commit_time_seconds': round(self._commit_time, 6),
+                'error': str(self._error) if self._error is not None else None
+            }
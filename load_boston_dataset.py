@@ -3,10 +3,9 @@
 Скрипт для загрузки Boston Housing Dataset в базу данных
 """
 
-import sqlite3
-import csv
 import os
 from database import DatabaseManager
+from datavue_load import load_file
 
 def download_boston_dataset():
     """Скачиваем Boston Housing Dataset из интернета"""
@@ -33,6 +32,13 @@ def load_boston_dataset_to_db():
     with db.get_connection() as conn:
         cursor = conn.cursor()
         
+        # Получаем ID администратора
+        cursor.execute('SELECT id FROM users WHERE role = "admin" LIMIT 1')
+        admin_result = cursor.fetchone()
+        if not admin_result:
+            raise Exception("Администратор не найден в базе данных")
+        admin_id = admin_result[0]
+        
         # Проверяем, есть ли уже Boston Housing Dataset
         cursor.execute('''
             SELECT id FROM data_types WHERE name = 'Boston Housing Dataset'
@@ -41,19 +47,11 @@ def load_boston_dataset_to_db():
         
         if existing:
             data_type_id = existing[0]
+            # Старые данные удаляются при загрузке (truncate)
             print("Boston Housing Dataset уже существует. Удаляем старые данные...")
-            
-            # Удаляем старые данные
-            cursor.execute(f'DELETE FROM data_{data_type_id}')
         else:
             # Создаем новый тип данных
             print("Создаем новый тип данных...")
-            # Получаем ID администратора
-            cursor.execute('SELECT id FROM users WHERE role = "admin" LIMIT 1')
-            admin_result = cursor.fetchone()
-            if not admin_result:
-                raise Exception("Администратор не найден в базе данных")
-            admin_id = admin_result[0]
             
             cursor.execute('''
                 INSERT INTO data_types (name, description, created_by, created_at)
@@ -94,51 +92,19 @@ def load_boston_dataset_to_db():
             # Создаем таблицу данных
             db.create_data_table_with_cursor(cursor, data_type_id)
         
-        # Читаем CSV файл и загружаем данные
-        print("Загружаем данные из CSV...")
-        with open('boston_housing.csv', 'r', encoding='utf-8') as file:
-            csv_reader = csv.DictReader(file)
-            
-            records_loaded = 0
-            for row in csv_reader:
-                # Преобразуем данные в нужные типы
-                record_data = {
-                    'crim': float(row['crim']),
-                    'zn': float(row['zn']),
-                    'indus': float(row['indus']),
-                    'chas': int(row['chas']),
-                    'nox': float(row['nox']),
-                    'rm': float(row['rm']),
-                    'age': float(row['age']),
-                    'dis': float(row['dis']),
-                    'rad': int(row['rad']),
-                    'tax': float(row['tax']),
-                    'ptratio': float(row['ptratio']),
-                    'b': float(row['b']),
-                    'lstat': float(row['lstat']),
-                    'medv': float(row['medv'])
-                }
-                
-                # Вставляем запись
-                cursor.execute(f'''
-                    INSERT INTO data_{data_type_id} 
-                    (crim, zn, indus, chas, nox, rm, age, dis, rad, tax, ptratio, b, lstat, medv, created_by, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    record_data['crim'], record_data['zn'], record_data['indus'], record_data['chas'],
-                    record_data['nox'], record_data['rm'], record_data['age'], record_data['dis'],
-                    record_data['rad'], record_data['tax'], record_data['ptratio'], record_data['b'],
-                    record_data['lstat'], record_data['medv'], 2, db.get_current_timestamp()
-                ))
-                
-                records_loaded += 1
-                if records_loaded % 100 == 0:
-                    print(f"Загружено {records_loaded} записей...")
-        
         conn.commit()
-        print(f"Успешно загружено {records_loaded} записей Boston Housing Dataset!")
-        print(f"Датасет содержит 14 полей")
-        print(f"Данные о недвижимости в Бостоне готовы для анализа!")
+    
+    # Читаем CSV файл и загружаем данные: приведение типов по полям справочника,
+    # вставка пачками, индексы и сводная статистика строятся после загрузки
+    print("Загружаем данные из CSV...")
+    result = load_file(db, data_type_id, 'boston_housing.csv', created_by=admin_id, truncate=True)
+    
+    print(f"Успешно загружено {result['loaded']} записей Boston Housing Dataset!")
+    if result['rejected']:
+        print(f"Отклонено записей с ошибками: {result['rejected']}")
+    print(f"Скорость загрузки: {result['rows_per_second'] or 0:.0f} записей/с")
+    print(f"Датасет содержит 14 полей")
+    print(f"Данные о недвижимости в Бостоне готовы для анализа!")
 
 if __name__ == "__main__":
     try:
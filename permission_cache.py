@@ -0,0 +1,98 @@
+"""Кэш решений авторизации: роль, активность и права записи пользователя."""
+
+import threading
+import time
+from typing import Callable, Dict, Any, Optional
+
+
+class PermissionCache:
+    """Кэш авторизационных данных пользователей в памяти процесса.
+
+    Запись содержит роль, флаг активности и множество id справочников, на
+    которые у пользователя есть право записи. Записи сбрасываются методами
+    DatabaseManager, изменяющими пользователей и права. TTL ограничивает время
+    жизни записи на случай изменений из других процессов (утилиты сброса пароля).
+    """
+
+    LOAD_SQL = '''
+        SELECT u.role, u.is_active, p.data_type_id
+        FROM users u
+        LEFT JOIN user_permissions p
+            ON p.user_id = u.id AND p.permission_type = 'write'
+        WHERE u.id = ?
+    '''
+
+    def __init__(self, connection_factory: Callable, ttl: float = 60.0):
+        """connection_factory - функция, возвращающая контекст соединения (DatabaseManager.get_connection)."""
+        self._connection_factory = connection_factory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._generations: Dict[int, int] = {}
+        self._global_generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def _generation(self, user_id: int) -> tuple:
+        return (self._global_generation, self._generations.get(user_id, 0))
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Авторизационные данные пользователя или None, если его нет."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and (self.ttl is None or entry['loaded_at'] + self.ttl > now):
+                self._hits += 1
+                return entry
+            self._misses += 1
+            generation = self._generation(user_id)
+
+        entry = self._load(user_id)
+        if entry is None:
+            return None
+
+        with self._lock:
+            if self._generation(user_id) == generation:
+                self._entries[user_id] = entry
+        return entry
+
+    def _load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Загрузка роли и прав пользователя одним запросом."""
+        with self._connection_factory() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.LOAD_SQL, (user_id,))
+            rows = cursor.fetchall()
+
+        if not rows:
+            return None
+
+        return {
+            'role': rows[0][0],
+            'is_active': bool(rows[0][1]),
+            'writable': frozenset(row[2] for row in rows if row[2] is not None),
+            'loaded_at': time.monotonic()
+        }
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Сброс записи пользователя (или всех пользователей, если id не указан)."""
+        with self._lock:
+            self._invalidations += 1
+            if user_id is None:
+                self._global_generation += 1
+                self._entries.clear()
+            else:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+                self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов кэша."""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / total, 4) if total else None,
+                'invalidations': self._invalidations
+            }
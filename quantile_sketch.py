@@ -0,0 +1,111 @@
+"""Компактный скетч квантилей с гарантированной относительной погрешностью."""
+
+import math
+from typing import Dict, Optional
+
+# Значения по модулю меньше этого порога считаются нулем
+MIN_INDEXABLE_VALUE = 1e-9
+
+
+class QuantileSketch:
+    """Логарифмическая гистограмма в духе DDSketch.
+
+    Значение x > 0 попадает в корзину ceil(log_gamma(x)), где
+    gamma = (1 + a) / (1 - a); оценка квантиля отличается от истинного значения
+    не более чем на долю a. Корзины - обычные счетчики, поэтому скетчи
+    складываются (merge), а значения можно как добавлять, так и удалять:
+    это позволяет вести скетч инкрементально при вставке, изменении
+    и удалении записей. Число корзин растет логарифмически от диапазона
+    значений (около 700 корзин на диапазон 1..10^6 при a = 0.01).
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("Относительная погрешность должна быть в интервале (0, 1)")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        # Середина корзины (gamma^(k-1), gamma^k] с учетом относительной погрешности
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    @staticmethod
+    def _bump(store: Dict[int, int], key: int, weight: int):
+        # Отрицательные счетчики допустимы: так скетч хранит разность (дельту) двух скетчей
+        count = store.get(key, 0) + weight
+        if count:
+            store[key] = count
+        else:
+            store.pop(key, None)
+
+    def add(self, value: float, weight: int = 1):
+        """Добавление значения (weight = -1 удаляет ранее добавленное значение)."""
+        if value > MIN_INDEXABLE_VALUE:
+            self._bump(self.positive, self._key(value), weight)
+        elif value < -MIN_INDEXABLE_VALUE:
+            self._bump(self.negative, self._key(-value), weight)
+        else:
+            self.zero_count += weight
+
+    def merge(self, other: 'QuantileSketch'):
+        """Слияние со скетчем с той же погрешностью."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Нельзя объединить скетчи с разной погрешностью")
+        for key, count in other.positive.items():
+            self._bump(self.positive, key, count)
+        for key, count in other.negative.items():
+            self._bump(self.negative, key, count)
+        self.zero_count += other.zero_count
+
+    @property
+    def count(self) -> int:
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zero_count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля q (0..1) или None для пустого скетча."""
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+
+        seen = 0
+        # Отрицательные значения по возрастанию - это корзины по убыванию модуля
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+    def to_bins(self) -> Dict[str, int]:
+        """Счетчики корзин с текстовыми ключами: 'p<k>', 'n<k>' и 'z' (нули)."""
+        bins = {f"p{key}": count for key, count in self.positive.items()}
+        bins.update((f"n{key}", count) for key, count in self.negative.items())
+        if self.zero_count:
+            bins['z'] = self.zero_count
+        return bins
+
+    @classmethod
+    def from_bins(cls, bins: Dict[str, int], relative_accuracy: float = 0.01) -> 'QuantileSketch':
+        sketch = cls(relative_accuracy)
+        for name, count in bins.items():
+            if name == 'z':
+                sketch.zero_count = count
+            elif name[0] == 'p':
+                sketch.positive[int(name[1:])] = count
+            else:
+                sketch.negative[int(name[1:])] = count
+        return sketch
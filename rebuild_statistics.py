@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Скрипт для перестроения сводной статистики справочников (таблица field_statistics).
+Использование: python rebuild_statistics.py [data_type_id ...]
+Без параметров перестраивает статистику всех справочников.
+"""
+
+import sys
+import time
+from database import DatabaseManager
+
+
+def rebuild_statistics(data_type_ids=None):
+    """Перестроение сводной статистики указанных (или всех) справочников"""
+    db = DatabaseManager()
+    
+    targets = data_type_ids or [None]
+    for data_type_id in targets:
+        started = time.perf_counter()
+        result = db.rebuild_statistics(data_type_id)
+        for type_id, rows in result.items():
+            print(f"✅ Справочник {type_id}: учтено записей {rows}")
+        print(f"⏱  Время: {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("📊 Перестроение сводной статистики")
+    print("=" * 60)
+    
+    try:
+        ids = [int(arg) for arg in sys.argv[1:]]
+    except ValueError:
+        print("Использование:")
+        print("  python rebuild_statistics.py           # все справочники")
+        print("  python rebuild_statistics.py 3 5       # справочники 3 и 5")
+        sys.exit(1)
+    
+    rebuild_statistics(ids)
@@ -0,0 +1,208 @@
+"""Компиляция фильтров, поиска и сортировки записей в параметризованный SQL."""
+
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+from spatial_index import coordinate_columns
+
+
+# Служебные колонки, по которым тоже можно фильтровать и сортировать
+SERVICE_COLUMNS = {
+    'id': ('d.id', 'integer'),
+    'created_at': ('d.created_at', 'date'),
+    'created_by': ('d.created_by', 'integer'),
+    'created_by_username': ('u.username', 'text'),
+}
+
+COMPARISON_OPERATORS = {
+    'eq': '=',
+    'ne': '!=',
+    'lt': '<',
+    'lte': '<=',
+    'gt': '>',
+    'gte': '>=',
+}
+
+# Операторы, допустимые для каждого типа поля
+ALLOWED_OPERATORS = {
+    'text': {'eq', 'ne', 'in', 'contains', 'is_null'},
+    'integer': {'eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'between', 'in', 'is_null'},
+    'decimal': {'eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'between', 'in', 'is_null'},
+    'date': {'eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'between', 'is_null'},
+    'boolean': {'eq', 'ne', 'is_null'},
+    'enum': {'eq', 'ne', 'in', 'is_null'},
+    'coordinates': {'is_null'},
+}
+
+# Типы полей, участвующие в полнотекстовом поиске (?q=)
+SEARCHABLE_TYPES = ('text', 'enum', 'date', 'integer', 'decimal')
+
+MAX_IN_VALUES = 500
+
+
+def escape_like(value: str) -> str:
+    """Экранирование спецсимволов LIKE."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class RecordQueryCompiler:
+    """Проверка запроса к записям по схеме data_fields и построение SQL.
+
+    Все имена полей сверяются со схемой справочника, значения передаются
+    только через параметры запроса.
+    """
+
+    def __init__(self, fields: List[Dict[str, Any]]):
+        self.columns = dict(SERVICE_COLUMNS)
+        for field in fields:
+            if field['field_type'] == 'coordinates':
+                # Координаты считаются пустыми, только если нет ни широты, ни долготы
+                lat, lng = coordinate_columns(field['field_name'])
+                column = f"COALESCE(d.{lat}, d.{lng})"
+            else:
+                column = f"d.{field['field_name']}"
+            self.columns[field['field_name']] = (column, field['field_type'])
+
+    def _column(self, name: str) -> Tuple[str, str]:
+        # Имя из JSON может быть списком или объектом: это ошибка запроса, а не TypeError
+        if not isinstance(name, str) or name not in self.columns:
+            raise ValueError(f"Неизвестное поле: {name}")
+        return self.columns[name]
+
+    def _convert(self, field_type: str, value: Any, name: str) -> Any:
+        """Приведение значения фильтра к типу поля."""
+        if value is None:
+            return None
+        try:
+            if field_type == 'integer':
+                if isinstance(value, bool):
+                    raise ValueError
+                return int(value)
+            if field_type == 'decimal':
+                if isinstance(value, bool):
+                    raise ValueError
+                return float(value)
+            if field_type == 'boolean':
+                if isinstance(value, str):
+                    if value.lower() in ('true', '1', 'да'):
+                        return 1
+                    if value.lower() in ('false', '0', 'нет'):
+                        return 0
+                    raise ValueError
+                return 1 if value else 0
+        except (TypeError, ValueError):
+            raise ValueError(f"Недопустимое значение для поля {name}: {value!r}")
+        return str(value)
+
+    def compile_filters(self, filters: Optional[List[Dict[str, Any]]]) -> Tuple[List[str], List[Any]]:
+        """Условия WHERE из списка {"field", "op", "value"}, объединяемых через AND."""
+        clauses, params = [], []
+        if not filters:
+            return clauses, params
+        if not isinstance(filters, list):
+            raise ValueError("Фильтр должен быть списком условий")
+
+        for condition in filters:
+            if not isinstance(condition, dict):
+                raise ValueError("Условие фильтра должно быть объектом")
+            name = condition.get('field')
+            op = condition.get('op', 'eq')
+            value = condition.get('value')
+            column, field_type = self._column(name)
+
+            if not isinstance(op, str) or op not in ALLOWED_OPERATORS.get(field_type, ()):
+                raise ValueError(f"Оператор {op} недоступен для поля {name}")
+
+            if op in COMPARISON_OPERATORS:
+                if value is None:
+                    clauses.append(f"{column} IS {'NOT ' if op == 'ne' else ''}NULL")
+                else:
+                    clauses.append(f"{column} {COMPARISON_OPERATORS[op]} ?")
+                    params.append(self._convert(field_type, value, name))
+            elif op == 'between':
+                if not isinstance(value, list) or len(value) != 2:
+                    raise ValueError(f"Для between нужен массив [от, до] (поле {name})")
+                low, high = value
+                # Открытые границы допускаются: [null, "2024-12-31"]
+                if low is not None:
+                    clauses.append(f"{column} >= ?")
+                    params.append(self._convert(field_type, low, name))
+                if high is not None:
+                    clauses.append(f"{column} <= ?")
+                    params.append(self._convert(field_type, high, name))
+            elif op == 'in':
+                if not isinstance(value, list) or not value:
+                    raise ValueError(f"Для in нужен непустой массив значений (поле {name})")
+                if len(value) > MAX_IN_VALUES:
+                    raise ValueError(f"Слишком много значений в in (максимум {MAX_IN_VALUES})")
+                clauses.append(f"{column} IN ({', '.join('?' for _ in value)})")
+                params.extend(self._convert(field_type, v, name) for v in value)
+            elif op == 'contains':
+                clauses.append(f"unicode_lower({column}) LIKE ? ESCAPE '\\'")
+                params.append(f"%{escape_like(str(value).lower())}%")
+            elif op == 'is_null':
+                clauses.append(f"{column} IS {'' if value in (None, True) else 'NOT '}NULL")
+
+        return clauses, params
+
+    def compile_search(self, search: Optional[str]) -> Tuple[List[str], List[Any]]:
+        """Условие поиска подстроки по всем текстовым и числовым полям и id."""
+        if not search or not search.strip():
+            return [], []
+        pattern = f"%{escape_like(search.strip().lower())}%"
+        targets = ['d.id'] + [
+            column for name, (column, field_type) in self.columns.items()
+            if name not in SERVICE_COLUMNS and field_type in SEARCHABLE_TYPES
+        ]
+        parts = [f"unicode_lower({column}) LIKE ? ESCAPE '\\'" for column in targets]
+        return [f"({' OR '.join(parts)})"], [pattern] * len(parts)
+
+    def compile_sort(self, sort: Optional[str]) -> str:
+        """ORDER BY из строки вида "field:asc,other:desc" (по умолчанию - новые первыми)."""
+        if not sort:
+            return 'ORDER BY d.created_at DESC, d.id DESC'
+        if not isinstance(sort, str):
+            raise ValueError("Параметр sort должен быть строкой вида field:asc")
+
+        terms = []
+        for item in sort.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            name, _, direction = item.partition(':')
+            direction = (direction or 'asc').lower()
+            if direction not in ('asc', 'desc'):
+                raise ValueError(f"Недопустимое направление сортировки: {direction}")
+            column, _ = self._column(name)
+            terms.append(f"{column} {direction.upper()}")
+
+        if not terms:
+            return 'ORDER BY d.created_at DESC, d.id DESC'
+        # id - последний ключ, чтобы порядок был стабильным между страницами
+        terms.append('d.id DESC')
+        return f"ORDER BY {', '.join(terms)}"
+
+    def compile(self, filters=None, search=None, sort=None) -> Dict[str, Any]:
+        """WHERE, параметры и ORDER BY для запроса записей."""
+        clauses, params = self.compile_filters(filters)
+        search_clauses, search_params = self.compile_search(search)
+        clauses += search_clauses
+        params += search_params
+        return {
+            'where': f"WHERE {' AND '.join(clauses)}" if clauses else '',
+            'params': params,
+            'order_by': self.compile_sort(sort)
+        }
+
+
+def parse_filter_param(value: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+    """Разбор параметра ?filter=<JSON>."""
+    if not value:
+        return None
+    try:
+        filters = json.loads(value)
+    except json.JSONDecodeError:
+        raise ValueError("Параметр filter должен быть JSON")
+    if isinstance(filters, dict):
+        filters = [filters]
+    return filters
@@ -0,0 +1,241 @@
+"""Проверка и приведение значений записей к типам полей справочника."""
+
+import json
+import re
+from datetime import datetime
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
+
+from spatial_index import coordinate_columns
+
+# Строковые представления логических значений (в нижнем регистре)
+TRUE_VALUES = ('true', '1', 'да', 'yes')
+FALSE_VALUES = ('false', '0', 'нет', 'no')
+
+# Дата ГГГГ-ММ-ДД, возможно со временем; кроме нее принимается ДД.ММ.ГГГГ
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2})?)?$')
+
+
+class RecordValidationError(ValueError):
+    """Запись не прошла проверку; errors - сообщения по полям."""
+
+    def __init__(self, errors: Dict[str, str]):
+        self.errors = errors
+        super().__init__('; '.join(f"{name}: {message}" for name, message in errors.items()))
+
+
+def _blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def convert_integer(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError("ожидается целое число")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError("ожидается целое число")
+        return int(value)
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError("ожидается целое число")
+
+
+def convert_decimal(value: Any) -> float:
+    if isinstance(value, bool):
+        raise ValueError("ожидается число")
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        # Десятичная запятая - частый случай для выгрузок из русской локали Excel
+        return float(str(value).strip().replace(',', '.'))
+    except ValueError:
+        raise ValueError("ожидается число")
+
+
+def convert_boolean(value: Any) -> int:
+    if isinstance(value, bool):
+        return 1 if value else 0
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return int(value)
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return 1
+    if text in FALSE_VALUES:
+        return 0
+    raise ValueError("ожидается логическое значение")
+
+
+def convert_date(value: Any) -> str:
+    text = str(value).strip()
+    if ISO_DATE.match(text):
+        # fromisoformat реализован на C и намного быстрее strptime
+        try:
+            datetime.fromisoformat(text)
+            return text
+        except ValueError:
+            pass
+    else:
+        try:
+            return datetime.strptime(text, '%d.%m.%Y').strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    raise ValueError("ожидается дата в формате ГГГГ-ММ-ДД")
+
+
+def convert_coordinates(value: Any) -> Optional[Tuple[Optional[float], Optional[float]]]:
+    """Координаты в пару (широта, долгота) с проверкой диапазонов."""
+    coords = value
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            coords = json.loads(text)
+        except ValueError:
+            # Формат "широта, долгота" (и "(широта, долгота)", как в экспорте CSV)
+            parts = text.strip('()').split(',')
+            if len(parts) != 2:
+                raise ValueError("неверный формат координат")
+            coords = {'latitude': parts[0], 'longitude': parts[1]}
+    if not isinstance(coords, dict):
+        raise ValueError("неверный формат координат")
+
+    result = {}
+    for key, limit in (('latitude', 90), ('longitude', 180)):
+        raw = coords.get(key)
+        if _blank(raw) or raw == '—':
+            result[key] = None
+            continue
+        try:
+            number = convert_decimal(raw)
+        except ValueError:
+            raise ValueError("неверный формат координат")
+        if not -limit <= number <= limit:
+            name = 'Широта' if key == 'latitude' else 'Долгота'
+            raise ValueError(f"{name} должна быть от -{limit} до {limit} градусов (получено: {raw})")
+        result[key] = number
+    if result['latitude'] is None and result['longitude'] is None:
+        return None
+    return result['latitude'], result['longitude']
+
+
+def make_enum_converter(allowed: List[str]) -> Callable[[Any], str]:
+    allowed_set = set(allowed)
+
+    def convert_enum(value: Any) -> str:
+        text = str(value)
+        if allowed_set and text not in allowed_set:
+            raise ValueError(f"недопустимое значение '{text}'")
+        return text
+    return convert_enum
+
+
+CONVERTERS = {
+    'integer': convert_integer,
+    'decimal': convert_decimal,
+    'boolean': convert_boolean,
+    'date': convert_date,
+    'coordinates': convert_coordinates,
+    'text': str,
+}
+
+
+def make_converter(field: Dict[str, Any]) -> Callable[[Any], Any]:
+    """Функция приведения значения к типу поля (пустые значения - None)."""
+    if field['field_type'] == 'enum':
+        convert = make_enum_converter(field.get('enum_values') or [])
+    else:
+        convert = CONVERTERS.get(field['field_type'], str)
+
+    if field['field_type'] == 'text':
+        return lambda value: None if value is None else convert(value)
+    return lambda value: None if _blank(value) else convert(value)
+
+
+class RecordValidator:
+    """Проверка записей по схеме справочника.
+
+    Функции приведения строятся один раз на поле, поэтому проверка пачки
+    записей не обращается к базе и не разбирает схему заново для каждой строки.
+    """
+
+    def __init__(self, fields: List[Dict[str, Any]]):
+        self.fields = fields
+        self.columns = [field['field_name'] for field in fields]
+        # Колонки таблицы: поле координат занимает две (широта и долгота)
+        self.storage_columns = []
+        self._layout = []
+        for field in fields:
+            is_coordinates = field['field_type'] == 'coordinates'
+            if is_coordinates:
+                self.storage_columns += coordinate_columns(field['field_name'])
+            else:
+                self.storage_columns.append(field['field_name'])
+            self._layout.append((field['field_name'], is_coordinates))
+        self._converters = {field['field_name']: make_converter(field) for field in fields}
+        self._required = [field['field_name'] for field in fields if field.get('is_required')]
+
+    def validate(self, record: Any) -> Dict[str, Any]:
+        """Приведенные значения записи или RecordValidationError."""
+        if not isinstance(record, dict):
+            raise RecordValidationError({'_record': 'запись должна быть JSON-объектом'})
+
+        errors = {}
+        values = {}
+        for name, value in record.items():
+            converter = self._converters.get(name)
+            if converter is None:
+                errors[name] = 'неизвестное поле'
+                continue
+            try:
+                values[name] = converter(value)
+            except (TypeError, ValueError) as e:
+                errors[name] = str(e)
+        for name in self._required:
+            if values.get(name) is None and name not in errors:
+                errors[name] = 'обязательное поле'
+        if errors:
+            raise RecordValidationError(errors)
+        return values
+
+    def row(self, values: Dict[str, Any]) -> tuple:
+        """Проверенные значения в порядке storage_columns (параметры для INSERT)."""
+        row = []
+        for name, is_coordinates in self._layout:
+            value = values.get(name)
+            if is_coordinates:
+                row.extend(value or (None, None))
+            else:
+                row.append(value)
+        return tuple(row)
+
+
+def iter_stream_lines(stream, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Строки бинарного потока, прочитанного крупными фрагментами.
+
+    Построчное чтение потока запроса напрямую идет маленькими порциями;
+    чтение фрагментами по chunk_size заметно быстрее на больших телах.
+    """
+    tail = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def iter_ndjson(lines: Iterable[Union[bytes, str]]) -> Iterator[Union[Dict[str, Any], RecordValidationError]]:
+    """Разбор NDJSON по строкам; на месте некорректной строки - RecordValidationError."""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield RecordValidationError({'_record': f'неверный JSON: {e}'})
@@ -0,0 +1,316 @@
+"""Метрики запросов API и обращений к базе в текстовом формате Prometheus."""
+
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from flask import request
+
+# Тип содержимого ответа в текстовом формате Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм: время ответа, число запросов SQL и их время за один запрос API
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SQL_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SQL_SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Потоки событий (SSE) открыты, пока открыто представление: их длительность - не время ответа
+UNTIMED_MIMETYPES = ('text/event-stream',)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+class _Counter:
+    """Счетчик с метками; изменяется под блокировкой RequestMetrics."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class _Histogram(_Counter):
+    """Гистограмма с метками: счетчики корзин, сумма и число наблюдений."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        # Корзина le - наблюдения не больше границы; последняя - +Inf
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        names = self.label_names + ('le',)
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}")
+            suffix = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class _CountingCursor(sqlite3.Cursor):
+    """Курсор, передающий время каждого запроса SQL в RequestMetrics соединения."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.metrics.record_sql(time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.metrics.record_sql(time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self.connection.metrics.record_sql(time.perf_counter() - started)
+
+
+class _CountingConnection(sqlite3.Connection):
+    """Соединение, все курсоры которого считают запросы SQL (см. RequestMetrics.instrument_database)."""
+
+    metrics: Optional['RequestMetrics'] = None
+
+    def cursor(self, factory=_CountingCursor):
+        return super().cursor(factory)
+
+    # Сокращенные методы sqlite3.Connection создают курсор в обход cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+class RequestMetrics:
+    """Метрики запросов Flask и обращений к базе.
+
+    before_request/after_request измеряют время ответа по маршруту (шаблону
+    URL, а не пути) и по справочнику (data_type_id из URL), а также число и
+    время запросов SQL и число выдач соединений за запрос API. Время
+    потокового ответа (экспорт) считается до отдачи последнего фрагмента,
+    объем ответа - до сжатия. Запросы SQL фоновых потоков (групповая
+    фиксация, изменения схемы) учитываются только в общих счетчиках.
+    render отдает метрики и служебную статистику сервера (пулы, кэши) в
+    текстовом формате Prometheus.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requests = _Counter(
+            'datavue_requests_total', 'Запросы API по маршруту, методу и коду ответа',
+            ('route', 'method', 'status')
+        )
+        self.request_seconds = _Histogram(
+            'datavue_request_duration_seconds', 'Время ответа API по маршруту',
+            LATENCY_BUCKETS, ('route', 'method')
+        )
+        self.data_type_seconds = _Histogram(
+            'datavue_data_type_request_duration_seconds', 'Время ответа API по справочнику и маршруту',
+            LATENCY_BUCKETS, ('data_type_id', 'route')
+        )
+        self.request_sql_statements = _Histogram(
+            'datavue_request_sql_statements', 'Число запросов SQL за один запрос API',
+            SQL_COUNT_BUCKETS, ('route',)
+        )
+        self.request_sql_seconds = _Histogram(
+            'datavue_request_sql_seconds', 'Время запросов SQL за один запрос API',
+            SQL_SECONDS_BUCKETS, ('route',)
+        )
+        self.request_connections = _Histogram(
+            'datavue_request_connection_leases', 'Выдачи соединений базы за один запрос API',
+            SQL_COUNT_BUCKETS, ('route',)
+        )
+        self.response_bytes = _Counter(
+            'datavue_response_bytes_total', 'Объем ответов API до сжатия (в том числе экспорта)',
+            ('route',)
+        )
+        self.sql_statements = _Counter('datavue_sql_statements_total', 'Запросы SQL всех потоков сервера')
+        self.sql_seconds = _Counter('datavue_sql_seconds_total', 'Время запросов SQL всех потоков сервера')
+        self.connection_leases = _Counter(
+            'datavue_connection_leases_total', 'Выдачи соединений DatabaseManager по пулу', ('pool',)
+        )
+        self._metrics = (
+            self.requests, self.request_seconds, self.data_type_seconds, self.request_sql_statements,
+            self.request_sql_seconds, self.request_connections, self.response_bytes,
+            self.sql_statements, self.sql_seconds, self.connection_leases
+        )
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def instrument_database(self, db):
+        """Подсчет запросов SQL и выдач соединений DatabaseManager."""
+        factory = type('CountingConnection', (_CountingConnection,), {'metrics': self})
+        for pool in (db.pool, db.read_pool):
+            pool.factory = factory
+            # Простаивающие соединения без счетчиков закрываются и открываются заново
+            pool.close_all()
+        db.get_connection = self._count_leases(db.get_connection, 'write')
+        db.get_read_connection = self._count_leases(db.get_read_connection, 'read')
+
+    def _count_leases(self, get_connection: Callable, pool: str) -> Callable:
+        @wraps(get_connection)
+        def counted(*args, **kwargs):
+            state = self._local
+            if getattr(state, 'active', False):
+                state.leases += 1
+            with self._lock:
+                self.connection_leases.inc((pool,))
+            return get_connection(*args, **kwargs)
+        return counted
+
+    def record_sql(self, seconds: float):
+        """Учет одного запроса SQL (вызывается курсором соединения)."""
+        state = self._local
+        if getattr(state, 'active', False):
+            state.sql_statements += 1
+            state.sql_seconds += seconds
+        with self._lock:
+            self.sql_statements.inc()
+            self.sql_seconds.inc(amount=seconds)
+
+    def _start_request(self):
+        state = self._local
+        state.active = True
+        state.started = time.perf_counter()
+        state.sql_statements = 0
+        state.sql_seconds = 0.0
+        state.leases = 0
+
+    def _finish_request(self, response):
+        state = self._local
+        if not getattr(state, 'active', False):
+            return response
+        state.active = False
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        data_type_id = (request.view_args or {}).get('data_type_id')
+        observation = (
+            route, request.method, str(response.status_code),
+            None if data_type_id is None else str(data_type_id),
+            state.started, state.sql_statements, state.sql_seconds, state.leases
+        )
+        if response.is_streamed and response.mimetype not in UNTIMED_MIMETYPES:
+            response.response = self._measure_stream(response.response, observation)
+        else:
+            self._observe(observation, response.content_length or 0)
+        return response
+
+    def _measure_stream(self, chunks: Iterable[Any], observation: tuple) -> Iterator[Any]:
+        """Фрагменты потокового ответа; время и объем учитываются после последнего фрагмента."""
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                yield chunk
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+            self._observe(observation, size)
+
+    def _observe(self, observation: tuple, size: int):
+        route, method, status, data_type_id, started, sql_statements, sql_seconds, leases = observation
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.requests.inc((route, method, status))
+            self.request_seconds.observe((route, method), elapsed)
+            if data_type_id is not None:
+                self.data_type_seconds.observe((data_type_id, route), elapsed)
+            self.request_sql_statements.observe((route,), sql_statements)
+            self.request_sql_seconds.observe((route,), sql_seconds)
+            self.request_connections.observe((route,), leases)
+            self.response_bytes.inc((route,), size)
+
+    def render(self, stats: Optional[Dict[str, Any]] = None) -> str:
+        """Метрики в текстовом формате Prometheus.
+
+        stats - служебная статистика по разделам (как в /api/admin/stats):
+        числовые значения отдаются как gauge datavue_<раздел>_<ключ>.
+        """
+        lines: List[str] = []
+        with self._lock:
+            for metric in self._metrics:
+                lines.extend(metric.render())
+        for section, values in (stats or {}).items():
+            if isinstance(values, dict):
+                for name, value in _flatten(f"datavue_{section}", values):
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _flatten(prefix: str, values: Dict[str, Any]) -> Iterator[Tuple[str, float]]:
+    """Числовые значения вложенного словаря статистики с именами метрик."""
+    for key, value in values.items():
+        name = _metric_name(f"{prefix}_{key}")
+        if isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+        elif isinstance(value, dict):
+            yield from _flatten(name, value)
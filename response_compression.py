@@ -0,0 +1,188 @@
+"""Сжатие ответов API (gzip, zstd) по заголовку Accept-Encoding."""
+
+import threading
+import time
+import zlib
+from typing import Dict, Any, Iterable, Iterator, Optional
+
+from flask import request
+
+# zstd - необязательная зависимость (пакет zstandard): сжимает быстрее gzip при том же размере
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Ответы меньше этого размера (в байтах) не сжимаются: выигрыш меньше накладных расходов
+DEFAULT_MIN_SIZE = 1024
+
+# Уровни сжатия по умолчанию: gzip 5 почти не уступает 6 по размеру и заметно быстрее
+DEFAULT_GZIP_LEVEL = 5
+DEFAULT_ZSTD_LEVEL = 3
+
+# Типы содержимого, которые имеет смысл сжимать (xlsx, изображения и т.п. уже сжаты;
+# text/event-stream не сжимается, чтобы события доходили до клиента сразу)
+COMPRESSIBLE_MIMETYPES = (
+    'application/json', 'application/msgpack', 'application/x-ndjson',
+    'text/csv', 'text/plain', 'text/html', 'text/css', 'application/javascript'
+)
+
+
+# Все поддерживаемые кодировки (zstd - только при установленном zstandard)
+ENCODINGS = ('zstd', 'gzip')
+
+
+def etag_variants(etag: str):
+    """ETag ответа и его варианты для сжатых представлений (с суффиксом кодировки)."""
+    return [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]
+
+
+class _GzipStream:
+    """Потоковый gzip поверх zlib (wbits=31 - формат gzip с заголовком)."""
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _ZstdStream:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class ResponseCompressor:
+    """Сжатие ответов Flask в after_request.
+
+    Кодировка выбирается по Accept-Encoding из доступных (zstd, если установлен
+    пакет zstandard, и gzip). Обычные ответы меньше min_size не сжимаются;
+    потоковые ответы (экспорт CSV, файлы заданий) сжимаются по мере отдачи,
+    без буферизации целиком. Ответы на запросы с Range не сжимаются. Для каждого
+    endpoint собирается статистика: объем до и после сжатия и время сжатия.
+    """
+
+    def __init__(self, app=None, min_size: int = DEFAULT_MIN_SIZE,
+                 gzip_level: int = DEFAULT_GZIP_LEVEL, zstd_level: int = DEFAULT_ZSTD_LEVEL):
+        self.min_size = min_size
+        self.levels = {'gzip': gzip_level, 'zstd': zstd_level}
+        self.encodings = (('zstd',) if zstandard is not None else ()) + ('gzip',)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.compress_response)
+
+    def _stream(self, encoding: str):
+        if encoding == 'zstd':
+            return _ZstdStream(self.levels['zstd'])
+        return _GzipStream(self.levels['gzip'])
+
+    def negotiate(self, accept_encodings) -> Optional[str]:
+        """Кодировка из Accept-Encoding или None (без сжатия)."""
+        return accept_encodings.best_match(self.encodings)
+
+    def compress_response(self, response):
+        if (request.method == 'HEAD' or not 200 <= response.status_code < 300 or response.status_code == 204
+                or 'Content-Encoding' in response.headers or 'Range' in request.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        # Представление ответа зависит от Accept-Encoding, даже если этот клиент сжатие не принимает
+        response.vary.add('Accept-Encoding')
+
+        streamed = response.is_streamed or response.direct_passthrough
+        if not streamed and response.content_length is not None and response.content_length < self.min_size:
+            return response
+        encoding = self.negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        endpoint = request.endpoint or request.path
+        if streamed:
+            response.response = self._compress_stream(response.response, encoding, endpoint)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+            response.headers.pop('Accept-Ranges', None)
+        else:
+            data = response.get_data()
+            started = time.perf_counter()
+            stream = self._stream(encoding)
+            compressed = stream.compress(data) + stream.flush()
+            self._record(endpoint, encoding, len(data), len(compressed), time.perf_counter() - started)
+            response.set_data(compressed)
+
+        response.headers['Content-Encoding'] = encoding
+        # Сжатое представление - другие байты: сильный ETag получает суффикс кодировки
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(f"{etag}-{encoding}")
+        return response
+
+    def _compress_stream(self, chunks: Iterable[bytes], encoding: str, endpoint: str) -> Iterator[bytes]:
+        """Сжатие потока фрагментов; статистика записывается в конце отдачи."""
+        stream = self._stream(encoding)
+        size_in = size_out = 0
+        seconds = 0.0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                started = time.perf_counter()
+                compressed = stream.compress(chunk)
+                seconds += time.perf_counter() - started
+                size_in += len(chunk)
+                if compressed:
+                    size_out += len(compressed)
+                    yield compressed
+            started = time.perf_counter()
+            tail = stream.flush()
+            seconds += time.perf_counter() - started
+            size_out += len(tail)
+            yield tail
+            self._record(endpoint, encoding, size_in, size_out, seconds)
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    def _record(self, endpoint: str, encoding: str, size_in: int, size_out: int, seconds: float):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0, 'encodings': {}
+            })
+            stats['responses'] += 1
+            stats['bytes_in'] += size_in
+            stats['bytes_out'] += size_out
+            stats['seconds'] += seconds
+            stats['encodings'][encoding] = stats['encodings'].get(encoding, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика сжатия по endpoint: степень сжатия и время на мегабайт исходных данных."""
+        with self._lock:
+            endpoints = {
+                endpoint: dict(
+                    stats,
+                    encodings=dict(stats['encodings']),
+                    seconds=round(stats['seconds'], 4),
+                    ratio=round(stats['bytes_in'] / stats['bytes_out'], 2) if stats['bytes_out'] else None,
+                    ms_per_mb=round(stats['seconds'] * 1000 / (stats['bytes_in'] / 1e6), 2) if stats['bytes_in'] else None
+                )
+                for endpoint, stats in self._stats.items()
+            }
+        return {
+            'encodings': list(self.encodings),
+            'levels': dict(self.levels),
+            'min_size': self.min_size,
+            'endpoints': endpoints
+        }
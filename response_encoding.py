@@ -0,0 +1,126 @@
+"""Кодирование ответов API: быстрый JSON, колоночный формат списков записей и MessagePack."""
+
+import json
+import os
+from typing import Callable, Dict, Any, List, Optional, Sequence
+
+from flask.json.provider import DefaultJSONProvider
+
+# Необязательные зависимости: orjson ускоряет JSON, msgpack нужен для двоичного формата
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# Колонки со строками, которые повторяются из записи в запись: в колоночном
+# формате значения заменяются номерами в словаре
+DICTIONARY_COLUMNS = ('created_by_username', 'created_by_full_name')
+
+
+def _stdlib_dumps(obj: Any, default: Callable[[Any], Any]) -> bytes:
+    # Кириллица без \uXXXX: в UTF-8 это 2 байта на букву вместо 6
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _orjson_dumps(obj: Any, default: Callable[[Any], Any]) -> bytes:
+    return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+# Кодировщики JSON по имени: объект -> байты UTF-8
+JSON_ENCODERS: Dict[str, Callable[[Any, Callable[[Any], Any]], bytes]] = {'json': _stdlib_dumps}
+if orjson is not None:
+    JSON_ENCODERS['orjson'] = _orjson_dumps
+
+
+def resolve_json_encoder(name: Optional[str] = None) -> str:
+    """Имя кодировщика JSON: заданный (или DATAVUE_JSON_ENCODER), если он доступен.
+
+    По умолчанию выбирается самый быстрый из установленных.
+    """
+    name = (name or os.environ.get('DATAVUE_JSON_ENCODER') or 'auto').lower()
+    if name == 'auto':
+        return 'orjson' if 'orjson' in JSON_ENCODERS else 'json'
+    if name not in JSON_ENCODERS:
+        print(f"⚠️  Кодировщик JSON '{name}' недоступен, используется стандартный json")
+        return 'json'
+    return name
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask с заменяемым кодировщиком.
+
+    Ответы jsonify кодируются сразу в байты выбранным кодировщиком, без
+    сортировки ключей и экранирования не-ASCII символов. В режиме отладки
+    (форматированный вывод) используется стандартная реализация Flask.
+    """
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def __init__(self, app, encoder: Optional[str] = None):
+        super().__init__(app)
+        self.encoder = resolve_json_encoder(encoder)
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        return JSON_ENCODERS[self.encoder](obj, self.default)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def response(self, *args: Any, **kwargs: Any):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def pack_msgpack(obj: Any) -> bytes:
+    """Объект в MessagePack (нужен пакет msgpack)."""
+    return msgpack.packb(obj, use_bin_type=True, default=str)
+
+
+def negotiate_records_mimetype(accept) -> Optional[str]:
+    """Формат ответа со списком записей по заголовку Accept.
+
+    MessagePack выбирается, только если клиент предпочитает его JSON. Если
+    пакет msgpack не установлен, а JSON клиент не принимает, возвращается
+    None (ответ 406). Без заголовка Accept - JSON.
+    """
+    if accept.best_match((JSON_MIMETYPE, MSGPACK_MIMETYPE)) != MSGPACK_MIMETYPE:
+        return JSON_MIMETYPE
+    if msgpack is not None:
+        return MSGPACK_MIMETYPE
+    return JSON_MIMETYPE if accept.best_match((JSON_MIMETYPE,)) else None
+
+
+def columnar_records(columns: Sequence[str], rows: List[Sequence[Any]]) -> Dict[str, Any]:
+    """Записи в колоночном виде: имена колонок один раз и массив значений на колонку.
+
+    values[i] - значения колонки columns[i] по записям в исходном порядке.
+    Для колонок из DICTIONARY_COLUMNS в values лежат номера, а сами строки -
+    в dictionaries[<колонка>]: значение = dictionaries[колонка][номер].
+    """
+    values = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+    dictionaries = {}
+    for index, name in enumerate(columns):
+        if name in DICTIONARY_COLUMNS:
+            codes = {}
+            values[index] = [codes.setdefault(value, len(codes)) for value in values[index]]
+            dictionaries[name] = list(codes)
+    return {
+        'format': 'columnar',
+        'count': len(rows),
+        'columns': list(columns),
+        'values': values,
+        'dictionaries': dictionaries
+    }
@@ -0,0 +1,144 @@
+"""Кэш схемы справочников: типы данных, поля, значения enum и наличие таблиц."""
+
+import copy
+import threading
+from typing import Callable, Dict, Any, Optional
+
+
+class SchemaCatalog:
+    """Версионированный кэш метаданных справочников в памяти процесса.
+
+    Схема справочника загружается одним запросом с JOIN и хранится до явной
+    инвалидации. Каждая инвалидация увеличивает поколение справочника, поэтому
+    результат загрузки, начатой до изменения схемы, в кэш не попадает.
+    """
+
+    LOAD_SQL = '''
+        SELECT dt.id, dt.name, dt.description, dt.created_by, dt.created_at,
+               EXISTS(
+                   SELECT 1 FROM sqlite_master
+                   WHERE type = 'table' AND name = 'data_' || dt.id
+               ) AS table_exists,
+               f.id, f.field_name, f.field_type, f.is_required,
+               f.description, f.validation_rules,
+               e.value
+        FROM data_types dt
+        LEFT JOIN data_fields f ON f.data_type_id = dt.id
+        LEFT JOIN enum_field_values e ON e.field_id = f.id AND f.field_type = 'enum'
+        WHERE dt.id = ?
+        ORDER BY f.id, e.display_order, e.value
+    '''
+
+    def __init__(self, connection_factory: Callable):
+        """connection_factory - функция, возвращающая контекст соединения (DatabaseManager.get_connection)."""
+        self._connection_factory = connection_factory
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._generations: Dict[int, int] = {}
+        self._global_generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def _generation(self, data_type_id: int) -> tuple:
+        return (self._global_generation, self._generations.get(data_type_id, 0))
+
+    def get(self, data_type_id: int) -> Optional[Dict[str, Any]]:
+        """Схема справочника (не копия - изменять нельзя) или None, если его нет."""
+        with self._lock:
+            entry = self._entries.get(data_type_id)
+            if entry is not None:
+                self._hits += 1
+                return entry
+            self._misses += 1
+            generation = self._generation(data_type_id)
+
+        entry = self._load(data_type_id)
+        if entry is None:
+            # Отсутствующие справочники не кэшируем: их могут создать извне
+            return None
+
+        with self._lock:
+            if self._generation(data_type_id) == generation:
+                self._entries[data_type_id] = entry
+        return entry
+
+    def get_copy(self, data_type_id: int) -> Optional[Dict[str, Any]]:
+        """Глубокая копия схемы для передачи наружу."""
+        entry = self.get(data_type_id)
+        return copy.deepcopy(entry) if entry is not None else None
+
+    def _load(self, data_type_id: int) -> Optional[Dict[str, Any]]:
+        """Загрузка схемы справочника одним запросом."""
+        with self._connection_factory() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.LOAD_SQL, (data_type_id,))
+            rows = cursor.fetchall()
+
+        if not rows:
+            return None
+
+        first = rows[0]
+        entry = {
+            'data_type': {
+                'id': first[0],
+                'name': first[1],
+                'description': first[2],
+                'created_by': first[3],
+                'created_at': first[4]
+            },
+            'table_exists': bool(first[5]),
+            'fields': [],
+            'fields_by_name': {}
+        }
+
+        current = None
+        for row in rows:
+            field_id = row[6]
+            if field_id is None:
+                continue
+            if current is None or current['id'] != field_id:
+                current = {
+                    'id': field_id,
+                    'field_name': row[7],
+                    'field_type': row[8],
+                    'is_required': row[9],
+                    'description': row[10],
+                    'validation_rules': row[11]
+                }
+                if current['field_type'] == 'enum':
+                    current['enum_values'] = []
+                entry['fields'].append(current)
+                entry['fields_by_name'][current['field_name']] = current
+            if row[12] is not None:
+                current['enum_values'].append(row[12])
+
+        return entry
+
+    def invalidate(self, data_type_id: Optional[int] = None):
+        """Сброс схемы справочника (или всех справочников, если id не указан)."""
+        with self._lock:
+            self._invalidations += 1
+            if data_type_id is None:
+                self._global_generation += 1
+                self._entries.clear()
+            else:
+                self._generations[data_type_id] = self._generations.get(data_type_id, 0) + 1
+                self._entries.pop(data_type_id, None)
+
+    def get_version(self, data_type_id: int) -> tuple:
+        """Текущее поколение схемы справочника."""
+        with self._lock:
+            return self._generation(data_type_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов кэша."""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / total, 4) if total else None,
+                'invalidations': self._invalidations
+            }
@@ -0,0 +1,260 @@
+"""Последовательное выполнение изменений схемы справочников (DDL)."""
+
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Optional, Set, Tuple
+
+# Пауза между попытками захватить блокировку записи, которую держит другой
+# процесс (например, офлайн-загрузка); растет вдвое до предела
+LOCK_RETRY_DELAY = 0.05
+MAX_LOCK_RETRY_DELAY = 2.0
+
+# Сколько всего (в секундах) изменение схемы ждет блокировку записи, прежде
+# чем завершиться ошибкой
+MAX_LOCK_WAIT = 60.0
+
+
+class SchemaLockTimeoutError(sqlite3.OperationalError):
+    """Изменение схемы не дождалось блокировки записи, которую держит другой процесс."""
+
+
+def _is_lock_error(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class SchemaGate:
+    """Блокировка схемы по справочникам: записи - совместно, изменения схемы - монопольно.
+
+    Изменение схемы справочника ждет завершения уже начатых записей в этот
+    справочник, а новые записи в него, пришедшие после изменения, ждут, пока
+    оно выполнится: изменения схемы не голодают при постоянном потоке
+    записей, и записи не упираются в блокировку SQLite на время миграции.
+    Записи в другие справочники (например, долгая потоковая загрузка) не
+    ждут чужих изменений схемы и не задерживают их.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._writers: Dict[Any, int] = {}
+        self._schema_waiting: Dict[Any, int] = {}
+        self._schema_active: Set[Any] = set()
+
+    @contextmanager
+    def shared(self, key: Any = None):
+        with self._condition:
+            while key in self._schema_active or self._schema_waiting.get(key):
+                self._condition.wait()
+            self._writers[key] = self._writers.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writers[key] -= 1
+                if not self._writers[key]:
+                    del self._writers[key]
+                    self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self, key: Any = None):
+        with self._condition:
+            self._schema_waiting[key] = self._schema_waiting.get(key, 0) + 1
+            try:
+                while key in self._schema_active or self._writers.get(key):
+                    self._condition.wait()
+            finally:
+                self._schema_waiting[key] -= 1
+                if not self._schema_waiting[key]:
+                    del self._schema_waiting[key]
+            self._schema_active.add(key)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._schema_active.discard(key)
+                self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                'writers_active': sum(self._writers.values()),
+                'schema_waiting': sum(self._schema_waiting.values()),
+                'schema_active': bool(self._schema_active)
+            }
+
+
+class SchemaChangeExecutor:
+    """Очередь изменений схемы с одним исполнителем.
+
+    Изменения выполняются строго по одному в порядке поступления. Каждое -
+    функция от курсора, выполняемая в своей транзакции под монопольной
+    блокировкой схемы своего справочника (см. SchemaGate). Если блокировку записи SQLite держит
+    другой процесс, исполнитель ждет и повторяет попытку (сначала без
+    блокировки схемы, чтобы не останавливать записи), но не дольше
+    max_lock_wait секунд - затем изменение завершается ошибкой. Для
+    мониторинга собираются длина очереди, время ожидания и выполнения
+    изменений.
+    """
+
+    def __init__(self, connection_factory: Callable, gate: Optional[SchemaGate] = None,
+                 max_lock_wait: float = MAX_LOCK_WAIT):
+        self._connection_factory = connection_factory
+        self.gate = gate or SchemaGate()
+        self.max_lock_wait = max_lock_wait
+        self._queue: 'queue.Queue[Tuple[Callable, str, Optional[Callable], Any, Future, float]]' = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._local = threading.local()
+        self._running: Optional[str] = None
+        self._running_since: Optional[float] = None
+        self._completed = 0
+        self._failed = 0
+        self._lock_retries = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='datavue-schema-changes', daemon=True)
+                self._thread.start()
+
+    def submit(self, operation: Callable[[sqlite3.Cursor], Any], description: str = '',
+               on_finish: Optional[Callable[[], None]] = None, key: Any = None) -> Any:
+        """Выполнение изменения схемы в очереди; возвращает результат операции.
+
+        key - справочник, схема которого меняется (ключ SchemaGate): изменение
+        ждет только записей в этот справочник.
+
+        on_finish вызывается после фиксации (или отката) изменения, но до
+        снятия монопольной блокировки схемы: например, сброс кэша схемы, чтобы
+        записи после изменения не взяли старую схему. Вызов из самого
+        исполнителя (вложенное изменение) выполняется сразу в текущей
+        транзакции; его on_finish вызывается сразу после операции.
+        """
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is not None:
+            try:
+                return operation(cursor)
+            finally:
+                if on_finish is not None:
+                    on_finish()
+        self._start()
+        future: Future = Future()
+        self._queue.put((operation, description, on_finish, key, future, time.monotonic()))
+        return future.result()
+
+    def _run(self):
+        while True:
+            operation, description, on_finish, key, future, queued_at = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            acquired = time.monotonic()
+            with self._lock:
+                self._running, self._running_since = description, acquired
+            try:
+                deadline = acquired + self.max_lock_wait
+                # Блокировку, которую держит другой процесс, ждем до монопольной
+                # блокировки схемы: пока ждем, записи этого процесса не стоят
+                self._wait_for_write_lock(deadline)
+                with self.gate.exclusive(key):
+                    acquired = time.monotonic()
+                    try:
+                        result = self._execute(operation, deadline)
+                    finally:
+                        if on_finish is not None:
+                            on_finish()
+            except Exception as e:
+                self._finish(queued_at, acquired, failed=True)
+                future.set_exception(e)
+            else:
+                self._finish(queued_at, acquired, failed=False)
+                future.set_result(result)
+
+    def _wait_for_write_lock(self, deadline: float):
+        """Ожидание, пока другой процесс отпустит блокировку записи (без захвата)."""
+        with self._connection_factory() as conn:
+            self._begin_with_retry(conn, deadline)
+            conn.rollback()
+
+    def _execute(self, operation: Callable[[sqlite3.Cursor], Any], deadline: float) -> Any:
+        with self._connection_factory() as conn:
+            self._begin_with_retry(conn, deadline)
+            cursor = conn.cursor()
+            self._local.cursor = cursor
+            try:
+                result = operation(cursor)
+            finally:
+                self._local.cursor = None
+            conn.commit()
+            return result
+
+    def _begin_with_retry(self, conn: sqlite3.Connection, deadline: float):
+        """BEGIN IMMEDIATE с повторами, пока блокировку держит другой процесс, но не дольше deadline."""
+        if conn.in_transaction:
+            conn.commit()
+        # busy_timeout соединения (30 с) не должен растягивать ожидание за deadline
+        busy_timeout = conn.execute('PRAGMA busy_timeout').fetchone()[0]
+        delay = LOCK_RETRY_DELAY
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                conn.execute(f'PRAGMA busy_timeout={max(0, min(busy_timeout, int(remaining * 1000)))}')
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    return
+                except sqlite3.OperationalError as e:
+                    if not _is_lock_error(e):
+                        raise
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SchemaLockTimeoutError(
+                            f"Изменение схемы не получило блокировку базы за {self.max_lock_wait:g} с: "
+                            f"ее держит другой процесс ({e})"
+                        ) from e
+                    with self._lock:
+                        self._lock_retries += 1
+                    print(f"Изменение схемы ждет блокировку базы: {e}")
+                    time.sleep(min(delay, remaining))
+                    delay = min(delay * 2, MAX_LOCK_RETRY_DELAY)
+        finally:
+            conn.execute(f'PRAGMA busy_timeout={busy_timeout}')
+
+    def _finish(self, queued_at: float, acquired: float, failed: bool):
+        # Ожидание - от постановки в очередь до получения блокировки схемы
+        waited = acquired - queued_at
+        elapsed = time.monotonic() - acquired
+        with self._lock:
+            self._running = self._running_since = None
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._run_total += elapsed
+            self._run_max = max(self._run_max, elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Очередь изменений схемы: длина, текущее изменение, время ожидания и выполнения."""
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                'queued': self._queue.qsize(),
+                'running': self._running,
+                'running_seconds': round(time.monotonic() - self._running_since, 3) if self._running_since else None,
+                'completed': self._completed,
+                'failed': self._failed,
+                'lock_retries': self._lock_retries,
+                'wait_seconds_avg': round(self._wait_total / finished, 4) if finished else None,
+                'wait_seconds_max': round(self._wait_max, 4),
+                'run_seconds_avg': round(self._run_total / finished, 4) if finished else None,
+                'run_seconds_max': round(self._run_max, 4),
+                'gate': self.gate.stats()
+            }
@@ -0,0 +1,155 @@
+"""Миграция схемы динамических таблиц data_{id} без построчного переписывания в Python."""
+
+import sqlite3
+import time
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+
+# Служебные колонки, присутствующие в каждой таблице данных
+SERVICE_COLUMNS = ('id', 'created_by', 'created_at')
+
+# ALTER TABLE ... DROP COLUMN появился в SQLite 3.35.0
+SUPPORTS_DROP_COLUMN = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def build_create_table_sql(table_name: str, columns: List[Tuple[str, str]]) -> str:
+    """SQL создания таблицы данных с указанными пользовательскими колонками."""
+    definitions = [
+        'id INTEGER PRIMARY KEY AUTOINCREMENT',
+        'created_by INTEGER',
+        'created_at TIMESTAMP'
+    ]
+    definitions += [f"{name} {sql_type}" for name, sql_type in columns]
+    definitions.append('FOREIGN KEY (created_by) REFERENCES users (id)')
+    return f"CREATE TABLE {table_name} ({', '.join(definitions)})"
+
+
+class DataTableMigrator:
+    """Приведение существующей таблицы данных к новому набору колонок.
+
+    Если изменился только состав колонок, используются ALTER TABLE ADD COLUMN
+    и DROP COLUMN (данные не копируются). Иначе таблица пересоздается: данные
+    переносятся запросами INSERT INTO ... SELECT по диапазонам id внутри SQLite,
+    после чего новая таблица переименовывается.
+    """
+
+    def __init__(self, cursor, table_name: str, columns: List[Tuple[str, str]],
+                 progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 batch_size: int = 100000):
+        self.cursor = cursor
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.progress = progress
+        self.batch_size = batch_size
+
+    def _report(self, stage: str, **info):
+        """Передача прогресса миграции в callback."""
+        if self.progress:
+            self.progress({'table': self.table_name, 'stage': stage, **info})
+
+    def _existing_columns(self) -> Dict[str, str]:
+        self.cursor.execute(f"PRAGMA table_info({self.table_name})")
+        return {row[1]: (row[2] or '').upper() for row in self.cursor.fetchall()}
+
+    def plan(self) -> Dict[str, Any]:
+        """План миграции: добавляемые, удаляемые колонки и способ выполнения."""
+        existing = self._existing_columns()
+        if not existing:
+            return {'strategy': 'create', 'add': [], 'drop': []}
+
+        wanted = {name: sql_type.upper() for name, sql_type in self.columns}
+        add = [(name, sql_type) for name, sql_type in self.columns if name not in existing]
+        drop = [name for name in existing if name not in SERVICE_COLUMNS and name not in wanted]
+        retyped = [name for name, sql_type in wanted.items()
+                   if name in existing and existing[name] != sql_type]
+
+        if retyped or (drop and not SUPPORTS_DROP_COLUMN):
+            strategy = 'rebuild'
+        elif add or drop:
+            strategy = 'alter'
+        else:
+            strategy = 'noop'
+        return {'strategy': strategy, 'add': add, 'drop': drop, 'retyped': retyped}
+
+    def run(self) -> Dict[str, Any]:
+        """Выполнение миграции в текущей транзакции курсора."""
+        started = time.perf_counter()
+        plan = self.plan()
+        self._report('plan', **plan)
+
+        if plan['strategy'] == 'create':
+            self.cursor.execute(build_create_table_sql(self.table_name, self.columns))
+            rows = 0
+        elif plan['strategy'] == 'alter':
+            try:
+                self._alter(plan)
+                rows = None
+            except sqlite3.OperationalError as e:
+                # Например, DROP COLUMN невозможен для колонки, входящей в индекс
+                self._report('fallback', reason=str(e))
+                plan['strategy'] = 'rebuild'
+                rows = self._rebuild()
+        elif plan['strategy'] == 'rebuild':
+            rows = self._rebuild()
+        else:
+            rows = None
+
+        result = {
+            'strategy': plan['strategy'],
+            'added': [name for name, _ in plan['add']],
+            'dropped': plan['drop'],
+            'rows_copied': rows,
+            'elapsed_seconds': round(time.perf_counter() - started, 4)
+        }
+        self._report('done', **result)
+        return result
+
+    def _alter(self, plan: Dict[str, Any]):
+        """Изменение таблицы на месте через ALTER TABLE."""
+        for name, sql_type in plan['add']:
+            self.cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {name} {sql_type}")
+            self._report('add_column', column=name)
+        for name in plan['drop']:
+            self.cursor.execute(f"ALTER TABLE {self.table_name} DROP COLUMN {name}")
+            self._report('drop_column', column=name)
+
+    def _rebuild(self) -> int:
+        """Пересоздание таблицы с переносом данных средствами SQLite."""
+        existing = self._existing_columns()
+        new_table = f"{self.table_name}__migrating"
+        kept = list(SERVICE_COLUMNS) + [name for name, _ in self.columns if name in existing]
+        columns_sql = ', '.join(kept)
+
+        self.cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+        self.cursor.execute(build_create_table_sql(new_table, self.columns))
+
+        self.cursor.execute(f"SELECT COUNT(*), MIN(id), MAX(id) FROM {self.table_name}")
+        total, min_id, max_id = self.cursor.fetchone()
+        self._report('copy', rows_copied=0, rows_total=total)
+
+        copied = 0
+        if total:
+            low = min_id - 1
+            while low < max_id:
+                high = low + self.batch_size
+                self.cursor.execute(f'''
+                    INSERT INTO {new_table} ({columns_sql})
+                    SELECT {columns_sql} FROM {self.table_name}
+                    WHERE id > ? AND id <= ?
+                ''', (low, high))
+                copied += max(self.cursor.rowcount, 0)
+                low = high
+                self._report('copy', rows_copied=copied, rows_total=total)
+
+        # Сохраняем счетчик AUTOINCREMENT, чтобы id удаленных записей не переиспользовались
+        self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (self.table_name,))
+        sequence = self.cursor.fetchone()
+
+        self.cursor.execute(f"DROP TABLE {self.table_name}")
+        self.cursor.execute(f"ALTER TABLE {new_table} RENAME TO {self.table_name}")
+
+        if sequence:
+            self.cursor.execute('''
+                UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?
+            ''', (sequence[0], self.table_name))
+        return copied
@@ -1,24 +1,109 @@
 """Flask сервер для системы управления данными."""
-from flask import Flask, request, jsonify, session, Response
+from flask import Flask, request, jsonify, session, Response, send_file
 from flask_cors import CORS
 from functools import wraps
 import sqlite3
-from datetime import datetime
-import csv
-import io
+import os
+from datetime import datetime, timezone
 import json
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
+import time
+import hashlib
 from database import DatabaseManager
+from record_query import parse_filter_param
+from statistics_engine import parse_percentiles
+from record_validation import iter_ndjson, iter_stream_lines
+from spatial_index import parse_bbox, DEFAULT_WITHIN_LIMIT, MAX_WITHIN_LIMIT
+from csv_import import CsvRecordReader, CsvImportError, CSV_DELIMITERS, open_text_stream
+from exports import (
+    EXPORT_BATCH_SIZE, CSV_MIMETYPE, XLSX_MIMETYPE, select_export_fields, export_filename,
+    iter_csv, write_xlsx, create_temp_export_file, iter_file
+)
+from schema_changes import SchemaLockTimeoutError
+from export_jobs import ExportJobManager, ExportJobError, ExportQueueFullError, EXPORT_FORMATS
+from change_log import DEFAULT_CHANGES_LIMIT, MAX_CHANGES_LIMIT
+from group_commit import DEFAULT_MAX_BATCH, DEFAULT_MAX_DELAY, DEFAULT_SYNCHRONOUS
+from connection_pool import DEFAULT_READ_MMAP_SIZE
+from request_metrics import RequestMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from change_events import (
+    ChangeBroadcaster, TooManyStreamsError, DEFAULT_MAX_STREAMS, DEFAULT_MAX_STREAMS_PER_USER, DEFAULT_QUEUE_SIZE
+)
+from response_encoding import FastJSONProvider, MSGPACK_MIMETYPE, negotiate_records_mimetype, pack_msgpack
+from response_compression import (
+    ResponseCompressor, DEFAULT_MIN_SIZE, DEFAULT_GZIP_LEVEL, DEFAULT_ZSTD_LEVEL, etag_variants
+)
 
 app = Flask(__name__)
+# Кодировщик JSON задается переменной DATAVUE_JSON_ENCODER (json, orjson; по умолчанию самый быстрый)
+app.json = FastJSONProvider(app)
 
 app.secret_key = 'your-secret-key-here'
 CORS(app, supports_credentials=True)
 
-
-db = DatabaseManager()
-
+# Типы содержимого, которые разбираются как NDJSON (одна запись JSON на строку)
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+db = DatabaseManager(
+    pool_size=int(os.environ.get('DATAVUE_DB_POOL_SIZE', '8')),
+    pool_timeout=float(os.environ.get('DATAVUE_DB_POOL_TIMEOUT', '30')),
+    read_pool_size=int(os.environ.get('DATAVUE_DB_READ_POOL_SIZE', '8')),
+    read_mmap_size=int(os.environ.get('DATAVUE_DB_READ_MMAP_SIZE', str(DEFAULT_READ_MMAP_SIZE)))
+)
+
+# Групповая фиксация вставок, изменений и удалений записей (один поток-писатель)
+if os.environ.get('DATAVUE_GROUP_COMMIT', '0') == '1':
+    db.enable_group_commit(
+        max_batch=int(os.environ.get('DATAVUE_GROUP_COMMIT_MAX_BATCH', str(DEFAULT_MAX_BATCH))),
+        max_delay=float(os.environ.get('DATAVUE_GROUP_COMMIT_MAX_DELAY_MS', str(DEFAULT_MAX_DELAY * 1000))) / 1000,
+        synchronous=os.environ.get('DATAVUE_GROUP_COMMIT_SYNCHRONOUS', DEFAULT_SYNCHRONOUS)
+    )
+
+# Сжатие ответов (gzip, zstd) можно отключить, если его выполняет прокси перед сервером
+compressor = None
+if os.environ.get('DATAVUE_COMPRESSION', '1') != '0':
+    compressor = ResponseCompressor(
+        app,
+        min_size=int(os.environ.get('DATAVUE_COMPRESSION_MIN_SIZE', str(DEFAULT_MIN_SIZE))),
+        gzip_level=int(os.environ.get('DATAVUE_GZIP_LEVEL', str(DEFAULT_GZIP_LEVEL))),
+        zstd_level=int(os.environ.get('DATAVUE_ZSTD_LEVEL', str(DEFAULT_ZSTD_LEVEL)))
+    )
+
+export_jobs = ExportJobManager(
+    db,
+    artifact_dir=os.environ.get('DATAVUE_EXPORT_DIR', 'exports'),
+    max_workers=int(os.environ.get('DATAVUE_EXPORT_WORKERS', '2')),
+    max_pending=int(os.environ.get('DATAVUE_EXPORT_MAX_PENDING', '20')),
+    max_per_user=int(os.environ.get('DATAVUE_EXPORT_MAX_PER_USER', '3')),
+    ttl=int(os.environ.get('DATAVUE_EXPORT_TTL', '86400'))
+)
+
+# Потоки событий (SSE) об изменениях записей для открытых представлений
+change_events = ChangeBroadcaster(
+    db,
+    max_streams=int(os.environ.get('DATAVUE_SSE_MAX_STREAMS', str(DEFAULT_MAX_STREAMS))),
+    max_streams_per_user=int(os.environ.get('DATAVUE_SSE_MAX_PER_USER', str(DEFAULT_MAX_STREAMS_PER_USER))),
+    queue_size=int(os.environ.get('DATAVUE_SSE_QUEUE_SIZE', str(DEFAULT_QUEUE_SIZE))),
+    dumps=app.json.dumps
+)
+
+# Метрики запросов и обращений к базе в формате Prometheus (GET /api/admin/metrics).
+# Хуки регистрируются после сжатия ответов: объем ответа считается до сжатия
+metrics = None
+if os.environ.get('DATAVUE_METRICS', '1') != '0':
+    metrics = RequestMetrics(app)
+    metrics.instrument_database(db)
+
+
+@app.before_request
+def bind_db_connection():
+    """Одно соединение из пула на весь HTTP-запрос."""
+    db.begin_request_scope()
+
+
+@app.teardown_request
+def release_db_connection(exc):
+    """Возврат соединения запроса в пул."""
+    db.end_request_scope()
 
 
 def format_datetime(dt_string):
@@ -36,6 +121,82 @@ def format_datetime(dt_string):
 
 
 
+def records_response(payload):
+    """Ответ со списком записей в формате из заголовка Accept: JSON или MessagePack."""
+    mimetype = negotiate_records_mimetype(request.accept_mimetypes)
+    if mimetype is None:
+        response = jsonify({'error': 'Формат MessagePack недоступен: на сервере не установлен пакет msgpack'})
+        response.status_code = 406
+        return response
+    if mimetype == MSGPACK_MIMETYPE:
+        response = Response(pack_msgpack(payload), mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(payload)
+    response.vary.add('Accept')
+    return response
+
+
+def data_version_validators(data_type_id, representation=''):
+    """ETag и Last-Modified ответа, который зависит только от данных справочника.
+
+    ETag строится из версии данных, URL запроса и формата ответа, поэтому для
+    проверки If-None-Match достаточно прочитать версию (поиск по ключу).
+    Last-Modified с точностью до секунды отдается, только когда секунда
+    изменения уже прошла: иначе два изменения в одну секунду дали бы одну дату.
+    """
+    version, modified_at = db.get_data_version(data_type_id)
+    key = f"{request.full_path}|{representation}|{app.json.encoder}"
+    etag = f"{data_type_id}-{version}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+    last_modified = None
+    if modified_at is not None and int(modified_at) < int(time.time()):
+        last_modified = datetime.fromtimestamp(int(modified_at), timezone.utc)
+    return etag, last_modified
+
+
+def not_modified_response(etag, last_modified):
+    """Ответ 304, если у клиента актуальная копия, иначе None.
+
+    If-None-Match сравнивается и с вариантами ETag сжатых ответов; If-Modified-Since
+    учитывается, только если If-None-Match не передан.
+    """
+    if request.if_none_match:
+        matched = next((tag for tag in etag_variants(etag) if request.if_none_match.contains_weak(tag)), None)
+        if matched is None:
+            return None
+    elif last_modified is not None and request.if_modified_since is not None:
+        if last_modified > request.if_modified_since:
+            return None
+        matched = etag
+    else:
+        return None
+    response = Response(status=304)
+    return set_version_headers(response, matched, last_modified)
+
+
+def set_version_headers(response, etag, last_modified):
+    """ETag и Last-Modified для успешного ответа; браузер хранит ответ и перепроверяет его."""
+    if response.status_code not in (200, 304):
+        return response
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def schema_lock_timeout_response(error):
+    """503 с Retry-After: изменение схемы не дождалось блокировки, которую держит другой процесс."""
+    response = jsonify({
+        'error': 'База данных занята другим процессом (например, загрузкой). '
+                 'Изменение схемы не выполнено, попробуйте еще раз позже.',
+        'details': str(error)
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '30'
+    return response
+
+
 def login_required(f):
     """Декоратор для проверки аутентификации."""
     @wraps(f)
@@ -44,6 +205,11 @@ def login_required(f):
             return jsonify({
             'error': 'Требуется аутентификация'
         }), 401
+        if not db.is_active_user(session['user_id']):
+            session.clear()
+            return jsonify({
+            'error': 'Требуется аутентификация'
+        }), 401
         return f(*args, **kwargs)
     return decorated_function
 
@@ -57,6 +223,11 @@ def admin_required(f):
             return jsonify({
             'error': 'Требуется аутентификация'
         }), 401
+        if not db.is_active_user(session['user_id']):
+            session.clear()
+            return jsonify({
+            'error': 'Требуется аутентификация'
+        }), 401
         if not db.is_admin(session['user_id']):
             return jsonify({
             'error': 'Требуются права администратора'
@@ -157,6 +328,8 @@ def create_data_type():
             'message': 'Тип данных создан',
             'data_type_id': data_type_id
         })
+    except SchemaLockTimeoutError as e:
+        return schema_lock_timeout_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
@@ -172,8 +345,13 @@ def get_data_fields(data_type_id):
     if not db.has_permission(session['user_id'], data_type_id, 'read'):
         return jsonify({'error': 'Недостаточно прав для просмотра полей'}), 403
 
+    validators = data_version_validators(data_type_id)
+    cached = not_modified_response(*validators)
+    if cached:
+        return cached
+
     fields = db.get_data_fields(data_type_id)
-    return jsonify(fields)
+    return set_version_headers(jsonify(fields), *validators)
 
 
 
@@ -239,11 +417,10 @@ def add_data_field(data_type_id):
         })
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
+    except SchemaLockTimeoutError as e:
+        return schema_lock_timeout_response(e)
     except sqlite3.OperationalError as e:
-        if "database is locked" in str(e):
-            return jsonify({'error': 'База данных временно заблокирована. Попробуйте еще раз через несколько секунд.'}), 503
-        else:
-            return jsonify({'error': f'Ошибка базы данных: {str(e)}'}), 500
+        return jsonify({'error': f'Ошибка базы данных: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'error': f'Неожиданная ошибка: {str(e)}'}), 500
 
@@ -266,8 +443,7 @@ def get_enum_values(data_type_id, field_id):
         if field['field_type'] != 'enum':
             return jsonify({'error': 'Поле не является enum типом'}), 400
         
-        values = db.get_enum_values(field_id)
-        return jsonify({'values': values})
+        return jsonify({'values': field.get('enum_values', [])})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -316,11 +492,10 @@ def delete_data_field(data_type_id, field_id):
         })
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
+    except SchemaLockTimeoutError as e:
+        return schema_lock_timeout_response(e)
     except sqlite3.OperationalError as e:
-        if "database is locked" in str(e):
-            return jsonify({'error': 'База данных временно заблокирована. Попробуйте еще раз через несколько секунд.'}), 503
-        else:
-            return jsonify({'error': f'Ошибка базы данных: {str(e)}'}), 500
+        return jsonify({'error': f'Ошибка базы данных: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'error': f'Неожиданная ошибка: {str(e)}'}), 500
 
@@ -343,11 +518,10 @@ def delete_data_type(data_type_id):
         })
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
+    except SchemaLockTimeoutError as e:
+        return schema_lock_timeout_response(e)
     except sqlite3.OperationalError as e:
-        if "database is locked" in str(e):
-            return jsonify({'error': 'База данных временно заблокирована. Попробуйте еще раз через несколько секунд.'}), 503
-        else:
-            return jsonify({'error': f'Ошибка базы данных: {str(e)}'}), 500
+        return jsonify({'error': f'Ошибка базы данных: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'error': f'Неожиданная ошибка: {str(e)}'}), 500
 
@@ -369,9 +543,51 @@ def get_data(data_type_id):
     
     limit = request.args.get('limit', 0, type=int)
     offset = request.args.get('offset', 0, type=int)
-
-    records = db.get_data_records(data_type_id, limit, offset)
-    return jsonify(records)
+    # ?format=columnar - имена колонок один раз и массив значений на колонку
+    response_format = request.args.get('format', 'records')
+    if response_format not in ('records', 'columnar'):
+        return jsonify({'error': 'Допустимые форматы: records, columnar'}), 400
+    columnar = response_format == 'columnar'
+
+    # Версия данных (ETag) и записи читаются из одного снимка базы
+    with db.read_snapshot():
+        return _data_records_response(data_type_id, limit, offset, columnar)
+
+
+def _data_records_response(data_type_id, limit, offset, columnar):
+    # Неизменившийся список отдается ответом 304 без чтения записей
+    validators = data_version_validators(data_type_id, negotiate_records_mimetype(request.accept_mimetypes))
+    cached = not_modified_response(*validators)
+    if cached:
+        return cached
+
+    if any(key in request.args for key in ('filter', 'q', 'sort', 'with_total')):
+        # Фильтрация, поиск и сортировка на стороне сервера: в ответе только нужная страница
+        try:
+            result = db.query_data_records(
+                data_type_id,
+                filters=parse_filter_param(request.args.get('filter')),
+                search=request.args.get('q'),
+                sort=request.args.get('sort'),
+                limit=limit,
+                offset=offset,
+                columnar=columnar
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return set_version_headers(records_response(result), *validators)
+
+    if 'after' in request.args:
+        # Постраничная выдача по курсору: ?after=<created_at,id>, пустое значение - первая страница
+        try:
+            page = db.get_data_records_page(data_type_id, limit or 100, request.args.get('after') or None,
+                                            columnar=columnar)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return set_version_headers(records_response(page), *validators)
+
+    records = db.get_data_records(data_type_id, limit, offset, columnar=columnar)
+    return set_version_headers(records_response(records), *validators)
 
 
 
@@ -432,6 +648,108 @@ def insert_data(data_type_id):
 
 
 
+@app.route('/api/data/<int:data_type_id>/bulk', methods=['POST'])
+@login_required
+
+
+def bulk_insert_data(data_type_id):
+    """Пакетное добавление записей: JSON-массив или поток NDJSON.
+    
+    ?atomic=1 - все или ничего: при любой ошибке не добавляется ни одна запись.
+    """
+    
+    if not db.has_permission(session['user_id'], data_type_id, 'write'):
+        return jsonify({'error': 'Недостаточно прав для добавления данных'}), 403
+
+    atomic = request.args.get('atomic', '0') in ('1', 'true')
+
+    if request.mimetype in NDJSON_MIMETYPES:
+        # Тело читается построчно, весь запрос в памяти не держится
+        records = iter_ndjson(iter_stream_lines(request.stream))
+    else:
+        records = request.get_json(silent=True)
+        if isinstance(records, dict):
+            records = records.get('records')
+        if not isinstance(records, list):
+            return jsonify({'error': 'Ожидается JSON-массив записей или NDJSON'}), 400
+
+    try:
+        report = db.bulk_insert_data_records(data_type_id, records, session['user_id'], atomic=atomic)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Ошибка пакетной вставки: {str(e)}'}), 500
+
+    if atomic and report['failed']:
+        return jsonify(report), 422
+    return jsonify(report)
+
+
+
+@app.route('/api/data-types/<int:data_type_id>/import-csv', methods=['POST'])
+@login_required
+
+
+def import_data_from_csv(data_type_id):
+    """Импорт записей из CSV.
+    
+    Файл передается телом запроса (text/csv) или полем file формы multipart.
+    Колонки сопоставляются с полями по заголовку; ?delimiter= задает разделитель
+    (по умолчанию определяется по заголовку), ?atomic=1 - все или ничего.
+    """
+    
+    if not db.has_permission(session['user_id'], data_type_id, 'write'):
+        return jsonify({'error': 'Недостаточно прав для добавления данных'}), 403
+
+    delimiter = request.args.get('delimiter') or None
+    if delimiter == 'tab':
+        delimiter = '\t'
+    if delimiter and delimiter not in CSV_DELIMITERS:
+        return jsonify({'error': 'Допустимые разделители: запятая, точка с запятой, tab'}), 400
+    atomic = request.args.get('atomic', '0') in ('1', 'true')
+
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'error': 'Файл не передан'}), 400
+        stream = upload.stream
+    else:
+        # Тело читается по мере разбора, без буферизации всего файла
+        stream = request.stream
+
+    schema = db.schema.get(data_type_id)
+    if not schema:
+        return jsonify({'error': 'Тип данных не найден'}), 404
+
+    started = time.perf_counter()
+    try:
+        reader = CsvRecordReader(open_text_stream(stream), schema['fields'], delimiter)
+        report = db.bulk_insert_data_records(data_type_id, reader, session['user_id'], atomic=atomic)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Ошибка импорта CSV: {str(e)}'}), 500
+    elapsed = time.perf_counter() - started
+
+    for error in report['errors']:
+        # Номер строки данных в файле (1 - первая строка после заголовка)
+        error['row'] = error['index'] + 1
+    report.update({
+        'columns': reader.mapped_fields,
+        'ignored_columns': reader.ignored_columns,
+        'delimiter': reader.delimiter,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(report['received'] / elapsed) if elapsed > 0 else None
+    })
+    print(f"Импорт CSV в data_{data_type_id}: {report['inserted']} из {report['received']} строк, "
+          f"{elapsed:.2f} с, {report['rows_per_second']} строк/с")
+
+    if atomic and report['failed']:
+        return jsonify(report), 422
+    return jsonify(report)
+
+
+
 @app.route('/api/data/<int:data_type_id>/<int:record_id>', methods=['GET'])
 @login_required
 
@@ -542,8 +860,154 @@ def get_data_statistics(data_type_id):
     if not db.has_permission(session['user_id'], data_type_id, 'read'):
         return jsonify({'error': 'Недостаточно прав для просмотра статистики'}), 403
 
-    stats = db.get_data_statistics(data_type_id)
-    return jsonify(stats)
+    try:
+        percentiles = parse_percentiles(request.args.get('percentiles'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    exact = request.args.get('exact', '').lower() in ('1', 'true')
+    # Версия данных (ETag) и статистика читаются из одного снимка базы
+    with db.read_snapshot():
+        validators = data_version_validators(data_type_id)
+        cached = not_modified_response(*validators)
+        if cached:
+            return cached
+        stats = db.get_data_statistics(data_type_id, percentiles, exact=exact)
+    return set_version_headers(jsonify(stats), *validators)
+
+
+
+@app.route('/api/data/<int:data_type_id>/within', methods=['GET'])
+@login_required
+
+
+def get_data_within(data_type_id):
+    """Записи с координатами в области карты (?bbox=) или в круге (?lat=&lng=&radius=)."""
+
+    if not db.has_permission(session['user_id'], data_type_id, 'read'):
+        return jsonify({'error': 'Недостаточно прав для просмотра данных'}), 403
+
+    field_name = request.args.get('field')
+    if not field_name:
+        return jsonify({'error': 'Не указано поле координат (?field=)'}), 400
+    limit = request.args.get('limit', DEFAULT_WITHIN_LIMIT, type=int)
+    if not 0 < limit <= MAX_WITHIN_LIMIT:
+        return jsonify({'error': f'limit должен быть от 1 до {MAX_WITHIN_LIMIT}'}), 400
+
+    try:
+        filters = parse_filter_param(request.args.get('filter'))
+        if 'radius' in request.args:
+            lat = request.args.get('lat', type=float)
+            lng = request.args.get('lng', type=float)
+            radius = request.args.get('radius', type=float)
+            if lat is None or lng is None or radius is None:
+                raise ValueError('Для поиска в радиусе нужны числовые lat, lng и radius (в метрах)')
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise ValueError('Центр круга вне допустимых координат')
+            if radius <= 0:
+                raise ValueError('radius должен быть больше 0')
+            result = db.query_records_within(data_type_id, field_name, center=(lat, lng), radius=radius,
+                                             filters=filters, limit=limit)
+        else:
+            result = db.query_records_within(data_type_id, field_name, bbox=parse_bbox(request.args.get('bbox')),
+                                             filters=filters, limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+
+
+
+@app.route('/api/data/<int:data_type_id>/clusters', methods=['GET'])
+@login_required
+
+
+def get_data_clusters(data_type_id):
+    """Кластеры точек поля координат для карты: ?field=&zoom=&bbox=&aggregate=поле1,поле2."""
+
+    if not db.has_permission(session['user_id'], data_type_id, 'read'):
+        return jsonify({'error': 'Недостаточно прав для просмотра данных'}), 403
+
+    field_name = request.args.get('field')
+    if not field_name:
+        return jsonify({'error': 'Не указано поле координат (?field=)'}), 400
+    zoom = request.args.get('zoom', type=int)
+    if zoom is None:
+        return jsonify({'error': 'Не указан уровень масштаба (?zoom=)'}), 400
+    aggregate = [name.strip() for name in request.args.get('aggregate', '').split(',') if name.strip()]
+
+    try:
+        bbox = parse_bbox(request.args['bbox']) if request.args.get('bbox') else None
+        result = db.cluster_coordinates(
+            data_type_id, field_name, zoom, bbox=bbox, aggregate_fields=aggregate,
+            filters=parse_filter_param(request.args.get('filter'))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+
+
+
+@app.route('/api/data/<int:data_type_id>/changes', methods=['GET'])
+@login_required
+
+
+def get_data_changes(data_type_id):
+    """Изменения записей после номера ?since= для инкрементальной синхронизации."""
+
+    if not db.has_permission(session['user_id'], data_type_id, 'read'):
+        return jsonify({'error': 'Недостаточно прав для просмотра данных'}), 403
+
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', DEFAULT_CHANGES_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'since и limit должны быть целыми числами'}), 400
+    if since < 0:
+        return jsonify({'error': 'since не может быть отрицательным'}), 400
+    if not 0 < limit <= MAX_CHANGES_LIMIT:
+        return jsonify({'error': f'limit должен быть от 1 до {MAX_CHANGES_LIMIT}'}), 400
+
+    try:
+        result = db.get_data_changes(data_type_id, since, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify(result)
+
+
+
+
+@app.route('/api/data/<int:data_type_id>/events', methods=['GET'])
+@login_required
+
+
+def get_data_events(data_type_id):
+    """Поток Server-Sent Events об изменениях записей и статистики справочника."""
+
+    user_id = session['user_id']
+    if not db.has_permission(user_id, data_type_id, 'read'):
+        return jsonify({'error': 'Недостаточно прав для просмотра данных'}), 403
+    if not db.get_data_type(data_type_id):
+        return jsonify({'error': 'Тип данных не найден'}), 404
+
+    try:
+        stream = change_events.open(data_type_id, user_id)
+    except TooManyStreamsError as e:
+        response = jsonify({'error': str(e)})
+        response.status_code = 429
+        response.headers['Retry-After'] = '30'
+        return response
+
+    events = change_events.stream(stream, lambda: db.has_permission(user_id, data_type_id, 'read'))
+    response = Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Прокси (nginx) не должен буферизовать поток событий
+        'X-Accel-Buffering': 'no'
+    })
+    # Клиент может отключиться до начала отдачи: поток все равно снимается с учета
+    response.call_on_close(lambda: change_events.close(stream))
+    return response
 
 
 
@@ -554,7 +1018,7 @@ def get_data_statistics(data_type_id):
 
 def get_users():
     """Получение списка пользователей."""
-    with sqlite3.connect(db.db_path) as conn:
+    with db.get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT id, username, full_name, role, created_at, is_active
@@ -593,7 +1057,7 @@ def create_user():
         return jsonify({'error': 'Недопустимая роль'}), 400
 
     try:
-        with sqlite3.connect(db.db_path) as conn:
+        with db.get_connection() as conn:
             cursor = conn.cursor()
             password_hash = db.hash_password(password)
             current_time = db.get_current_timestamp()
@@ -647,7 +1111,7 @@ def update_user(user_id):
     full_name = data.get('full_name', '')
 
     try:
-        with sqlite3.connect(db.db_path) as conn:
+        with db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 UPDATE users
@@ -658,7 +1122,10 @@ def update_user(user_id):
             if cursor.rowcount == 0:
                 return jsonify({'error': 'Пользователь не найден'}), 404
 
+            # ФИО автора выводится в записях всех справочников
+            db.versions.bump_all_with_cursor(cursor)
             conn.commit()
+            db.invalidate_user_authorization(user_id)
             return jsonify({
             'message': 'Пользователь обновлен'
         })
@@ -674,7 +1141,7 @@ def update_user(user_id):
 def delete_user(user_id):
     """Удаление пользователя."""
     try:
-        with sqlite3.connect(db.db_path) as conn:
+        with db.get_connection() as conn:
             cursor = conn.cursor()
 
             
@@ -688,8 +1155,16 @@ def delete_user(user_id):
                 return jsonify({'error': 'Нельзя удалить собственный аккаунт'}), 400
 
             
-            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            conn.commit()
+            # Записи пользователя в справочниках остаются (как и раньше), поэтому
+            # проверку внешних ключей на время удаления отключаем
+            conn.execute("PRAGMA foreign_keys=OFF")
+            try:
+                cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+                db.versions.bump_all_with_cursor(cursor)
+                conn.commit()
+            finally:
+                conn.execute("PRAGMA foreign_keys=ON")
+            db.invalidate_user_authorization(user_id)
 
             return jsonify({
             'message': 'Пользователь удален'
@@ -714,7 +1189,7 @@ def reset_user_password(user_id):
             string.ascii_letters + string.digits, k=8
         ))
 
-        with sqlite3.connect(db.db_path) as conn:
+        with db.get_connection() as conn:
             cursor = conn.cursor()
             password_hash = db.hash_password(new_password)
             cursor.execute('''
@@ -797,7 +1272,7 @@ def revoke_permission(user_id, data_type_id):
 
 
 def export_data_to_csv(data_type_id):
-    """Экспорт данных в CSV формат."""
+    """Экспорт данных в CSV формат (потоковая выгрузка пачками)."""
     
     if not db.has_permission(session['user_id'], data_type_id, 'read'):
         return jsonify({'error': 'Недостаточно прав для экспорта данных'}), 403
@@ -823,85 +1298,20 @@ def export_data_to_csv(data_type_id):
         if not all_fields:
             return jsonify({'error': 'У типа данных нет полей'}), 400
 
-        
-        if selected_fields and len(selected_fields) > 0:
-            
-            selected_fields_set = set(selected_fields)
-            fields = [f for f in all_fields if f['field_name'] in selected_fields_set]
-            
-            field_order = {name: idx for idx, name in enumerate(selected_fields)}
-            fields.sort(key=lambda f: field_order.get(f['field_name'], 999))
-        else:
-            fields = all_fields
-
-        
-        records = db.get_data_records(data_type_id, limit=limit, offset=0)
-
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        if include_headers:
-            if include_descriptions:
-                
-                headers = []
-                for field in fields:
-                    headers.append(f"{field['field_name']} ({field['description']})")
-                writer.writerow(headers)
-            else:
-                
-                headers = [field['field_name'] for field in fields]
-                writer.writerow(headers)
-
-        
-        for record in records:
-            row = []
-            for field in fields:
-                value = record.get(field['field_name'], '')
-                
-                if value is None:
-                    row.append('')
-                elif field['field_type'] == 'boolean':
-                    row.append('Да' if value else 'Нет')
-                elif field['field_type'] == 'coordinates':
-                    
-                    if isinstance(value, dict):
-                        lat = value.get('latitude', '—')
-                        lng = value.get('longitude', '—')
-                        row.append(f"({lat}, {lng})")
-                    elif isinstance(value, str):
-                        try:
-                            import json
-                            coords = json.loads(value)
-                            lat = coords.get('latitude', '—')
-                            lng = coords.get('longitude', '—')
-                            row.append(f"({lat}, {lng})")
-                        except Exception:
-                            row.append(str(value))
-                    else:
-                        row.append(str(value))
-                elif field['field_type'] in ['integer', 'decimal']:
-                    row.append(str(value))
-                else:
-                    row.append(str(value))
-            writer.writerow(row)
-
-        
-        output.seek(0)
-        csv_data = output.getvalue()
-        output.close()
+        fields = select_export_fields(all_fields, selected_fields)
 
-        
-        csv_data = '\ufeff' + csv_data
+        # Строки читаются из базы по мере отправки ответа клиенту
+        batches = db.iter_data_rows(
+            data_type_id, [field['field_name'] for field in fields],
+            limit=limit, batch_size=EXPORT_BATCH_SIZE
+        )
+        chunks = iter_csv(batches, fields, include_headers, include_descriptions)
 
-        
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        safe_name = data_type['name'].replace(' ', '_').replace('(', '').replace(')', '').replace(',', '').replace(' ', '_')
-        filename = f"{safe_name}_{timestamp}.csv"
+        filename = export_filename(data_type['name'], 'csv')
 
         return Response(
-            csv_data,
-            mimetype='text/csv',
+            chunks,
+            mimetype=CSV_MIMETYPE,
             headers={
                 'Content-Disposition': f'attachment; filename="{filename}"',
                 'Content-Type': 'text/csv; charset=utf-8'
@@ -918,10 +1328,11 @@ def export_data_to_csv(data_type_id):
 
 
 def export_data_to_excel(data_type_id):
-    """Экспорт данных в Excel формат."""
+    """Экспорт данных в Excel формат (write-only книга во временном файле)."""
     if not db.has_permission(session['user_id'], data_type_id, 'read'):
         return jsonify({'error': 'Недостаточно прав для экспорта данных'}), 403
 
+    path = None
     try:
         data = request.get_json()
         limit = data.get('limit', 100)
@@ -940,112 +1351,153 @@ def export_data_to_excel(data_type_id):
         if not all_fields:
             return jsonify({'error': 'У типа данных нет полей'}), 400
 
-        
-        if selected_fields and len(selected_fields) > 0:
-            
-            selected_fields_set = set(selected_fields)
-            fields = [f for f in all_fields if f['field_name'] in selected_fields_set]
-            
-            field_order = {name: idx for idx, name in enumerate(selected_fields)}
-            fields.sort(key=lambda f: field_order.get(f['field_name'], 999))
-        else:
-            fields = all_fields
-
-        
-        
-        actual_limit = limit if limit > 0 else 10000
-        records = db.get_data_records(data_type_id, limit=actual_limit, offset=0)
-
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Данные"
-
-        
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
+        fields = select_export_fields(all_fields, selected_fields)
 
-        
-        if include_headers:
-            if include_descriptions:
-                headers = []
-                for field in fields:
-                    headers.append(f"{field['field_name']} ({field['description']})")
-            else:
-                headers = [field['field_name'] for field in fields]
+        # limit=0 - все записи; при превышении лимита строк Excel создаются новые листы
+        batches = db.iter_data_rows(
+            data_type_id, [field['field_name'] for field in fields],
+            limit=limit, batch_size=EXPORT_BATCH_SIZE
+        )
+        path = create_temp_export_file('.xlsx')
+        write_xlsx(path, batches, fields, include_headers, include_descriptions)
 
-            
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = header_alignment
-
-        for row_idx, record in enumerate(records, 2):
-            for col_idx, field in enumerate(fields, 1):
-                value = record.get(field['field_name'], '')
-
-                if value is None:
-                    cell_value = ''
-                elif field['field_type'] == 'boolean':
-                    cell_value = 'Да' if value else 'Нет'
-                elif field['field_type'] == 'coordinates':
-                    if isinstance(value, dict):
-                        lat = value.get('latitude', '—')
-                        lng = value.get('longitude', '—')
-                        cell_value = f"({lat}, {lng})"
-                    elif isinstance(value, str):
-                        try:
-                            import json
-                            coords = json.loads(value)
-                            lat = coords.get('latitude', '—')
-                            lng = coords.get('longitude', '—')
-                            cell_value = f"({lat}, {lng})"
-                        except Exception:
-                            cell_value = str(value)
-                    else:
-                        cell_value = str(value)
-                elif field['field_type'] in ['integer', 'decimal']:
-                    cell_value = value
-                else:
-                    cell_value = str(value)
-
-                ws.cell(row=row_idx, column=col_idx, value=cell_value)
-
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except Exception:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        excel_data = output.getvalue()
-        output.close()
-
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        safe_name = data_type['name'].replace(' ', '_').replace('(', '').replace(')', '').replace(',', '').replace(' ', '_')
-        filename = f"{safe_name}_{timestamp}.xlsx"
+        filename = export_filename(data_type['name'], 'xlsx')
 
-        return Response(
-            excel_data,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        response = Response(
+            iter_file(path),
+            mimetype=XLSX_MIMETYPE,
             headers={
                 'Content-Disposition': f'attachment; filename="{filename}"',
-                'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                'Content-Type': XLSX_MIMETYPE,
+                'Content-Length': str(os.path.getsize(path))
             }
         )
+        path = None  # файл удалит генератор ответа
+        return response
 
     except Exception as e:
         return jsonify({'error': f'Ошибка экспорта Excel: {str(e)}'}), 500
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+
+@app.route('/api/data-types/<int:data_type_id>/export-jobs', methods=['POST'])
+@login_required
+
+
+def create_export_job(data_type_id):
+    """Постановка фонового экспорта (CSV или Excel) в очередь."""
+    if not db.has_permission(session['user_id'], data_type_id, 'read'):
+        return jsonify({'error': 'Недостаточно прав для экспорта данных'}), 403
+
+    try:
+        data = request.get_json() or {}
+        export_format = data.get('format', 'xlsx')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Неподдерживаемый формат экспорта: {export_format}'}), 400
+
+        try:
+            limit = int(data.get('limit', 0) or 0)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Некорректный лимит записей'}), 400
+
+        data_type = db.get_data_type(data_type_id)
+        if not data_type:
+            return jsonify({'error': 'Тип данных не найден'}), 404
+
+        all_fields = db.get_data_fields(data_type_id)
+        if not all_fields:
+            return jsonify({'error': 'У типа данных нет полей'}), 400
+
+        fields = select_export_fields(all_fields, data.get('selected_fields'))
+
+        job = export_jobs.submit(
+            session['user_id'], data_type, fields, export_format,
+            limit=limit,
+            include_headers=data.get('include_headers', True),
+            include_descriptions=data.get('include_descriptions', False)
+        )
+        return jsonify(job), 202
+
+    except ExportQueueFullError as e:
+        return jsonify({'error': str(e)}), 429
+    except ExportJobError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': f'Ошибка постановки экспорта: {str(e)}'}), 500
+
+
+
+def _get_own_export_job(job_id):
+    """Задание экспорта текущего пользователя (администратор видит все задания)."""
+    job = export_jobs.get(job_id)
+    if job and (job['user_id'] == session['user_id'] or db.is_admin(session['user_id'])):
+        return job
+    return None
+
+
+
+@app.route('/api/export-jobs', methods=['GET'])
+@login_required
+
+
+def list_export_jobs():
+    """Список заданий экспорта текущего пользователя (?all=1 - все, для администратора)."""
+    show_all = request.args.get('all') == '1' and db.is_admin(session['user_id'])
+    return jsonify(export_jobs.list_jobs(None if show_all else session['user_id']))
+
+
+
+@app.route('/api/export-jobs/<job_id>', methods=['GET'])
+@login_required
+
+
+def get_export_job(job_id):
+    """Статус и прогресс задания экспорта."""
+    job = _get_own_export_job(job_id)
+    if not job:
+        return jsonify({'error': 'Задание экспорта не найдено'}), 404
+    return jsonify(job)
+
+
+
+@app.route('/api/export-jobs/<job_id>', methods=['DELETE'])
+@login_required
+
+
+def cancel_export_job(job_id):
+    """Отмена выполняющегося задания или удаление готового файла."""
+    if not _get_own_export_job(job_id):
+        return jsonify({'error': 'Задание экспорта не найдено'}), 404
+    job = export_jobs.cancel(job_id)
+    if not job:
+        return jsonify({'error': 'Задание экспорта не найдено'}), 404
+    return jsonify(job)
+
+
+
+@app.route('/api/export-jobs/<job_id>/download', methods=['GET'])
+@login_required
+
+
+def download_export_job(job_id):
+    """Скачивание готового файла экспорта."""
+    job = _get_own_export_job(job_id)
+    if not job:
+        return jsonify({'error': 'Задание экспорта не найдено'}), 404
+    artifact = export_jobs.get_artifact(job_id)
+    if not artifact:
+        if job['status'] in ('queued', 'running'):
+            return jsonify({'error': 'Экспорт еще выполняется'}), 409
+        return jsonify({'error': 'Файл экспорта недоступен'}), 410
+    return send_file(
+        artifact['path'],
+        mimetype=artifact['mimetype'],
+        as_attachment=True,
+        download_name=artifact['file_name']
+    )
 
 
 
@@ -1096,6 +1548,44 @@ def setup_admin():
 
 
 
+def server_stats():
+    """Служебная статистика сервера по разделам (пулы соединений, очереди, кэши)."""
+    return {
+        'pool': db.get_pool_stats(),
+        'read_pool': db.get_read_pool_stats(),
+        'schema_changes': db.schema_changes.stats(),
+        'summary_refresh': db.summary_refresher.stats(),
+        'group_commit': db.writer.stats() if db.writer else None,
+        'schema_catalog': db.schema.stats(),
+        'permission_cache': db.permissions.stats(),
+        'geo_clusters': db.geo_clusters.stats(),
+        'export_jobs': export_jobs.stats(),
+        'compression': compressor.stats() if compressor else None,
+        'change_events': change_events.stats()
+    }
+
+
+@app.route('/api/admin/stats', methods=['GET'])
+@admin_required
+
+
+def get_admin_stats():
+    """Служебная статистика сервера (пул соединений, кэши)."""
+    return jsonify(server_stats())
+
+
+@app.route('/api/admin/metrics', methods=['GET'])
+@admin_required
+
+
+def get_admin_metrics():
+    """Метрики запросов, базы, пулов и кэшей в текстовом формате Prometheus."""
+    if metrics is None:
+        return jsonify({'error': 'Метрики отключены (DATAVUE_METRICS=0)'}), 404
+    return Response(metrics.render(server_stats()), content_type=METRICS_CONTENT_TYPE)
+
+
+
 @app.route('/api/admin/check-setup', methods=['GET'])
 
 
@@ -0,0 +1,255 @@
+"""Хранение координат в числовых колонках и пространственный индекс R*Tree."""
+
+import json
+import math
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple
+
+# Поле координат <name> хранится в двух колонках REAL: <name>__lat и <name>__lng
+LATITUDE_SUFFIX = '__lat'
+LONGITUDE_SUFFIX = '__lng'
+
+# Средний радиус Земли в метрах (для расстояний по формуле гаверсинусов)
+EARTH_RADIUS_METERS = 6371008.8
+
+# Сколько точек по умолчанию и максимум отдает запрос по области
+DEFAULT_WITHIN_LIMIT = 1000
+MAX_WITHIN_LIMIT = 10000
+
+
+def coordinate_columns(field_name: str) -> Tuple[str, str]:
+    """Имена колонок широты и долготы поля координат."""
+    return f"{field_name}{LATITUDE_SUFFIX}", f"{field_name}{LONGITUDE_SUFFIX}"
+
+
+def storage_columns(fields: Sequence[Dict[str, Any]],
+                    sql_type: Callable[[str], str]) -> List[Tuple[str, str]]:
+    """Колонки таблицы данных для полей справочника: координаты - парой REAL."""
+    columns = []
+    for field in fields:
+        if field['field_type'] == 'coordinates':
+            columns += [(name, 'REAL') for name in coordinate_columns(field['field_name'])]
+        else:
+            columns.append((field['field_name'], sql_type(field['field_type'])))
+    return columns
+
+
+def split_coordinates(value: Any) -> Tuple[Optional[float], Optional[float]]:
+    """Пара (широта, долгота) из объекта, JSON-строки или пары чисел."""
+    if value is None:
+        return None, None
+    if isinstance(value, str):
+        if not value.strip():
+            return None, None
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise ValueError("Неверный формат координат")
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        lat, lng = value
+    elif isinstance(value, dict):
+        lat, lng = value.get('latitude'), value.get('longitude')
+    else:
+        raise ValueError("Неверный формат координат")
+    try:
+        return (None if lat is None else float(lat)), (None if lng is None else float(lng))
+    except (TypeError, ValueError):
+        raise ValueError("Неверный формат координат")
+
+
+def join_coordinates(lat: Optional[float], lng: Optional[float]) -> Optional[Dict[str, Optional[float]]]:
+    """Объект {"latitude", "longitude"} для API (None, если координат нет)."""
+    if lat is None and lng is None:
+        return None
+    return {'latitude': lat, 'longitude': lng}
+
+
+def coordinates_text_sql(field_name: str, alias: str = '') -> str:
+    """Выражение SQL с координатами в виде "(широта, долгота)" для выгрузок."""
+    lat, lng = (f"{alias}{column}" for column in coordinate_columns(field_name))
+    return (f"CASE WHEN {lat} IS NULL AND {lng} IS NULL THEN NULL "
+            f"ELSE '(' || COALESCE({lat}, '—') || ', ' || COALESCE({lng}, '—') || ')' END")
+
+
+def rtree_table(table_name: str, field_name: str) -> str:
+    """Имя таблицы R*Tree поля координат."""
+    return f"{table_name}_{field_name}_rtree"
+
+
+def _list_rtree_fields_with_cursor(cursor, table_name: str) -> List[str]:
+    """Поля, для которых у таблицы данных есть индекс R*Tree."""
+    prefix, suffix = f"{table_name}_", '_rtree'
+    cursor.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%USING rtree%'
+    ''')
+    return [
+        name[len(prefix):-len(suffix)] for (name,) in cursor.fetchall()
+        if name.startswith(prefix) and name.endswith(suffix) and len(name) > len(prefix) + len(suffix)
+    ]
+
+
+def create_spatial_index_with_cursor(cursor, table_name: str, field_name: str) -> bool:
+    """Создание R*Tree поля координат и триггеров, поддерживающих его актуальность.
+
+    В индекс попадают только записи с обеими координатами. R*Tree хранит
+    границы в float32, поэтому он служит для отбора кандидатов, а точная
+    проверка выполняется по колонкам таблицы. Возвращает True, если индекс
+    создан (и заполнен существующими записями).
+    """
+    rtree = rtree_table(table_name, field_name)
+    lat, lng = coordinate_columns(field_name)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (rtree,))
+    created = cursor.fetchone() is None
+    if created:
+        cursor.execute(f"CREATE VIRTUAL TABLE {rtree} USING rtree(id, min_lat, max_lat, min_lng, max_lng)")
+        cursor.execute(f'''
+            INSERT INTO {rtree} (id, min_lat, max_lat, min_lng, max_lng)
+            SELECT id, {lat}, {lat}, {lng}, {lng} FROM {table_name}
+            WHERE {lat} IS NOT NULL AND {lng} IS NOT NULL
+        ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {rtree}_insert AFTER INSERT ON {table_name}
+        WHEN new.{lat} IS NOT NULL AND new.{lng} IS NOT NULL
+        BEGIN
+            INSERT INTO {rtree} (id, min_lat, max_lat, min_lng, max_lng)
+            VALUES (new.id, new.{lat}, new.{lat}, new.{lng}, new.{lng});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {rtree}_update AFTER UPDATE OF {lat}, {lng} ON {table_name}
+        BEGIN
+            DELETE FROM {rtree} WHERE id = old.id;
+            INSERT INTO {rtree} (id, min_lat, max_lat, min_lng, max_lng)
+            SELECT new.id, new.{lat}, new.{lat}, new.{lng}, new.{lng}
+            WHERE new.{lat} IS NOT NULL AND new.{lng} IS NOT NULL;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {rtree}_delete AFTER DELETE ON {table_name}
+        BEGIN
+            DELETE FROM {rtree} WHERE id = old.id;
+        END
+    ''')
+    return created
+
+
+def drop_spatial_index_with_cursor(cursor, table_name: str, field_name: str):
+    """Удаление R*Tree поля координат вместе с триггерами."""
+    rtree = rtree_table(table_name, field_name)
+    for trigger in ('insert', 'update', 'delete'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {rtree}_{trigger}")
+    cursor.execute(f"DROP TABLE IF EXISTS {rtree}")
+
+
+def drop_stale_spatial_indexes_with_cursor(cursor, table_name: str,
+                                           fields: Sequence[Dict[str, Any]] = ()) -> List[str]:
+    """Удаление индексов R*Tree полей, которых больше нет среди полей координат.
+
+    Вызывается до изменения таблицы: DROP COLUMN невозможен, пока колонку
+    используют триггеры. Без fields удаляются все индексы таблицы.
+    """
+    wanted = {field['field_name'] for field in fields if field['field_type'] == 'coordinates'}
+    stale = [name for name in _list_rtree_fields_with_cursor(cursor, table_name) if name not in wanted]
+    for field_name in stale:
+        drop_spatial_index_with_cursor(cursor, table_name, field_name)
+    return stale
+
+
+def migrate_legacy_coordinates_with_cursor(cursor, table_name: str,
+                                           fields: Sequence[Dict[str, Any]]) -> List[str]:
+    """Перенос координат из старого формата (JSON-строка в одной колонке) в пару REAL.
+
+    Новые колонки заполняются средствами SQLite (json_extract); старая колонка
+    после этого удаляется обычной миграцией таблицы как лишняя.
+    """
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    existing = {row[1] for row in cursor.fetchall()}
+    migrated = []
+    for field in fields:
+        name = field['field_name']
+        if field['field_type'] != 'coordinates' or name not in existing:
+            continue
+        lat, lng = coordinate_columns(name)
+        for column in (lat, lng):
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} REAL")
+        cursor.execute(f'''
+            UPDATE {table_name}
+            SET {lat} = CAST(json_extract({name}, '$.latitude') AS REAL),
+                {lng} = CAST(json_extract({name}, '$.longitude') AS REAL)
+            WHERE json_valid({name})
+        ''')
+        migrated.append(name)
+    return migrated
+
+
+def needs_coordinate_migration_with_cursor(cursor, table_name: str,
+                                           fields: Sequence[Dict[str, Any]]) -> bool:
+    """Есть ли у таблицы поля координат в старом формате или без колонок REAL."""
+    names = [field['field_name'] for field in fields if field['field_type'] == 'coordinates']
+    if not names:
+        return False
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    existing = {row[1] for row in cursor.fetchall()}
+    return any(name in existing or coordinate_columns(name)[0] not in existing for name in names)
+
+
+def parse_bbox(value: str) -> Tuple[float, float, float, float]:
+    """Разбор bbox=<запад>,<юг>,<восток>,<север> (долгота, широта, как в GeoJSON).
+
+    Возвращает (min_lat, min_lng, max_lat, max_lng). Запад больше востока
+    означает область, пересекающую 180-й меридиан.
+    """
+    parts = value.split(',') if value else []
+    if len(parts) != 4:
+        raise ValueError("bbox должен иметь вид <мин. долгота>,<мин. широта>,<макс. долгота>,<макс. широта>")
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(part) for part in parts)
+    except ValueError:
+        raise ValueError("Координаты bbox должны быть числами")
+    if not (-90 <= min_lat <= 90 and -90 <= max_lat <= 90):
+        raise ValueError("Широта bbox должна быть от -90 до 90 градусов")
+    if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+        raise ValueError("Долгота bbox должна быть от -180 до 180 градусов")
+    if min_lat > max_lat:
+        raise ValueError("Минимальная широта bbox больше максимальной")
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def longitude_ranges(min_lng: float, max_lng: float) -> List[Tuple[float, float]]:
+    """Диапазоны долготы области; через 180-й меридиан - два диапазона."""
+    if min_lng <= max_lng:
+        return [(min_lng, max_lng)]
+    return [(min_lng, 180.0), (-180.0, max_lng)]
+
+
+def radius_bbox(lat: float, lng: float, radius: float) -> Tuple[float, float, float, float]:
+    """Область (min_lat, min_lng, max_lat, max_lng), содержащая круг радиуса radius метров."""
+    delta_lat = math.degrees(radius / EARTH_RADIUS_METERS)
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        # Круг накрывает полюс - подходят все долготы
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+    delta_lng = math.degrees(radius / (EARTH_RADIUS_METERS * math.cos(math.radians(lat))))
+    if delta_lng >= 180:
+        return min_lat, -180.0, max_lat, 180.0
+    min_lng, max_lng = lng - delta_lng, lng + delta_lng
+    # Выход за ±180 переносим на другую сторону (область через меридиан)
+    if min_lng < -180:
+        min_lng += 360
+    if max_lng > 180:
+        max_lng -= 360
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def haversine_distance(lat1: Optional[float], lng1: Optional[float],
+                       lat2: Optional[float], lng2: Optional[float]) -> Optional[float]:
+    """Расстояние между точками по большому кругу в метрах."""
+    if lat1 is None or lng1 is None or lat2 is None or lng2 is None:
+        return None
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,192 @@
+"""Расчет статистики по таблице данных за один проход."""
+
+import math
+from array import array
+from collections import Counter
+from typing import Dict, Any, Iterable, List, Optional, Sequence
+
+NUMERIC_TYPES = ('integer', 'decimal')
+
+# Типы полей, для которых считается распределение значений
+CATEGORY_TYPES = ('text', 'enum', 'boolean', 'date')
+
+DEFAULT_PERCENTILES = (25, 50, 75)
+
+# Сколько самых частых значений возвращать для текстовых полей
+MAX_CATEGORY_VALUES = 50
+
+FETCH_SIZE = 5000
+
+
+def parse_percentiles(value: Optional[str]) -> Sequence[float]:
+    """Разбор параметра ?percentiles=5,50,95."""
+    if not value:
+        return DEFAULT_PERCENTILES
+    result = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            percentile = float(item)
+        except ValueError:
+            raise ValueError(f"Недопустимый перцентиль: {item}")
+        if not 0 <= percentile <= 100:
+            raise ValueError(f"Перцентиль должен быть от 0 до 100: {item}")
+        result.append(percentile)
+    return tuple(sorted(set(result)))
+
+
+def percentile_key(percentile: float) -> str:
+    """Ключ перцентиля в ответе: 25 -> 'p25', 99.9 -> 'p99.9'."""
+    return f"p{percentile:g}"
+
+
+def quantile(sorted_values: Sequence[float], percentile: float) -> Optional[float]:
+    """Перцентиль с линейной интерполяцией между соседними значениями."""
+    n = len(sorted_values)
+    if n == 0:
+        return None
+    position = (n - 1) * percentile / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, n - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+class NumericAccumulator:
+    """Накопление значений числового поля.
+
+    Значения хранятся компактно в array('d'); после прохода по таблице они
+    сортируются один раз, и из них считаются все показатели, включая точные
+    медиану и перцентили.
+    """
+
+    def __init__(self, field_type: str):
+        self.field_type = field_type
+        self.values = array('d')
+        self.null_count = 0
+
+    def add_column(self, column: Iterable[Any]):
+        """Добавление значений колонки из очередной порции строк."""
+        present = [value for value in column if value is not None]
+        self.null_count += len(column) - len(present)
+        size = len(self.values)
+        try:
+            self.values.extend(present)
+        except TypeError:
+            # Нечисловые значения (например, строки после ручного импорта).
+            # extend успевает добавить значения до первого нечислового - убираем их
+            del self.values[size:]
+            for value in present:
+                try:
+                    self.values.append(float(value))
+                except (TypeError, ValueError):
+                    self.null_count += 1
+
+    def result(self, percentiles: Sequence[float]) -> Dict[str, Any]:
+        count = len(self.values)
+        stats = {
+            'type': self.field_type,
+            'count': count,
+            'null_count': self.null_count,
+            'sum': None,
+            'mean': None,
+            'min': None,
+            'max': None,
+            'variance': None,
+            'stddev': None,
+            'median': None,
+            'percentiles': {percentile_key(p): None for p in percentiles}
+        }
+        if not count:
+            return stats
+
+        ordered = sorted(self.values)
+        total = math.fsum(ordered)
+        mean = total / count
+        # Выборочная дисперсия, вторым проходом по значениям в памяти (устойчиво к большим числам)
+        variance = math.fsum((x - mean) ** 2 for x in ordered) / (count - 1) if count > 1 else 0.0
+
+        integer = self.field_type == 'integer'
+        stats.update({
+            'sum': int(total) if integer and total.is_integer() else total,
+            'mean': mean,
+            'min': int(ordered[0]) if integer and ordered[0].is_integer() else ordered[0],
+            'max': int(ordered[-1]) if integer and ordered[-1].is_integer() else ordered[-1],
+            'variance': variance,
+            'stddev': math.sqrt(variance),
+            'median': quantile(ordered, 50),
+            'percentiles': {percentile_key(p): quantile(ordered, p) for p in percentiles}
+        })
+        return stats
+
+
+class CategoryAccumulator:
+    """Подсчет частот значений текстовых, enum, логических полей и дат (по месяцам)."""
+
+    def __init__(self, field_type: str, max_values: int = MAX_CATEGORY_VALUES):
+        self.field_type = field_type
+        self.max_values = max_values
+        self.counts = Counter()
+        self.null_count = 0
+
+    def _key(self, value: Any) -> Any:
+        if self.field_type == 'boolean':
+            return bool(value)
+        if self.field_type == 'date':
+            return str(value)[:7]  # YYYY-MM
+        return value
+
+    def add_column(self, column: Iterable[Any]):
+        present = [value for value in column if value is not None and value != '']
+        self.null_count += len(column) - len(present)
+        if self.field_type in ('boolean', 'date'):
+            present = map(self._key, present)
+        self.counts.update(present)
+
+    def result(self, percentiles: Sequence[float]) -> Dict[str, Any]:
+        if self.field_type == 'date':
+            # Месяцы - в хронологическом порядке
+            items = sorted(self.counts.items())
+        elif self.field_type == 'boolean':
+            items = sorted(self.counts.items(), reverse=True)
+        else:
+            items = sorted(self.counts.items(), key=lambda item: (-item[1], str(item[0])))[:self.max_values]
+        return {
+            'type': self.field_type,
+            'count': sum(self.counts.values()),
+            'null_count': self.null_count,
+            'distinct': len(self.counts),
+            'values': [{'value': value, 'count': count} for value, count in items]
+        }
+
+
+def compute_statistics(cursor, table_name: str, fields: List[Dict[str, Any]],
+                       percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+                       fetch_size: int = FETCH_SIZE) -> Dict[str, Dict[str, Any]]:
+    """Статистика по всем полям таблицы одним SELECT.
+
+    Строки читаются порциями по fetch_size и раскладываются по колонкам,
+    поэтому таблица сканируется ровно один раз независимо от числа полей.
+    """
+    accumulators = {}
+    for field in fields:
+        if field['field_type'] in NUMERIC_TYPES:
+            accumulators[field['field_name']] = NumericAccumulator(field['field_type'])
+        elif field['field_type'] in CATEGORY_TYPES:
+            accumulators[field['field_name']] = CategoryAccumulator(field['field_type'])
+
+    if not accumulators:
+        return {}
+
+    names = list(accumulators)
+    cursor.execute(f"SELECT {', '.join(names)} FROM {table_name}")
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        for name, column in zip(names, zip(*rows)):
+            accumulators[name].add_column(column)
+
+    return {name: accumulators[name].result(percentiles) for name in names}
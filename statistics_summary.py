@@ -0,0 +1,615 @@
+"""Сводные таблицы статистики, обновляемые вместе с записями данных."""
+
+import math
+from typing import Dict, Any, Iterable, List, Optional, Sequence
+
+from quantile_sketch import QuantileSketch
+from statistics_engine import (
+    NUMERIC_TYPES, CATEGORY_TYPES, DEFAULT_PERCENTILES, MAX_CATEGORY_VALUES, FETCH_SIZE,
+    percentile_key
+)
+
+# После превышения этого числа различных значений частоты текстового поля
+# перестают вестись (до перестроения сводки): для уникальных текстов
+# распределение бесполезно, а сводка росла бы вместе с таблицей
+MAX_TRACKED_VALUES = 1000
+
+SKETCH_ACCURACY = 0.01
+
+# Виды корзин в field_statistics_bins
+SKETCH_BIN = 's'
+VALUE_BIN = 'v'
+
+# Младшие биты метки bounds_stale: какой из экстремумов устарел
+STALE_MIN = 1
+STALE_MAX = 2
+
+
+class FieldSummary:
+    """Агрегаты одного поля: счетчики, суммы, экстремумы, частоты значений и скетч квантилей.
+
+    Используется и как полная сводка (при чтении и перестроении), и как
+    дельта изменений пачки записей: при weight = -1 счетчики уменьшаются.
+    """
+
+    def __init__(self, field_name: str, field_type: str):
+        self.field_name = field_name
+        self.field_type = field_type
+        self.count = 0
+        self.null_count = 0
+        self.total = 0
+        self.total_sq = 0.0
+        self.min = None
+        self.max = None
+        # MIN/MAX оценены по скетчу, пока точные пересчитываются в фоне
+        self.bounds_approximate = False
+        self.value_counts: Optional[Dict[str, int]] = {} if field_type in CATEGORY_TYPES else None
+        self.sketch = QuantileSketch(SKETCH_ACCURACY) if field_type in NUMERIC_TYPES else None
+
+    @property
+    def numeric(self) -> bool:
+        return self.field_type in NUMERIC_TYPES
+
+    @staticmethod
+    def number(value: Any):
+        """Числовое значение ячейки или None (пусто или не число)."""
+        if value is None or isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return value
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _category(self, value: Any) -> Optional[str]:
+        if value is None or value == '':
+            return None
+        if self.field_type == 'boolean':
+            return '1' if value not in (0, '0', 'false', False) else '0'
+        if self.field_type == 'date':
+            return str(value)[:7]  # YYYY-MM
+        return str(value)
+
+    def add(self, value: Any, weight: int = 1):
+        """Учет значения (weight = -1 - при удалении записи)."""
+        if self.numeric:
+            number = self.number(value)
+            if number is None:
+                self.null_count += weight
+                return
+            self.count += weight
+            self.total += weight * number
+            self.total_sq += weight * float(number) * number
+            self.sketch.add(number, weight)
+            if weight > 0:
+                self.min = number if self.min is None else min(self.min, number)
+                self.max = number if self.max is None else max(self.max, number)
+            return
+
+        key = self._category(value)
+        if key is None:
+            self.null_count += weight
+            return
+        self.count += weight
+        if self.value_counts is not None:
+            count = self.value_counts.get(key, 0) + weight
+            if count:
+                self.value_counts[key] = count
+            else:
+                self.value_counts.pop(key, None)
+            if self.field_type == 'text' and len(self.value_counts) > MAX_TRACKED_VALUES:
+                self.value_counts = None
+
+    def bins(self) -> Dict[tuple, int]:
+        """Корзины скетча и частоты значений: {(вид, ключ): счетчик}."""
+        if self.sketch is not None:
+            return {(SKETCH_BIN, key): count for key, count in self.sketch.to_bins().items()}
+        if self.value_counts is not None:
+            return {(VALUE_BIN, key): count for key, count in self.value_counts.items()}
+        return {}
+
+    def result(self, percentiles: Sequence[float]) -> Dict[str, Any]:
+        """Статистика поля в формате ответа /statistics."""
+        if self.numeric:
+            return self._numeric_result(percentiles)
+
+        stats = {
+            'type': self.field_type,
+            'count': self.count,
+            'null_count': self.null_count,
+            'distinct': len(self.value_counts) if self.value_counts is not None else None,
+            'values': None
+        }
+        if self.value_counts is not None:
+            if self.field_type == 'boolean':
+                items = [(key == '1', count) for key, count in sorted(self.value_counts.items(), reverse=True)]
+            elif self.field_type == 'date':
+                items = sorted(self.value_counts.items())
+            else:
+                items = sorted(self.value_counts.items(), key=lambda item: (-item[1], item[0]))[:MAX_CATEGORY_VALUES]
+            stats['values'] = [{'value': value, 'count': count} for value, count in items]
+        return stats
+
+    def _numeric_result(self, percentiles: Sequence[float]) -> Dict[str, Any]:
+        count = self.count
+        stats = {
+            'type': self.field_type,
+            'count': count,
+            'null_count': self.null_count,
+            'sum': None,
+            'mean': None,
+            'min': None,
+            'max': None,
+            'variance': None,
+            'stddev': None,
+            'median': None,
+            'percentiles': {percentile_key(p): None for p in percentiles},
+            # Медиана и перцентили берутся из скетча (погрешность SKETCH_ACCURACY)
+            'approximate': True,
+            'bounds_approximate': self.bounds_approximate
+        }
+        if not count:
+            return stats
+
+        mean = self.total / count
+        variance = max((self.total_sq - self.total * mean) / (count - 1), 0.0) if count > 1 else 0.0
+
+        def estimate(percentile):
+            value = self.sketch.quantile(percentile / 100)
+            return min(max(value, self.min), self.max)
+
+        stats.update({
+            'sum': self.total,
+            'mean': mean,
+            'min': self.min,
+            'max': self.max,
+            'variance': variance,
+            'stddev': math.sqrt(variance),
+            'median': estimate(50),
+            'percentiles': {percentile_key(p): estimate(p) for p in percentiles}
+        })
+        return stats
+
+
+class StatisticsSummary:
+    """Сводная статистика справочников в таблицах field_statistics и field_statistics_bins.
+
+    field_statistics хранит по строке на поле (счетчики, суммы, экстремумы),
+    field_statistics_bins - корзины скетча квантилей числовых полей и частоты
+    значений остальных. Изменения записей применяются как дельты
+    (count = count + ?), поэтому стоимость обновления не зависит ни от размера
+    таблицы, ни от размера сводки.
+
+    Методы *_with_cursor выполняются в транзакции вызывающего кода, поэтому
+    сводка меняется атомарно вместе с записями. Пока для справочника нет
+    строк сводки по всем полям (старая база, запись внешним скриптом),
+    инкрементальное обновление пропускается; сводку строит фоновое
+    обновление (см. summary_refresh) проходом по снимку базы.
+
+    Экстремум, значение которого удалено, помечается устаревшим
+    (bounds_stale - случайная метка, в младших битах - STALE_MIN/STALE_MAX,
+    0 - оба экстремума точные), и с этого момента колонка хранит экстремум
+    только добавленных значений. Чтение в это время оценивает его по
+    крайним корзинам скетча, а точный пересчитывается в фоне без
+    блокировки записи.
+    """
+
+    CREATE_SQL = (
+        '''
+        CREATE TABLE IF NOT EXISTS field_statistics (
+            data_type_id INTEGER NOT NULL,
+            field_name TEXT NOT NULL,
+            field_type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            null_count INTEGER NOT NULL DEFAULT 0,
+            sum NUMERIC NOT NULL DEFAULT 0,
+            sum_sq REAL NOT NULL DEFAULT 0,
+            min NUMERIC,
+            max NUMERIC,
+            values_tracked BOOLEAN NOT NULL DEFAULT 1,
+            bounds_stale INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (data_type_id, field_name)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS field_statistics_bins (
+            data_type_id INTEGER NOT NULL,
+            field_name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            bin TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (data_type_id, field_name, kind, bin)
+        ) WITHOUT ROWID
+        ''',
+    )
+
+    UPDATE_SQL = '''
+        UPDATE field_statistics
+        SET count = count + ?,
+            null_count = null_count + ?,
+            sum = sum + ?,
+            sum_sq = sum_sq + ?,
+            min = CASE WHEN min IS NULL OR ? < min THEN ? ELSE min END,
+            max = CASE WHEN max IS NULL OR ? > max THEN ? ELSE max END
+        WHERE data_type_id = ? AND field_name = ?
+    '''
+
+    # Новая метка устаревания: повторное устаревание во время фонового
+    # пересчета дает другую метку, и пересчет по старому снимку не применится
+    STALE_SQL = '''
+        UPDATE field_statistics
+        SET min = CASE WHEN ? & 1 THEN NULL ELSE min END,
+            max = CASE WHEN ? & 2 THEN NULL ELSE max END,
+            bounds_stale = ((random() & 1152921504606846975) << 2) | (bounds_stale & 3) | ?
+        WHERE data_type_id = ? AND field_name = ?
+    '''
+
+    BIN_UPSERT_SQL = '''
+        INSERT INTO field_statistics_bins (data_type_id, field_name, kind, bin, count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (data_type_id, field_name, kind, bin)
+        DO UPDATE SET count = count + excluded.count
+    '''
+
+    def create_table_with_cursor(self, cursor):
+        for sql in self.CREATE_SQL:
+            cursor.execute(sql)
+        cursor.execute('PRAGMA table_info(field_statistics)')
+        if 'bounds_stale' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute('ALTER TABLE field_statistics ADD COLUMN bounds_stale INTEGER NOT NULL DEFAULT 0')
+        # Прежний флаг bounds_stale = 1 означал, что устарели оба экстремума
+        cursor.execute(f'UPDATE field_statistics SET bounds_stale = {STALE_MIN | STALE_MAX} WHERE bounds_stale = 1')
+
+    @staticmethod
+    def _tracked(fields: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [f for f in fields if f['field_type'] in NUMERIC_TYPES + CATEGORY_TYPES]
+
+    def _load_heads(self, cursor, data_type_id: int) -> Dict[str, tuple]:
+        """Строки field_statistics справочника: {поле: (тип, count, min, max, values_tracked, bounds_stale)}."""
+        cursor.execute('''
+            SELECT field_name, field_type, count, min, max, values_tracked, bounds_stale
+            FROM field_statistics
+            WHERE data_type_id = ?
+        ''', (data_type_id,))
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+
+    def _is_complete(self, heads: Dict[str, tuple], fields: List[Dict[str, Any]]) -> bool:
+        for field in self._tracked(fields):
+            head = heads.get(field['field_name'])
+            if head is None or head[0] != field['field_type']:
+                return False
+        return True
+
+    def apply_with_cursor(self, cursor, data_type_id: int, fields: List[Dict[str, Any]],
+                          added: Iterable[Dict[str, Any]] = (),
+                          removed: Iterable[Dict[str, Any]] = ()) -> bool:
+        """Учет добавленных и удаленных строк (изменение = удаление старой + добавление новой).
+
+        Вызывается после изменения таблицы данных в той же транзакции.
+        Возвращает False, если сводка для справочника еще не построена.
+        """
+        heads = self._load_heads(cursor, data_type_id)
+        tracked = self._tracked(fields)
+        if not self._is_complete(heads, fields):
+            return False
+
+        added, removed = list(added), list(removed)
+        deltas = []
+        for field in tracked:
+            delta = FieldSummary(field['field_name'], field['field_type'])
+            for row in removed:
+                delta.add(row.get(delta.field_name), -1)
+            for row in added:
+                delta.add(row.get(delta.field_name), 1)
+            deltas.append(delta)
+
+        cursor.executemany(self.UPDATE_SQL, [
+            (d.count, d.null_count, d.total, d.total_sq, d.min, d.min, d.max, d.max,
+             data_type_id, d.field_name)
+            for d in deltas
+        ])
+
+        bin_rows = []
+        shrunk = []
+        for delta in deltas:
+            tracked_values = heads[delta.field_name][4]
+            if delta.numeric or tracked_values:
+                bins = delta.bins()
+                bin_rows += [(data_type_id, delta.field_name, kind, key, count)
+                             for (kind, key), count in bins.items()]
+                if any(count < 0 for count in bins.values()):
+                    shrunk.append(delta.field_name)
+        cursor.executemany(self.BIN_UPSERT_SQL, bin_rows)
+        for field_name in shrunk:
+            cursor.execute('''
+                DELETE FROM field_statistics_bins
+                WHERE data_type_id = ? AND field_name = ? AND count <= 0
+            ''', (data_type_id, field_name))
+
+        self._finish_numeric(cursor, data_type_id, heads, deltas, removed, added)
+        self._limit_values(cursor, data_type_id, heads, deltas)
+        return True
+
+    def _finish_numeric(self, cursor, data_type_id: int, heads: Dict[str, tuple],
+                        deltas: List[FieldSummary], removed: List[Dict[str, Any]],
+                        added_rows: List[Dict[str, Any]]):
+        """Сброс опустевших полей и пометка MIN/MAX устаревшими после удаления крайнего значения.
+
+        Пересчет MIN/MAX - проход по таблице, поэтому в транзакции записи он не
+        выполняется: экстремумы пересчитываются в фоне (см. apply_bounds_with_cursor).
+        """
+        stale = []
+        for delta in deltas:
+            if not delta.numeric or not removed:
+                continue
+            _, count, current_min, current_max, _, bounds_stale = heads[delta.field_name]
+            if count + delta.count == 0:
+                # Пустое поле: экстремумы снова точные (NULL)
+                cursor.execute('''
+                    UPDATE field_statistics
+                    SET sum = 0, sum_sq = 0, min = NULL, max = NULL, bounds_stale = 0
+                    WHERE data_type_id = ? AND field_name = ?
+                ''', (data_type_id, delta.field_name))
+                cursor.execute('''
+                    DELETE FROM field_statistics_bins WHERE data_type_id = ? AND field_name = ?
+                ''', (data_type_id, delta.field_name))
+                continue
+            # Крайнее значение, добавленное снова (изменение записи без изменения
+            # этого поля), экстремум не меняет. Устаревший экстремум - экстремум
+            # добавленных значений, и его сбрасывает любое удаленное значение
+            added = {FieldSummary.number(row.get(delta.field_name)) for row in added_rows}
+            gone = {FieldSummary.number(row.get(delta.field_name)) for row in removed} - added - {None}
+            if not gone:
+                continue
+            sides = 0
+            if bounds_stale & STALE_MIN or current_min in gone:
+                sides |= STALE_MIN
+            if bounds_stale & STALE_MAX or current_max in gone:
+                sides |= STALE_MAX
+            if sides:
+                stale.append((sides, sides, sides, data_type_id, delta.field_name))
+
+        cursor.executemany(self.STALE_SQL, stale)
+
+    def stale_bounds_with_cursor(self, cursor, data_type_id: int) -> Dict[str, int]:
+        """Поля с устаревшими MIN/MAX: {поле: метка устаревания}."""
+        cursor.execute(
+            'SELECT field_name, bounds_stale FROM field_statistics WHERE data_type_id = ? AND bounds_stale',
+            (data_type_id,)
+        )
+        return dict(cursor.fetchall())
+
+    def scan_bounds_with_cursor(self, cursor, data_type_id: int) -> List[tuple]:
+        """Точные MIN/MAX полей с устаревшими экстремумами одним проходом (в снимке чтения).
+
+        Возвращает (поле, метка, min, max) для apply_bounds_with_cursor.
+        """
+        stale = self.stale_bounds_with_cursor(cursor, data_type_id)
+        if not stale:
+            return []
+        names = list(stale)
+        columns = ', '.join(f"MIN({name}), MAX({name})" for name in names)
+        cursor.execute(f"SELECT {columns} FROM data_{data_type_id}")
+        row = cursor.fetchone()
+        return [(name, stale[name], row[i * 2], row[i * 2 + 1]) for i, name in enumerate(names)]
+
+    def apply_bounds_with_cursor(self, cursor, data_type_id: int, scanned: List[tuple]) -> int:
+        """Запись пересчитанных MIN/MAX (в транзакции записи); возвращает число обновленных полей.
+
+        Значения, добавленные после снимка, уже учтены в колонке устаревшего
+        экстремума, поэтому они объединяются с результатом прохода. Поле,
+        экстремумы которого снова устарели после снимка (другая метка), не
+        обновляется.
+        """
+        updated = 0
+        for field_name, token, low, high in scanned:
+            if not token & STALE_MIN:
+                low = None
+            if not token & STALE_MAX:
+                high = None
+            cursor.execute('''
+                UPDATE field_statistics
+                SET min = CASE WHEN ? IS NULL THEN min WHEN min IS NULL OR ? < min THEN ? ELSE min END,
+                    max = CASE WHEN ? IS NULL THEN max WHEN max IS NULL OR ? > max THEN ? ELSE max END,
+                    bounds_stale = 0
+                WHERE data_type_id = ? AND field_name = ? AND bounds_stale = ?
+            ''', (low, low, low, high, high, high, data_type_id, field_name, token))
+            updated += cursor.rowcount
+        return updated
+
+    def _limit_values(self, cursor, data_type_id: int, heads: Dict[str, tuple],
+                      deltas: List[FieldSummary]):
+        """Отключение учета частот текстового поля с слишком большим числом значений."""
+        for delta in deltas:
+            if delta.field_type != 'text' or not heads[delta.field_name][4]:
+                continue
+            if delta.value_counts is not None:
+                cursor.execute('''
+                    SELECT COUNT(*) FROM field_statistics_bins
+                    WHERE data_type_id = ? AND field_name = ? AND kind = ?
+                ''', (data_type_id, delta.field_name, VALUE_BIN))
+                if cursor.fetchone()[0] <= MAX_TRACKED_VALUES:
+                    continue
+            self._drop_values(cursor, data_type_id, delta.field_name)
+
+    def _drop_values(self, cursor, data_type_id: int, field_name: str):
+        cursor.execute('''
+            UPDATE field_statistics SET values_tracked = 0
+            WHERE data_type_id = ? AND field_name = ?
+        ''', (data_type_id, field_name))
+        cursor.execute('''
+            DELETE FROM field_statistics_bins WHERE data_type_id = ? AND field_name = ?
+        ''', (data_type_id, field_name))
+
+    def _save(self, cursor, data_type_id: int, summaries: List[FieldSummary]):
+        """Запись полной сводки полей (с заменой существующей)."""
+        for summary in summaries:
+            cursor.execute('''
+                DELETE FROM field_statistics_bins WHERE data_type_id = ? AND field_name = ?
+            ''', (data_type_id, summary.field_name))
+        cursor.executemany('''
+            INSERT OR REPLACE INTO field_statistics
+                (data_type_id, field_name, field_type, count, null_count, sum, sum_sq,
+                 min, max, values_tracked)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (data_type_id, s.field_name, s.field_type, s.count, s.null_count, s.total, s.total_sq,
+             s.min, s.max, s.numeric or s.value_counts is not None)
+            for s in summaries
+        ])
+        cursor.executemany(self.BIN_UPSERT_SQL, [
+            (data_type_id, s.field_name, kind, key, count)
+            for s in summaries
+            for (kind, key), count in s.bins().items()
+        ])
+
+    def scan_with_cursor(self, cursor, data_type_id: int, fields: List[Dict[str, Any]]) -> List[FieldSummary]:
+        """Полная сводка справочника проходом по таблице без записи (в снимке чтения)."""
+        return self._scan(cursor, data_type_id, self._tracked(fields))
+
+    def replace_with_cursor(self, cursor, data_type_id: int, summaries: List[FieldSummary]):
+        """Замена сводки справочника построенной scan_with_cursor (в транзакции записи)."""
+        self.delete_with_cursor(cursor, data_type_id)
+        self._save(cursor, data_type_id, summaries)
+
+    def _scan(self, cursor, data_type_id: int, fields: List[Dict[str, Any]],
+              fetch_size: int = FETCH_SIZE) -> List[FieldSummary]:
+        """Построение сводки по указанным полям одним проходом по таблице."""
+        summaries = [FieldSummary(f['field_name'], f['field_type']) for f in fields]
+        if not summaries:
+            return summaries
+        cursor.execute(f"SELECT {', '.join(s.field_name for s in summaries)} FROM data_{data_type_id}")
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for summary, column in zip(summaries, zip(*rows)):
+                add = summary.add
+                for value in column:
+                    add(value)
+        return summaries
+
+    def rebuild_with_cursor(self, cursor, data_type_id: int, fields: List[Dict[str, Any]]) -> int:
+        """Полное перестроение сводки справочника (восстановление после сбоев)."""
+        self.delete_with_cursor(cursor, data_type_id)
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"data_{data_type_id}",)
+        )
+        if not cursor.fetchone():
+            return 0
+        summaries = self._scan(cursor, data_type_id, self._tracked(fields))
+        self._save(cursor, data_type_id, summaries)
+        return summaries[0].count + summaries[0].null_count if summaries else 0
+
+    def sync_fields_with_cursor(self, cursor, data_type_id: int, fields: List[Dict[str, Any]],
+                                added_columns: Sequence[str] = ()):
+        """Приведение сводки к новому набору полей после миграции таблицы.
+
+        Строки удаленных полей удаляются. Колонки, добавленные через ALTER TABLE,
+        заполнены NULL, поэтому их сводка строится без чтения таблицы; остальные
+        новые или изменившие тип поля пересчитываются проходом по таблице.
+        """
+        tracked = self._tracked(fields)
+        names = [f['field_name'] for f in tracked]
+        placeholders = ', '.join('?' for _ in names)
+        for table in ('field_statistics', 'field_statistics_bins'):
+            cursor.execute(
+                f"DELETE FROM {table} WHERE data_type_id = ? AND field_name NOT IN ({placeholders})",
+                [data_type_id] + names
+            )
+
+        cursor.execute('''
+            SELECT field_name, field_type, count + null_count
+            FROM field_statistics
+            WHERE data_type_id = ?
+        ''', (data_type_id,))
+        existing = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        if existing:
+            rows = next(iter(existing.values()))[1]
+        else:
+            cursor.execute(f"SELECT COUNT(*) FROM data_{data_type_id}")
+            rows = cursor.fetchone()[0]
+            if rows:
+                # Сводки не было и таблица не пуста - построится при первом чтении
+                return
+
+        fresh, rescan = [], []
+        for field in tracked:
+            current = existing.get(field['field_name'])
+            if current is not None and current[0] == field['field_type']:
+                continue
+            if field['field_name'] in added_columns or rows == 0:
+                summary = FieldSummary(field['field_name'], field['field_type'])
+                summary.null_count = rows
+                fresh.append(summary)
+            else:
+                rescan.append(field)
+        self._save(cursor, data_type_id, fresh + self._scan(cursor, data_type_id, rescan))
+
+    def delete_with_cursor(self, cursor, data_type_id: int):
+        for table in ('field_statistics', 'field_statistics_bins'):
+            cursor.execute(f"DELETE FROM {table} WHERE data_type_id = ?", (data_type_id,))
+
+    def _load(self, cursor, data_type_id: int) -> Dict[str, FieldSummary]:
+        cursor.execute('''
+            SELECT field_name, field_type, count, null_count, sum, sum_sq, min, max, values_tracked, bounds_stale
+            FROM field_statistics
+            WHERE data_type_id = ?
+        ''', (data_type_id,))
+        summaries = {}
+        stale_sides = {}
+        for row in cursor.fetchall():
+            summary = FieldSummary(row[0], row[1])
+            summary.count, summary.null_count, summary.total, summary.total_sq = row[2:6]
+            summary.min, summary.max = row[6], row[7]
+            stale_sides[row[0]] = row[9] & (STALE_MIN | STALE_MAX)
+            if summary.value_counts is not None and not row[8]:
+                summary.value_counts = None
+            summaries[row[0]] = summary
+
+        cursor.execute('''
+            SELECT field_name, kind, bin, count
+            FROM field_statistics_bins
+            WHERE data_type_id = ?
+        ''', (data_type_id,))
+        sketch_bins: Dict[str, Dict[str, int]] = {}
+        for field_name, kind, key, count in cursor.fetchall():
+            summary = summaries.get(field_name)
+            if summary is None:
+                continue
+            if kind == SKETCH_BIN:
+                sketch_bins.setdefault(field_name, {})[key] = count
+            elif summary.value_counts is not None:
+                summary.value_counts[key] = count
+        for field_name, bins in sketch_bins.items():
+            summaries[field_name].sketch = QuantileSketch.from_bins(bins, SKETCH_ACCURACY)
+        for field_name, sides in stale_sides.items():
+            if sides and summaries[field_name].count:
+                self._estimate_bounds(summaries[field_name], sides)
+        return summaries
+
+    @staticmethod
+    def _estimate_bounds(summary: FieldSummary, sides: int):
+        """Оценка устаревших MIN/MAX по крайним корзинам скетча и добавленным значениям."""
+        low, high = summary.sketch.quantile(0), summary.sketch.quantile(1)
+        if low is None:
+            return
+        summary.bounds_approximate = True
+        if sides & STALE_MIN:
+            summary.min = low if summary.min is None else min(low, summary.min)
+        if sides & STALE_MAX:
+            summary.max = high if summary.max is None else max(high, summary.max)
+
+    def is_complete_with_cursor(self, cursor, data_type_id: int, fields: List[Dict[str, Any]]) -> bool:
+        """Есть ли сводка по всем полям справочника."""
+        return self._is_complete(self._load_heads(cursor, data_type_id), fields)
+
+    def get_statistics_with_cursor(self, cursor, data_type_id: int, fields: List[Dict[str, Any]],
+                                   percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> Dict[str, Any]:
+        """Статистика из готовой сводки (только чтение): время ответа не зависит от числа записей."""
+        summaries = self._load(cursor, data_type_id)
+        return {
+            f['field_name']: summaries[f['field_name']].result(percentiles)
+            for f in self._tracked(fields)
+        }
@@ -0,0 +1,74 @@
+"""Фоновое обновление сводной статистики справочников."""
+
+import queue
+import threading
+from typing import Callable, Dict, Any, Optional, Set
+
+
+class SummaryRefresher:
+    """Поток, пересчитывающий устаревшие MIN/MAX и недостающие сводки.
+
+    Чтение статистики не пишет в базу: оно только ставит справочник в
+    очередь (повторная постановка справочника, уже ждущего в очереди,
+    ничего не делает). refresh(data_type_id) выполняет проход по снимку
+    чтения и короткую транзакцию записи; False - сводку обновить не
+    удалось (данные изменились во время прохода), справочник будет
+    поставлен в очередь при следующем чтении.
+    """
+
+    def __init__(self, refresh: Callable[[int], bool]):
+        self._refresh = refresh
+        self._queue: 'queue.Queue[int]' = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pending: Set[int] = set()
+        self._scheduled = 0
+        self._completed = 0
+        self._retries = 0
+        self._failed = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='datavue-summary-refresh', daemon=True)
+                self._thread.start()
+
+    def schedule(self, data_type_id: int):
+        """Постановка справочника в очередь обновления сводки."""
+        with self._lock:
+            if data_type_id in self._pending:
+                return
+            self._pending.add(data_type_id)
+            self._scheduled += 1
+        self._start()
+        self._queue.put(data_type_id)
+
+    def _run(self):
+        while True:
+            data_type_id = self._queue.get()
+            with self._lock:
+                # Изменения во время обновления снова поставят справочник в очередь
+                self._pending.discard(data_type_id)
+            try:
+                done = self._refresh(data_type_id)
+            except Exception as e:
+                print(f"⚠️  Ошибка обновления сводной статистики data_{data_type_id}: {e}")
+                with self._lock:
+                    self._failed += 1
+                continue
+            with self._lock:
+                if done:
+                    self._completed += 1
+                else:
+                    self._retries += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики обновлений сводки."""
+        with self._lock:
+            return {
+                'queued': len(self._pending),
+                'scheduled': self._scheduled,
+                'completed': self._completed,
+                'retries': self._retries,
+                'failed': self._failed
+            }